@@ -0,0 +1,388 @@
+"""
+Materialized analytics rollups, updated when a session ends and rebuildable at any time
+    error_rollup     one row per (patient, exercise, error), from session_errors
+    daily_activity   one row per (patient, day, exercise), from finished sessions
+    activity_streaks current / longest run of active days per patient
+    patient_summary  lifetime totals per patient      } for the doctor's
+    weekly_activity  one row per (patient, Monday)    } cohort view
+
+    python analytics.py --rebuild [--patient ID]
+"""
+
+import argparse
+import sys
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+CALENDAR_FIELDS = ['sessions', 'total_reps', 'correct_reps', 'duration_seconds']
+
+
+def record_session_errors(cursor, patient_id: int, exercise_name: str, error_counts: Dict[str, int], seen_at: str):
+    """Add one finished session's errors to the rollup; run in the session's own transaction"""
+    cursor.executemany("""
+        INSERT INTO error_rollup (patient_id, exercise_name, error_name, total_count, session_count, last_seen)
+        VALUES (?, ?, ?, ?, 1, ?)
+        ON CONFLICT (patient_id, exercise_name, error_name) DO UPDATE SET
+            total_count = total_count + excluded.total_count,
+            session_count = session_count + 1,
+            last_seen = MAX(last_seen, excluded.last_seen)
+    """, [(patient_id, exercise_name, error_name, count, seen_at) for error_name, count in error_counts.items()])
+
+
+def rebuild_error_rollup(cursor, patient_id: Optional[int] = None) -> int:
+    """Recompute the rollup (for one patient or everyone) from session_errors; returns the rows written"""
+    if patient_id is None:
+        where, params = "", ()
+        cursor.execute("DELETE FROM error_rollup")
+    else:
+        where, params = "WHERE s.patient_id = ?", (patient_id,)
+        cursor.execute("DELETE FROM error_rollup WHERE patient_id = ?", params)
+    cursor.execute(f"""
+        INSERT INTO error_rollup (patient_id, exercise_name, error_name, total_count, session_count, last_seen)
+        SELECT s.patient_id, s.exercise_name, se.error_name,
+               SUM(se.count), COUNT(DISTINCT s.id), MAX(s.start_time)
+        FROM session_errors se
+        JOIN sessions s ON se.session_id = s.id
+        {where}
+        GROUP BY s.patient_id, s.exercise_name, se.error_name
+    """, params)
+    return cursor.rowcount
+
+
+def load_error_rollup(cursor, patient_id: int) -> List[tuple]:
+    """(exercise_name, error_name, total_count, session_count, last_seen) rows of one patient"""
+    cursor.execute("""
+        SELECT exercise_name, error_name, total_count, session_count, last_seen
+        FROM error_rollup
+        WHERE patient_id = ?
+        ORDER BY exercise_name, total_count DESC
+    """, (patient_id,))
+    return cursor.fetchall()
+
+
+# ============= DAILY ACTIVITY =============
+
+def record_daily_activity(cursor, patient_id: int, day: str, exercise_name: str,
+                          total_reps: int, correct_reps: int, duration_seconds: int):
+    """Add one finished session to its day; run in the session's own transaction"""
+    cursor.execute("""
+        INSERT INTO daily_activity (patient_id, day, exercise_name, sessions, total_reps, correct_reps, duration_seconds)
+        VALUES (?, ?, ?, 1, ?, ?, ?)
+        ON CONFLICT (patient_id, day, exercise_name) DO UPDATE SET
+            sessions = sessions + 1,
+            total_reps = total_reps + excluded.total_reps,
+            correct_reps = correct_reps + excluded.correct_reps,
+            duration_seconds = duration_seconds + excluded.duration_seconds
+    """, (patient_id, day, exercise_name, total_reps, correct_reps, duration_seconds))
+    cursor.execute("""
+        INSERT INTO patient_summary (patient_id, sessions, total_reps, correct_reps, duration_seconds, first_day, last_day)
+        VALUES (?, 1, ?, ?, ?, ?, ?)
+        ON CONFLICT (patient_id) DO UPDATE SET
+            sessions = sessions + 1,
+            total_reps = total_reps + excluded.total_reps,
+            correct_reps = correct_reps + excluded.correct_reps,
+            duration_seconds = duration_seconds + excluded.duration_seconds,
+            first_day = MIN(first_day, excluded.first_day),
+            last_day = MAX(last_day, excluded.last_day)
+    """, (patient_id, total_reps, correct_reps, duration_seconds, day, day))
+    cursor.execute("""
+        INSERT INTO weekly_activity (patient_id, week_start, sessions, total_reps, correct_reps)
+        VALUES (?, ?, 1, ?, ?)
+        ON CONFLICT (patient_id, week_start) DO UPDATE SET
+            sessions = sessions + 1,
+            total_reps = total_reps + excluded.total_reps,
+            correct_reps = correct_reps + excluded.correct_reps
+    """, (patient_id, week_start(date.fromisoformat(day)).isoformat(), total_reps, correct_reps))
+    
+    row = cursor.execute(
+        "SELECT last_day, current_streak, longest_streak FROM activity_streaks WHERE patient_id = ?", (patient_id,)
+    ).fetchone()
+    if row is None:
+        current = longest = 1
+    else:
+        last_day, current, longest = row
+        if day == last_day:
+            return
+        if day < last_day:  # Session from an earlier day finished late - recount
+            rebuild_streaks(cursor, patient_id)
+            return
+        current = current + 1 if date.fromisoformat(day) - date.fromisoformat(last_day) == timedelta(days=1) else 1
+        longest = max(longest, current)
+    cursor.execute("""
+        INSERT OR REPLACE INTO activity_streaks (patient_id, last_day, current_streak, longest_streak)
+        VALUES (?, ?, ?, ?)
+    """, (patient_id, day, current, longest))
+
+
+def week_start(day: date) -> date:
+    """Monday of the day's week"""
+    return day - timedelta(days=day.weekday())
+
+
+def compute_streaks(days: List[str]) -> Tuple[int, int]:
+    """(streak ending at the last day, longest streak) of sorted, distinct ISO days"""
+    current = longest = 0
+    previous = None
+    for day in days:
+        today = date.fromisoformat(day)
+        current = current + 1 if previous is not None and today - previous == timedelta(days=1) else 1
+        longest = max(longest, current)
+        previous = today
+    return current, longest
+
+
+def rebuild_streaks(cursor, patient_id: int):
+    days = [row[0] for row in cursor.execute(
+        "SELECT DISTINCT day FROM daily_activity WHERE patient_id = ? ORDER BY day", (patient_id,)
+    )]
+    cursor.execute("DELETE FROM activity_streaks WHERE patient_id = ?", (patient_id,))
+    if days:
+        current, longest = compute_streaks(days)
+        cursor.execute("""
+            INSERT INTO activity_streaks (patient_id, last_day, current_streak, longest_streak)
+            VALUES (?, ?, ?, ?)
+        """, (patient_id, days[-1], current, longest))
+
+
+def rebuild_daily_activity(cursor, patient_id: Optional[int] = None) -> int:
+    """Recompute daily_activity and streaks (for one patient or everyone) from finished sessions"""
+    if patient_id is None:
+        where, params = "", ()
+        cursor.execute("DELETE FROM daily_activity")
+    else:
+        where, params = "AND patient_id = ?", (patient_id,)
+        cursor.execute("DELETE FROM daily_activity WHERE patient_id = ?", params)
+    cursor.execute(f"""
+        INSERT INTO daily_activity (patient_id, day, exercise_name, sessions, total_reps, correct_reps, duration_seconds)
+        SELECT patient_id, substr(start_time, 1, 10), exercise_name,
+               COUNT(*), SUM(total_reps), SUM(correct_reps), SUM(duration_seconds)
+        FROM sessions
+        WHERE end_time IS NOT NULL {where}
+        GROUP BY patient_id, substr(start_time, 1, 10), exercise_name
+    """, params)
+    rows = cursor.rowcount
+    
+    if patient_id is None:
+        cursor.execute("DELETE FROM activity_streaks")
+        patients = [row[0] for row in cursor.execute("SELECT DISTINCT patient_id FROM daily_activity").fetchall()]
+    else:
+        patients = [patient_id]
+    for patient in patients:
+        rebuild_streaks(cursor, patient)
+    return rows
+
+
+def rebuild_cohort_summary(cursor, patient_id: Optional[int] = None):
+    """Recompute patient_summary and weekly_activity from daily_activity; run after rebuild_daily_activity"""
+    if patient_id is None:
+        where, params = "", ()
+        cursor.execute("DELETE FROM patient_summary")
+        cursor.execute("DELETE FROM weekly_activity")
+    else:
+        where, params = "WHERE patient_id = ?", (patient_id,)
+        cursor.execute("DELETE FROM patient_summary WHERE patient_id = ?", params)
+        cursor.execute("DELETE FROM weekly_activity WHERE patient_id = ?", params)
+    cursor.execute(f"""
+        INSERT INTO patient_summary (patient_id, sessions, total_reps, correct_reps, duration_seconds, first_day, last_day)
+        SELECT patient_id, SUM(sessions), SUM(total_reps), SUM(correct_reps), SUM(duration_seconds), MIN(day), MAX(day)
+        FROM daily_activity
+        {where}
+        GROUP BY patient_id
+    """, params)
+    # 'weekday 0' moves to the next Sunday (or stays on one); six days back is that week's Monday
+    cursor.execute(f"""
+        INSERT INTO weekly_activity (patient_id, week_start, sessions, total_reps, correct_reps)
+        SELECT patient_id, date(day, 'weekday 0', '-6 days') AS week, SUM(sessions), SUM(total_reps), SUM(correct_reps)
+        FROM daily_activity
+        {where}
+        GROUP BY patient_id, week
+    """, params)
+
+
+def load_calendar(cursor, patient_id: int, start: date, end: date) -> Dict:
+    """Day-indexed activity between start and end (inclusive): one range scan of the primary key"""
+    days = [[0] * len(CALENDAR_FIELDS) for _ in range((end - start).days + 1)]
+    exercises: Dict[str, List[List[int]]] = {}
+    cursor.execute("""
+        SELECT day, exercise_name, sessions, total_reps, correct_reps, duration_seconds
+        FROM daily_activity
+        WHERE patient_id = ? AND day BETWEEN ? AND ?
+    """, (patient_id, start.isoformat(), end.isoformat()))
+    for day, exercise_name, *values in cursor.fetchall():
+        index = (date.fromisoformat(day) - start).days
+        totals = days[index]
+        for i, value in enumerate(values):
+            totals[i] += value or 0
+        exercises.setdefault(exercise_name, []).append([index, *values])
+    
+    row = cursor.execute(
+        "SELECT last_day, current_streak, longest_streak FROM activity_streaks WHERE patient_id = ?", (patient_id,)
+    ).fetchone()
+    last_day, current, longest = row if row else (None, 0, 0)
+    # A streak is still alive until a full day passes without a session
+    if last_day is not None and date.today() - date.fromisoformat(last_day) > timedelta(days=1):
+        current = 0
+    
+    return {
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'fields': CALENDAR_FIELDS,
+        'days': days,
+        'exercises': {name: sorted(rows) for name, rows in exercises.items()},
+        'current_streak': current,
+        'longest_streak': longest,
+        'last_active_day': last_day,
+    }
+
+
+def first_active_day(cursor, patient_id: int) -> Optional[str]:
+    row = cursor.execute("SELECT MIN(day) FROM daily_activity WHERE patient_id = ?", (patient_id,)).fetchone()
+    return row[0] if row else None
+
+
+# ============= DOCTOR COHORT =============
+
+def accuracy(correct_reps, total_reps) -> Optional[float]:
+    return round(correct_reps / total_reps * 100, 1) if total_reps else None
+
+
+def load_cohort(cursor, doctor_id: int, today: date, weeks: int, top_errors: int = 3) -> Dict:
+    """
+    Per-patient and cohort-wide activity of a doctor's patients, from the rollups only
+    Four queries, each driven by idx_users_doctor_role and a primary-key range of a
+    rollup, so the cost grows with the number of patients, never with their history.
+    accuracy_trend[i] is the week starting week_starts[i] (Mondays, oldest first; the last is this week)
+    """
+    since_7d = (today - timedelta(days=6)).isoformat()
+    since_30d = (today - timedelta(days=29)).isoformat()
+    week_starts = [(week_start(today) - timedelta(weeks=weeks - 1 - i)).isoformat() for i in range(weeks)]
+    week_index = {week: i for i, week in enumerate(week_starts)}
+    
+    patients = {}
+    cursor.execute("""
+        SELECT u.id, u.full_name, ps.sessions, ps.total_reps, ps.correct_reps, ps.duration_seconds, ps.last_day
+        FROM users u
+        LEFT JOIN patient_summary ps ON ps.patient_id = u.id
+        WHERE u.role = 'patient' AND u.doctor_id = ?
+        ORDER BY u.full_name
+    """, (doctor_id,))
+    for patient_id, full_name, sessions, total_reps, correct_reps, duration, last_day in cursor.fetchall():
+        patients[patient_id] = {
+            'id': patient_id,
+            'full_name': full_name,
+            'total_sessions': sessions or 0,
+            'total_reps': total_reps or 0,
+            'correct_reps': correct_reps or 0,
+            'duration_seconds': duration or 0,
+            'accuracy': accuracy(correct_reps, total_reps),
+            'last_active_day': last_day,
+            'sessions_7d': 0,
+            'sessions_30d': 0,
+            'active_days_30d': 0,
+            'reps_30d': 0,
+            'accuracy_trend': [None] * weeks,
+            'top_errors': [],
+        }
+    
+    # Last 7 / 30 days
+    cursor.execute("""
+        SELECT u.id,
+               SUM(CASE WHEN da.day >= ? THEN da.sessions ELSE 0 END),
+               SUM(da.sessions), COUNT(DISTINCT da.day), SUM(da.total_reps)
+        FROM users u
+        JOIN daily_activity da ON da.patient_id = u.id AND da.day BETWEEN ? AND ?
+        WHERE u.role = 'patient' AND u.doctor_id = ?
+        GROUP BY u.id
+    """, (since_7d, since_30d, today.isoformat(), doctor_id))
+    for patient_id, sessions_7d, sessions_30d, active_days, reps in cursor.fetchall():
+        patients[patient_id].update(sessions_7d=sessions_7d, sessions_30d=sessions_30d,
+                                    active_days_30d=active_days, reps_30d=reps)
+    
+    # Weekly accuracy, per patient and for the whole cohort
+    cohort_weeks = [[0, 0] for _ in range(weeks)]
+    cursor.execute("""
+        SELECT u.id, wa.week_start, wa.correct_reps, wa.total_reps
+        FROM users u
+        JOIN weekly_activity wa ON wa.patient_id = u.id AND wa.week_start BETWEEN ? AND ?
+        WHERE u.role = 'patient' AND u.doctor_id = ?
+    """, (week_starts[0], week_starts[-1], doctor_id))
+    for patient_id, week, correct_reps, total_reps in cursor.fetchall():
+        index = week_index[week]
+        patients[patient_id]['accuracy_trend'][index] = accuracy(correct_reps, total_reps)
+        cohort_weeks[index][0] += correct_reps or 0
+        cohort_weeks[index][1] += total_reps or 0
+    
+    # Most frequent errors of all time, summed over exercises
+    cohort_errors: Dict[str, List[int]] = {}
+    cursor.execute("""
+        SELECT u.id, er.error_name, SUM(er.total_count)
+        FROM users u
+        JOIN error_rollup er ON er.patient_id = u.id
+        WHERE u.role = 'patient' AND u.doctor_id = ?
+        GROUP BY u.id, er.error_name
+    """, (doctor_id,))
+    for patient_id, error_name, count in cursor.fetchall():
+        patients[patient_id]['top_errors'].append({'error_name': error_name, 'total_count': count})
+        totals = cohort_errors.setdefault(error_name, [0, 0])
+        totals[0] += count
+        totals[1] += 1
+    for patient in patients.values():
+        patient['top_errors'] = sorted(patient['top_errors'], key=lambda e: -e['total_count'])[:top_errors]
+    
+    rows = list(patients.values())
+    total_reps = sum(p['total_reps'] for p in rows)
+    return {
+        'today': today.isoformat(),
+        'week_starts': week_starts,
+        'cohort': {
+            'patients': len(rows),
+            'active_patients_7d': sum(1 for p in rows if p['sessions_7d']),
+            'active_patients_30d': sum(1 for p in rows if p['sessions_30d']),
+            'sessions_7d': sum(p['sessions_7d'] for p in rows),
+            'sessions_30d': sum(p['sessions_30d'] for p in rows),
+            'total_sessions': sum(p['total_sessions'] for p in rows),
+            'total_reps': total_reps,
+            'reps_30d': sum(p['reps_30d'] for p in rows),
+            'accuracy': accuracy(sum(p['correct_reps'] for p in rows), total_reps),
+            'accuracy_trend': [accuracy(correct, total) for correct, total in cohort_weeks],
+            'top_errors': [
+                {'error_name': name, 'total_count': count, 'patients': affected}
+                for name, (count, affected) in sorted(cohort_errors.items(), key=lambda e: -e[1][0])[:top_errors * 2]
+            ],
+        },
+        'patients': rows,
+    }
+
+
+def main(argv=None):
+    from db import Database
+
+    parser = argparse.ArgumentParser(description="Rebuild materialized analytics")
+    parser.add_argument("--db", default="rehab_v3.db", help="database file (default: rehab_v3.db)")
+    parser.add_argument("--rebuild", action="store_true", help="recompute error_rollup, daily_activity, streaks and the cohort summary")
+    parser.add_argument("--patient", type=int, help="only rebuild this patient")
+    args = parser.parse_args(argv)
+    if not args.rebuild:
+        parser.print_help()
+        return 1
+
+    db = Database(Path(args.db), size=1, read_size=1)
+    conn = db.connect()
+    try:
+        cursor = conn.cursor()
+        error_rows = rebuild_error_rollup(cursor, args.patient)
+        activity_rows = rebuild_daily_activity(cursor, args.patient)
+        rebuild_cohort_summary(cursor, args.patient)
+        conn.commit()
+        scope = f"patient {args.patient}" if args.patient is not None else "all patients"
+        print(f"✅ error_rollup rebuilt for {scope}: {error_rows} rows")
+        print(f"✅ daily_activity, streaks and cohort summary rebuilt for {scope}: {activity_rows} rows")
+        return 0
+    finally:
+        conn.close()
+        db.close_all()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+"""
+SQLite connection pool shared by the API, the frame writer and manage_db.py
+
+Connections are opened once and reused: connect() hands out an idle
+connection and conn.close() puts it back, so existing
+`conn = connect() ... conn.close()` code keeps working unchanged.
+Every connection runs in WAL mode with tuned pragmas, and every
+statement's duration is passed to the registered query hooks.
+
+Async code never touches SQLite directly: `await db.run(fn)` runs
+fn(conn) on a small dedicated thread pool, so a slow query cannot stall
+the event loop (and with it every live exercise WebSocket).
+"""
+
+import asyncio
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Optional, TypeVar
+
+QueryHook = Callable[[str, str, float], None]  # pool name, SQL, milliseconds
+OperationHook = Callable[[str, float, float], None]  # operation name, ms waiting for a thread, ms running
+T = TypeVar('T')
+
+DEFAULT_PRAGMAS = {
+    'synchronous': 'NORMAL',     # Safe with WAL; commits no longer fsync the main database
+    'cache_size': -16000,        # 16 MB page cache per connection
+    'mmap_size': 268435456,      # Read pages through a 256 MB memory map
+    'temp_store': 'MEMORY',
+}
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.connection.pool.observe(sql, (time.perf_counter() - start) * 1000)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.connection.pool.observe(sql, (time.perf_counter() - start) * 1000)
+
+    def executescript(self, sql_script):
+        start = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            self.connection.pool.observe(sql_script, (time.perf_counter() - start) * 1000)
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() returns it to its pool"""
+
+    pool: "ConnectionPool"
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    # Connection.execute() does not go through cursor(), so route it explicitly to get timings
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+    def close(self):
+        self.pool.release(self)
+
+    def dispose(self):
+        super().close()
+
+
+class ConnectionPool:
+    """
+    Reusable connections to one database file
+
+    Up to `size` idle connections are kept; connect() opens a new one when
+    none is idle, so a connection that is never closed (an exception
+    between connect and close) only costs a reopen, never a deadlock.
+    Read-only pools open the file with mode=ro and query_only, for
+    analytics that must never write. Each connection keeps its own
+    prepared-statement cache (`cached_statements`), which survives
+    across requests because the connection does.
+    """
+
+    def __init__(self, db_path: Path, size: int = 8, readonly: bool = False, name: Optional[str] = None,
+                 busy_timeout: float = 5.0, cached_statements: int = 256, pragmas: Optional[dict] = None):
+        self.db_path = Path(db_path)
+        self.size = size
+        self.readonly = readonly
+        self.name = name or ('read' if readonly else 'write')
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self.pragmas = dict(DEFAULT_PRAGMAS, **(pragmas or {}))
+        self.hooks: List[QueryHook] = []
+        self.opened = 0
+        self._idle: List[PooledConnection] = []
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook: QueryHook):
+        self.hooks.append(hook)
+
+    def observe(self, sql: str, ms: float):
+        for hook in self.hooks:
+            hook(self.name, sql, ms)
+
+    def _open(self) -> PooledConnection:
+        if self.readonly:
+            target, uri = f'{self.db_path.resolve().as_uri()}?mode=ro', True
+        else:
+            target, uri = str(self.db_path), False
+        conn = sqlite3.connect(
+            target, uri=uri, timeout=self.busy_timeout, factory=PooledConnection,
+            cached_statements=self.cached_statements, check_same_thread=False
+        )
+        conn.pool = self
+        if not self.readonly:
+            conn.execute("PRAGMA journal_mode=WAL")  # Persistent: readers no longer wait for writers
+        for pragma, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {pragma}={value}")
+        if self.readonly:
+            conn.execute("PRAGMA query_only=1")
+        self.opened += 1
+        return conn
+
+    def connect(self) -> PooledConnection:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._open()
+
+    def release(self, conn: PooledConnection):
+        if conn.in_transaction:
+            conn.rollback()  # Never hand out a connection with someone else's uncommitted writes
+        conn.row_factory = None
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.dispose()
+
+    @property
+    def idle(self) -> int:
+        return len(self._idle)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.dispose()
+
+
+def operation_name(fn: Callable) -> str:
+    """Metrics label for a database operation: the enclosing endpoint for nested functions"""
+    return fn.__qualname__.split('.<locals>')[0]
+
+
+class Database:
+    """
+    Read-write and read-only pools for one database file, plus the
+    bounded thread pool that async code runs its database work on
+    """
+
+    def __init__(self, db_path: Path, size: int = 8, read_size: int = 4, workers: int = 4, **options):
+        self.db_path = Path(db_path)
+        self.pool = ConnectionPool(db_path, size, **options)
+        self.read_pool = ConnectionPool(db_path, read_size, readonly=True, **options)
+        self.workers = workers
+        self.operation_hooks: List[OperationHook] = []
+        self.queued = 0  # Operations submitted and not yet started
+        self._queued_lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _submit(self, name: str, fn: Callable[..., T], *args) -> "asyncio.Future[T]":
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='db')
+        submitted = time.perf_counter()
+        with self._queued_lock:
+            self.queued += 1
+
+        def timed():
+            started = time.perf_counter()
+            with self._queued_lock:
+                self.queued -= 1
+            try:
+                return fn(*args)
+            finally:
+                done = time.perf_counter()
+                for hook in self.operation_hooks:
+                    hook(name, (started - submitted) * 1000, (done - started) * 1000)
+
+        return asyncio.get_running_loop().run_in_executor(self._executor, timed)
+
+    async def run(self, fn: Callable[..., T], *args, readonly: bool = False) -> T:
+        """Await fn(conn, *args) on a database thread; the connection is returned to its pool afterwards"""
+        def with_connection():
+            conn = self.connect(readonly)
+            try:
+                return fn(conn, *args)
+            finally:
+                conn.close()
+
+        return await self._submit(operation_name(fn), with_connection)
+
+    async def call(self, fn: Callable[..., T], *args) -> T:
+        """Await a blocking function that opens its own connections (e.g. the session registry)"""
+        return await self._submit(operation_name(fn), fn, *args)
+
+    def add_operation_hook(self, hook: OperationHook):
+        self.operation_hooks.append(hook)
+
+    def connect(self, readonly: bool = False) -> PooledConnection:
+        if readonly:
+            if not self.db_path.exists():  # mode=ro cannot create the file
+                self.pool.connect().close()
+            return self.read_pool.connect()
+        return self.pool.connect()
+
+    def add_hook(self, hook: QueryHook):
+        self.pool.add_hook(hook)
+        self.read_pool.add_hook(hook)
+
+    def close_all(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.pool.close_all()
+        self.read_pool.close_all()
+
+
+def statement_kind(sql: str) -> str:
+    """First keyword of a statement (SELECT, INSERT, ...), used as a metrics label"""
+    words = sql.lstrip().split(None, 1)
+    return words[0].upper() if words else ''
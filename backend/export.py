@@ -0,0 +1,302 @@
+"""
+Streaming bulk export of sessions, session errors and per-frame data
+
+Rows are read in chunks of CHUNK_ROWS through one cursor (SQLite steps it
+lazily, nothing is fetched ahead) and encoded chunk by chunk, so memory
+stays constant however large the database is. Frames are decoded one
+time-series chunk at a time.
+
+    python export.py sessions --format csv --patient 2 --from 2026-01-01 -o sessions.csv
+    python export.py errors --format ndjson --doctor 1 --exercise squat
+    python export.py frames --format parquet --patient 2 -o frames.parquet   (needs pyarrow)
+"""
+
+import argparse
+import csv
+import io
+import json
+import math
+import sys
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from timeseries import BASE_COLUMNS, open_series
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = None
+
+CHUNK_ROWS = 1000
+
+# Columns of each dataset and their types ('int', 'float', 'str', or 'json' for lists / objects)
+DATASETS: Dict[str, List[Tuple[str, str]]] = {
+    'sessions': [
+        ('id', 'int'), ('patient_id', 'int'), ('exercise_name', 'str'), ('start_time', 'str'), ('end_time', 'str'),
+        ('total_reps', 'int'), ('correct_reps', 'int'), ('accuracy', 'float'), ('duration_seconds', 'int'),
+    ],
+    'errors': [
+        ('session_id', 'int'), ('patient_id', 'int'), ('exercise_name', 'str'), ('start_time', 'str'),
+        ('error_name', 'str'), ('count', 'int'), ('severity', 'str'),
+    ],
+    'frames': [
+        ('session_id', 'int'), ('patient_id', 'int'), ('exercise_name', 'str'), ('frame', 'int'),
+        ('t', 'float'), ('rep_count', 'int'), ('state', 'str'), ('errors', 'json'), ('angles', 'json'),
+    ],
+}
+FORMATS = {
+    'csv': 'text/csv',  # Starlette adds the charset
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+class ExportFilter(NamedTuple):
+    patient_id: Optional[int] = None
+    doctor_id: Optional[int] = None
+    exercise_name: Optional[str] = None
+    start: Optional[date] = None  # Sessions started on or after this day
+    end: Optional[date] = None  # ... and on or before this day
+
+
+def available_formats() -> List[str]:
+    return [name for name in FORMATS if name != 'parquet' or pa is not None]
+
+
+def _session_filter(filters: ExportFilter) -> Tuple[str, list]:
+    """WHERE clause over `sessions s`; every combination is a range of idx_sessions_patient_start"""
+    conditions, params = [], []
+    if filters.patient_id is not None:
+        conditions.append("s.patient_id = ?")
+        params.append(filters.patient_id)
+    if filters.doctor_id is not None:
+        conditions.append("s.patient_id IN (SELECT id FROM users WHERE role = 'patient' AND doctor_id = ?)")
+        params.append(filters.doctor_id)
+    if filters.exercise_name is not None:
+        conditions.append("s.exercise_name = ?")
+        params.append(filters.exercise_name)
+    if filters.start is not None:
+        conditions.append("s.start_time >= ?")
+        params.append(filters.start.isoformat())
+    if filters.end is not None:
+        conditions.append("s.start_time < ?")
+        params.append((filters.end + timedelta(days=1)).isoformat())
+    return ("WHERE " + " AND ".join(conditions)) if conditions else "", params
+
+
+def _chunks(cursor, chunk_rows: int) -> Iterator[List[tuple]]:
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                return
+            yield rows
+    finally:
+        cursor.close()  # Also when the consumer stops early, so no SELECT stays open on the connection
+
+
+def iter_sessions(conn, filters: ExportFilter, chunk_rows: int = CHUNK_ROWS) -> Iterator[List[tuple]]:
+    where, params = _session_filter(filters)
+    cursor = conn.execute(f"""
+        SELECT s.id, s.patient_id, s.exercise_name, s.start_time, s.end_time,
+               s.total_reps, s.correct_reps, s.accuracy, s.duration_seconds
+        FROM sessions s
+        {where}
+        ORDER BY s.patient_id, s.start_time, s.id
+    """, params)
+    yield from _chunks(cursor, chunk_rows)
+
+
+def iter_errors(conn, filters: ExportFilter, chunk_rows: int = CHUNK_ROWS) -> Iterator[List[tuple]]:
+    where, params = _session_filter(filters)
+    cursor = conn.execute(f"""
+        SELECT se.session_id, s.patient_id, s.exercise_name, s.start_time, se.error_name, se.count, se.severity
+        FROM sessions s
+        JOIN session_errors se ON se.session_id = s.id
+        {where}
+        ORDER BY s.patient_id, s.start_time, s.id, se.id
+    """, params)
+    yield from _chunks(cursor, chunk_rows)
+
+
+def iter_frames(conn, filters: ExportFilter, chunk_rows: int = CHUNK_ROWS) -> Iterator[List[tuple]]:
+    """One row per recorded frame, from session_timeseries (sessions without a series are skipped)"""
+    where, params = _session_filter(filters)
+    sessions = _chunks(conn.execute(f"""
+        SELECT s.id, s.patient_id, s.exercise_name
+        FROM sessions s
+        {where}
+        ORDER BY s.patient_id, s.start_time, s.id
+    """, params), chunk_rows)
+    rows: List[tuple] = []
+    try:
+        for session_ids in sessions:
+            for session_id, patient_id, exercise_name in session_ids:
+                reader = open_series(conn, session_id)
+                if reader is None:
+                    continue
+                states = reader.header['state_codes']
+                angle_names = [name for name in reader.columns if name not in BASE_COLUMNS]
+                frame = 0
+                for chunk in reader.iter_chunks():
+                    angles = [chunk[name].tolist() for name in angle_names]
+                    for i, (t, rep_count, state, error_mask) in enumerate(zip(
+                            chunk['t'].tolist(), chunk['rep_count'].tolist(),
+                            chunk['state'].tolist(), chunk['error_mask'].tolist())):
+                        rows.append((
+                            session_id, patient_id, exercise_name, frame, round(t, 3),
+                            None if math.isnan(rep_count) else int(rep_count),
+                            None if math.isnan(state) else states[int(state)],
+                            [] if math.isnan(error_mask) else reader.errors_at(error_mask),
+                            {name: round(values[i], 3) for name, values in zip(angle_names, angles) if not math.isnan(values[i])},
+                        ))
+                        frame += 1
+                        if len(rows) >= chunk_rows:
+                            yield rows
+                            rows = []
+        if rows:
+            yield rows
+    finally:
+        sessions.close()
+
+
+READERS = {'sessions': iter_sessions, 'errors': iter_errors, 'frames': iter_frames}
+
+
+# ============= ENCODERS =============
+
+def _encode_csv(columns: List[Tuple[str, str]], chunks: Iterator[List[tuple]]) -> Iterator[bytes]:
+    json_columns = [i for i, (_, kind) in enumerate(columns) if kind == 'json']
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in columns])
+    for rows in chunks:
+        for row in rows:
+            if json_columns:
+                row = list(row)
+                for i in json_columns:
+                    row[i] = json.dumps(row[i], ensure_ascii=False)
+            writer.writerow(row)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():  # Header of an empty export
+        yield buffer.getvalue().encode('utf-8')
+
+
+def _encode_ndjson(columns: List[Tuple[str, str]], chunks: Iterator[List[tuple]]) -> Iterator[bytes]:
+    names = [name for name, _ in columns]
+    for rows in chunks:
+        yield ''.join(json.dumps(dict(zip(names, row)), ensure_ascii=False) + '\n' for row in rows).encode('utf-8')
+
+
+class _Drain(io.RawIOBase):
+    """Write-only sink that hands out what was written so far; tell() keeps counting for the Parquet footer"""
+
+    def __init__(self):
+        super().__init__()
+        self.parts: List[bytes] = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self) -> bytes:
+        data, self.parts = b''.join(self.parts), []
+        return data
+
+
+def _encode_parquet(columns: List[Tuple[str, str]], chunks: Iterator[List[tuple]]) -> Iterator[bytes]:
+    """One row group per chunk; list / object columns are stored as JSON strings"""
+    types = {'int': pa.int64(), 'float': pa.float64(), 'str': pa.string(), 'json': pa.string()}
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+    sink = _Drain()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema, compression='zstd')
+    for rows in chunks:
+        arrays = []
+        for i, (name, kind) in enumerate(columns):
+            values = [row[i] for row in rows]
+            if kind == 'json':
+                values = [json.dumps(value, ensure_ascii=False) for value in values]
+            arrays.append(pa.array(values, type=schema.field(name).type))
+        writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+ENCODERS = {'csv': _encode_csv, 'ndjson': _encode_ndjson, 'parquet': _encode_parquet}
+
+
+def stream_export(conn, dataset: str, fmt: str, filters: ExportFilter, chunk_rows: int = CHUNK_ROWS) -> Iterator[bytes]:
+    """
+    Encoded bytes of a dataset, chunk by chunk; the caller owns (and closes) conn
+    Call close() on the result when stopping early: it closes the open cursors
+    """
+    if dataset not in DATASETS:
+        raise ValueError(f"Unknown dataset: {dataset} (choose from {', '.join(DATASETS)})")
+    if fmt not in available_formats():
+        raise ValueError(f"Unsupported format: {fmt} (available: {', '.join(available_formats())})")
+    rows = READERS[dataset](conn, filters, chunk_rows)
+    return _closing(ENCODERS[fmt](DATASETS[dataset], rows), rows)
+
+
+def _closing(encoded: Iterator[bytes], rows) -> Iterator[bytes]:
+    """The encoded stream; closing it closes the reader too, whose finally closes its cursor"""
+    try:
+        yield from encoded
+    finally:
+        rows.close()
+
+
+def main(argv=None):
+    from db import Database
+
+    parser = argparse.ArgumentParser(description="Export sessions, errors or frames")
+    parser.add_argument("dataset", choices=list(DATASETS))
+    parser.add_argument("--format", default="csv", choices=list(FORMATS), help="output format (parquet needs pyarrow)")
+    parser.add_argument("--db", default="rehab_v3.db", help="database file (default: rehab_v3.db)")
+    parser.add_argument("--patient", type=int, help="only this patient")
+    parser.add_argument("--doctor", type=int, help="only patients of this doctor")
+    parser.add_argument("--exercise", help="only this exercise (e.g. squat)")
+    parser.add_argument("--from", dest="start", type=date.fromisoformat, help="sessions started on or after YYYY-MM-DD")
+    parser.add_argument("--to", dest="end", type=date.fromisoformat, help="sessions started on or before YYYY-MM-DD")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help=f"rows read and written at a time (default: {CHUNK_ROWS})")
+    parser.add_argument("-o", "--output", default="-", help="output file (default: stdout)")
+    args = parser.parse_args(argv)
+    if args.format not in available_formats():
+        parser.error("parquet export needs pyarrow (pip install pyarrow)")
+    if not Path(args.db).exists():
+        parser.error(f"database not found: {args.db}")
+
+    filters = ExportFilter(args.patient, args.doctor, args.exercise, args.start, args.end)
+    db = Database(Path(args.db), size=1, read_size=1)
+    conn = db.connect(readonly=True)
+    output = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        written = 0
+        for data in stream_export(conn, args.dataset, args.format, filters, args.chunk_rows):
+            output.write(data)
+            written += len(data)
+        if output is not sys.stdout.buffer:
+            print(f"✅ Exported {args.dataset} to {args.output} ({written:,} bytes)", file=sys.stderr)
+        return 0
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+        conn.close()
+        db.close_all()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+"""
+Latest-frame-wins mailbox for the exercise WebSocket
+The receive task parks frames here; the processing task always takes the newest one
+"""
+
+import asyncio
+from typing import Any, Optional
+
+
+class FrameMailbox:
+    """
+    One-slot mailbox: a frame that arrives while another is still waiting
+    replaces it, so the processor never works on a stale frame.
+
+    Every frame that leaves the mailbox (taken or replaced) is counted as
+    consumed; the count is handed back to the client as send credits.
+    """
+
+    def __init__(self):
+        self._item: Optional[Any] = None
+        self._event = asyncio.Event()
+        self._closed = False
+        self.received = 0
+        self.dropped = 0
+        self._consumed = 0
+
+    def put(self, item: Any):
+        if self._closed:
+            return
+        if self._item is not None:
+            self.dropped += 1
+            self._consumed += 1
+        self._item = item
+        self.received += 1
+        self._event.set()
+
+    async def get(self) -> Optional[Any]:
+        """Wait for the newest frame; returns None once the mailbox is closed and empty"""
+        while self._item is None:
+            if self._closed:
+                return None
+            self._event.clear()
+            await self._event.wait()
+
+        item, self._item = self._item, None
+        self._consumed += 1
+        return item
+
+    def take_consumed(self) -> int:
+        """Number of frames consumed since the last call (credits to return to the client)"""
+        consumed, self._consumed = self._consumed, 0
+        return consumed
+
+    def close(self):
+        self._closed = True
+        self._event.set()
@@ -0,0 +1,239 @@
+"""
+Frame preprocessing stages that run inside the pose workers
+"""
+
+import time
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR
+    _turbo = TurboJPEG()
+except (ImportError, OSError):  # PyTurboJPEG or the libturbojpeg shared library missing
+    _turbo = None
+
+Roi = Tuple[int, int, int, int]  # x0, y0, x1, y1 in full-frame pixels
+
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+# Every Nth frame of a stream is also decoded at full size to measure what the reduced decode saves
+BASELINE_SAMPLE_EVERY = 200
+
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def jpeg_dimensions(jpeg: bytes) -> Optional[Tuple[int, int]]:
+    """Read (width, height) from the JPEG frame header without decoding any pixels"""
+    if jpeg[:2] != b'\xff\xd8':
+        return None
+    i = 2
+    while i + 9 < len(jpeg):
+        if jpeg[i] != 0xFF:
+            return None
+        marker = jpeg[i + 1]
+        if marker == 0xFF:  # Fill byte
+            i += 1
+            continue
+        if marker in _SOF_MARKERS:
+            height = int.from_bytes(jpeg[i + 5:i + 7], 'big')
+            width = int.from_bytes(jpeg[i + 7:i + 9], 'big')
+            return width, height
+        i += 2 + int.from_bytes(jpeg[i + 2:i + 4], 'big')
+    return None
+
+
+def choose_decode_scale(width: int, height: int, target_size: int) -> int:
+    """Largest power-of-two reduction that keeps the longest side at or above target_size"""
+    if target_size <= 0:
+        return 1
+    for scale in (8, 4, 2):
+        if max(width, height) / scale >= target_size:
+            return scale
+    return 1
+
+
+class FrameDecoder:
+    """
+    Decode and colour-conversion stages for one video stream
+
+    The JPEG is decoded at 1/2, 1/4 or 1/8 scale straight from the DCT
+    coefficients when the source is larger than needed. The scale is picked
+    from the stream's frame size and only re-evaluated when that size
+    changes. Colour conversion writes into a reused RGB buffer.
+    """
+
+    def __init__(self, target_size: int):
+        self.target_size = target_size
+        self.source_size: Optional[Tuple[int, int]] = None
+        self.scale = 1
+        self.frames = 0
+        self._rgb: Optional[np.ndarray] = None
+
+    def reset(self):
+        self.source_size = None
+        self.scale = 1
+        self.frames = 0
+
+    def decode(self, jpeg: bytes) -> Tuple[Optional[np.ndarray], bool]:
+        """Returns (BGR frame or None, whether the decode scale changed)"""
+        changed = False
+        size = jpeg_dimensions(jpeg)
+        if size is not None and size != self.source_size:
+            scale = choose_decode_scale(size[0], size[1], self.target_size)
+            changed = self.source_size is not None and scale != self.scale
+            self.source_size = size
+            self.scale = scale
+        self.frames += 1
+
+        if _turbo is not None:
+            try:
+                return _turbo.decode(jpeg, pixel_format=TJPF_BGR, scaling_factor=(1, self.scale)), changed
+            except (OSError, ValueError):
+                pass  # Fall back to OpenCV for anything libjpeg-turbo rejects
+        return cv2.imdecode(np.frombuffer(jpeg, np.uint8), REDUCED_DECODE_FLAGS[self.scale]), changed
+
+    def to_rgb(self, bgr_image: np.ndarray) -> np.ndarray:
+        if self._rgb is None or self._rgb.shape != bgr_image.shape:
+            self._rgb = np.empty_like(bgr_image)
+        # Crops are views into the decoded frame - OpenCV needs contiguous input
+        return cv2.cvtColor(np.ascontiguousarray(bgr_image), cv2.COLOR_BGR2RGB, dst=self._rgb)
+
+    def should_sample_baseline(self) -> bool:
+        return self.scale > 1 and self.frames % BASELINE_SAMPLE_EVERY == 1
+
+    @staticmethod
+    def measure_baseline(jpeg: bytes) -> Dict[str, float]:
+        """Time a full-size decode + colour conversion, as the pipeline did before scaled decode"""
+        start = time.perf_counter()
+        frame = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+        decoded = time.perf_counter()
+        if frame is not None:
+            cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        return {
+            'decode': (decoded - start) * 1000,
+            'color': (time.perf_counter() - decoded) * 1000,
+        }
+
+
+class RoiTracker:
+    """
+    Region of interest for one video stream, derived from the previous frame's landmarks
+
+    The ROI is a padded square around the visible landmarks. It is only moved
+    when the body gets close to its edge, so most frames reuse the same crop
+    and MediaPipe's tracking sees a stable image.
+    """
+
+    def __init__(self, padding: float = 0.25, edge_margin: float = 0.08, min_visibility: float = 0.5):
+        self.padding = padding
+        self.edge_margin = edge_margin
+        self.min_visibility = min_visibility
+        self.roi: Optional[Roi] = None
+
+    def reset(self):
+        self.roi = None
+
+    def _body_box(self, landmarks: np.ndarray, frame_w: int, frame_h: int):
+        visible = landmarks[landmarks[:, 3] >= self.min_visibility]
+        if len(visible) < 4:
+            return None
+        x = np.clip(visible[:, 0], 0.0, 1.0) * frame_w
+        y = np.clip(visible[:, 1], 0.0, 1.0) * frame_h
+        return x.min(), y.min(), x.max(), y.max()
+
+    def update(self, landmarks: np.ndarray, frame_w: int, frame_h: int) -> bool:
+        """Update the ROI from full-frame landmarks; returns True if the ROI changed"""
+        box = self._body_box(landmarks, frame_w, frame_h)
+        if box is None:
+            changed = self.roi is not None
+            self.roi = None
+            return changed
+
+        bx0, by0, bx1, by1 = box
+        if self.roi is not None:
+            x0, y0, x1, y1 = self.roi
+            margin = self.edge_margin * (x1 - x0)
+            inside = bx0 >= x0 + margin and by0 >= y0 + margin and bx1 <= x1 - margin and by1 <= y1 - margin
+            if inside:
+                return False
+
+        # Square box (pose models expect roughly square input) with padding on every side
+        side = max(bx1 - bx0, by1 - by0) * (1 + 2 * self.padding)
+        side = min(side, max(frame_w, frame_h))
+        cx, cy = (bx0 + bx1) / 2, (by0 + by1) / 2
+        x0 = int(max(0, min(cx - side / 2, frame_w - side)))
+        y0 = int(max(0, min(cy - side / 2, frame_h - side)))
+        roi = (x0, y0, int(min(frame_w, x0 + side)), int(min(frame_h, y0 + side)))
+
+        # A crop covering (almost) the whole frame saves nothing
+        if (roi[2] - roi[0]) * (roi[3] - roi[1]) >= 0.9 * frame_w * frame_h:
+            roi = None
+
+        changed = roi != self.roi
+        self.roi = roi
+        return changed
+
+
+def crop_to_roi(frame: np.ndarray, roi: Roi, size: int) -> np.ndarray:
+    """Crop the ROI and shrink it to at most `size` pixels on its longest side"""
+    x0, y0, x1, y1 = roi
+    crop = frame[y0:y1, x0:x1]
+    longest = max(x1 - x0, y1 - y0)
+    if longest <= size:
+        return crop
+    scale = size / longest
+    return cv2.resize(crop, (max(1, round((x1 - x0) * scale)), max(1, round((y1 - y0) * scale))), interpolation=cv2.INTER_LINEAR)
+
+
+def roi_to_frame(landmarks: np.ndarray, roi: Roi, frame_w: int, frame_h: int) -> np.ndarray:
+    """Map landmarks normalised to the ROI crop back to full-frame normalised coordinates"""
+    x0, y0, x1, y1 = roi
+    crop_w, crop_h = x1 - x0, y1 - y0
+    mapped = landmarks.copy()
+    mapped[:, 0] = (x0 + landmarks[:, 0] * crop_w) / frame_w
+    mapped[:, 1] = (y0 + landmarks[:, 1] * crop_h) / frame_h
+    # MediaPipe's z uses the same scale as x (image width)
+    mapped[:, 2] = landmarks[:, 2] * crop_w / frame_w
+    return mapped
+
+
+class PipelineStats:
+    """Running per-stage timings (ms) reported by the pose workers"""
+
+    def __init__(self):
+        self.frames = 0
+        self.stage_totals: Dict[str, float] = {}
+        self.stage_counts: Dict[str, int] = {}  # Frames that ran each stage (e.g. crop only runs with an ROI)
+        self.baseline_totals: Dict[str, float] = {}
+        self.baseline_samples = 0
+
+    def add(self, stage_ms: Dict[str, float]):
+        self.frames += 1
+        for stage, ms in stage_ms.items():
+            if stage.startswith('baseline_'):
+                continue
+            self.stage_totals[stage] = self.stage_totals.get(stage, 0.0) + ms
+            self.stage_counts[stage] = self.stage_counts.get(stage, 0) + 1
+        if 'baseline_decode' in stage_ms:
+            self.baseline_samples += 1
+            for stage in ('decode', 'color'):
+                self.baseline_totals[stage] = self.baseline_totals.get(stage, 0.0) + stage_ms[f'baseline_{stage}']
+
+    def snapshot(self) -> Dict:
+        stages = {}
+        for stage, total in self.stage_totals.items():
+            mean = total / self.stage_counts[stage]
+            entry = {'mean_ms': round(mean, 3), 'frames': self.stage_counts[stage]}
+            if stage in self.baseline_totals and self.baseline_samples:
+                baseline = self.baseline_totals[stage] / self.baseline_samples
+                entry['full_size_mean_ms'] = round(baseline, 3)
+                entry['saved_ms'] = round(baseline - mean, 3)
+            stages[stage] = entry
+        return {'frames': self.frames, 'baseline_samples': self.baseline_samples, 'stages': stages}
@@ -0,0 +1,220 @@
+"""
+Batched background writer for session time series
+The WebSocket loop only enqueues; a background task hands frames to a dedicated writer thread
+"""
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
+
+from db import ConnectionPool, PooledConnection
+from timeseries import INSERT_CHUNK, INSERT_HEADER, SeriesBuilder, chunk_row
+
+logger = logging.getLogger('rehab.frames')
+
+# Queue fill level where frames without errors start being downsampled, and the stride per level
+DOWNSAMPLE_LEVELS = ((0.9, 4), (0.5, 2))
+
+FrameRow = Tuple[int, float, int, str, dict, list]  # session_id, unix time, rep_count, state, angles, errors
+QueueItem = Union[FrameRow, int, None]  # A frame, a session id to close, or None to stop
+
+
+class FrameWriter:
+    """
+    Persists session frames as columnar time series (see timeseries.py)
+
+    Frames are moved off the queue in batches of `batch_size` or every
+    `flush_ms`, and each batch is written in one transaction. A session's
+    frames are encoded as a new session_timeseries_chunks row once
+    `chunk_frames` have accumulated, and when the session is closed; in
+    between, the open chunk is rewritten with the frames so far at most
+    every `flush_ms` (also when no new frames arrive), so a crash loses
+    about `flush_ms` of frames. That
+    rewrite is bounded by one chunk, not by the session length. Buffered
+    frames live in a fixed-size float32 table per session (SeriesBuilder),
+    so memory per session is bounded by `chunk_frames` rather than by the
+    session length. submit() never blocks: once the queue is half
+    full only every 2nd (then every 4th) frame without errors is kept, and
+    a full queue drops frames. All SQLite work runs on a single dedicated
+    thread with one connection taken from the pool for the writer's lifetime.
+    """
+
+    def __init__(self, pool: ConnectionPool, batch_size: int = 100, flush_ms: int = 500,
+                 max_queue: int = 5000, chunk_frames: int = 750):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.flush_ms = flush_ms
+        self.chunk_frames = chunk_frames
+        self.queue: "asyncio.Queue[QueueItem]" = asyncio.Queue(maxsize=max_queue)
+        self.written = 0
+        self.dropped = 0
+        self.downsampled = 0
+        self.buffered_bytes = 0  # Frame buffers of all open sessions
+        self.peak_session_bytes = 0  # Largest frame buffer any session has held
+        self._session_seq: Dict[int, int] = {}
+        self._builders: Dict[int, SeriesBuilder] = {}  # Only touched on the writer thread
+        # Frames of each open chunk already stored, and time.monotonic() of that write (writer thread)
+        self._stored: Dict[int, Tuple[int, float]] = {}
+        self._pending: List[Tuple[str, tuple]] = []  # Statements of the batch being written
+        self._thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix='frame-writer')
+        self._conn: Optional[PooledConnection] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Write everything still queued or buffered, then stop"""
+        if self._task is None:
+            return
+        await self.queue.put(None)
+        await self._task
+        self._task = None
+        await asyncio.get_running_loop().run_in_executor(self._thread, self._close)
+        self._thread.shutdown(wait=True)
+
+    def submit(self, session_id: int, timestamp: float, rep_count: int, state: str, angles: dict, errors: list) -> bool:
+        """Queue a frame; returns False if it was downsampled or dropped"""
+        seq = self._session_seq.get(session_id, 0) + 1
+        self._session_seq[session_id] = seq
+
+        fill = self.queue.qsize() / self.queue.maxsize
+        if not errors:  # Frames with errors are what clinicians review - never downsample them
+            for level, stride in DOWNSAMPLE_LEVELS:
+                if fill >= level:
+                    if seq % stride:
+                        self.downsampled += 1
+                        return False
+                    break
+        try:
+            self.queue.put_nowait((session_id, timestamp, rep_count, state, angles, errors))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+
+    def close_session(self, session_id: int):
+        """Write the session's remaining frames once everything queued before has been handled"""
+        self._session_seq.pop(session_id, None)
+        try:
+            self.queue.put_nowait(session_id)
+        except asyncio.QueueFull:
+            asyncio.get_running_loop().create_task(self.queue.put(session_id))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        unstored = False  # Open chunks hold frames that are not written yet
+        while not stopping:
+            try:
+                first = await asyncio.wait_for(self.queue.get(), self.flush_ms / 1000 if unstored else None)
+            except asyncio.TimeoutError:  # No frames for a while - still store the open chunks
+                try:
+                    unstored = await loop.run_in_executor(self._thread, self._write, [])
+                except Exception:
+                    logger.exception("Failed to write open chunks")
+                continue
+            if first is None:
+                break
+            batch: List[QueueItem] = [first]
+            deadline = loop.time() + self.flush_ms / 1000
+
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            try:
+                unstored = await loop.run_in_executor(self._thread, self._write, batch)
+            except Exception:
+                logger.exception("Failed to write %d frames", len(batch))
+
+        await loop.run_in_executor(self._thread, self._flush_all)
+
+    def _write(self, batch: List[QueueItem]) -> bool:
+        """Write a batch; returns True if an open chunk still has frames waiting for `flush_ms`"""
+        for item in batch:
+            if isinstance(item, int):
+                builder = self._builders.pop(item, None)
+                if builder is not None:
+                    self.buffered_bytes -= builder.nbytes
+                    self._store(builder, builder.encode_chunk())
+                    self._stored.pop(item, None)
+                continue
+
+            session_id, timestamp, rep_count, state, angles, errors = item
+            builder = self._builders.get(session_id)
+            if builder is None:
+                builder = self._builders[session_id] = SeriesBuilder(session_id, timestamp, self.chunk_frames)
+                self.buffered_bytes += builder.nbytes
+                self._stored[session_id] = (0, time.monotonic())
+            size = builder.nbytes
+            builder.append(timestamp, rep_count, state, angles, errors)
+            if builder.nbytes != size:  # Widened for a new angle column
+                self.buffered_bytes += builder.nbytes - size
+            self.peak_session_bytes = max(self.peak_session_bytes, builder.nbytes)
+            if builder.full:
+                self._store(builder, builder.encode_chunk())
+
+        now = time.monotonic()
+        unstored = False
+        for session_id, builder in self._builders.items():
+            stored, at = self._stored[session_id]
+            if len(builder) > stored:
+                if now - at >= self.flush_ms / 1000:
+                    self._store(builder, builder.encode_partial())
+                else:
+                    unstored = True
+        self._commit()
+        return unstored
+
+    def _store(self, builder: SeriesBuilder, encoded):
+        """Queue the header and an encoded (full or partial) chunk for this batch's transaction"""
+        if encoded is None:
+            return
+        chunk, data = encoded
+        stored, _ = self._stored.get(builder.session_id, (0, 0.0))
+        self.written += chunk['frames'] - stored
+        # A full chunk's successor starts empty; a partial one stays open with `frames` stored
+        partial = chunk['seq'] == builder.seq
+        self._stored[builder.session_id] = (chunk['frames'] if partial else 0, time.monotonic())
+        self._pending.append((INSERT_HEADER, (builder.session_id, builder.header_json())))
+        self._pending.append((INSERT_CHUNK, chunk_row(builder.session_id, chunk, data)))
+
+    def _commit(self):
+        if not self._pending:
+            return
+        if self._conn is None:
+            self._conn = self.pool.connect()
+        try:
+            with self._conn:  # One transaction per batch
+                for sql, parameters in self._pending:
+                    self._conn.execute(sql, parameters)
+        finally:
+            self._pending.clear()
+
+    def _flush_all(self):
+        for builder in self._builders.values():
+            self._store(builder, builder.encode_chunk())
+        try:
+            self._commit()
+        except Exception:
+            logger.exception("Failed to write frames of %d sessions", len(self._builders))
+        self._builders.clear()
+        self._stored.clear()
+        self.buffered_bytes = 0
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
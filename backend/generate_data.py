@@ -0,0 +1,311 @@
+"""
+Synthetic data generator for scale testing
+
+Creates doctors, patients, sessions, session errors, exercise limits and
+(optionally) frame time series that look like real usage: each patient has
+an adherence rate, a starting accuracy that improves over time, a few
+exercises they practise and a personal mix of the exercise's errors. Output
+is deterministic for a given --seed and --end.
+
+Rows are loaded with executemany in large transactions while the secondary
+indexes are dropped; the indexes are rebuilt and the rollups recomputed at the end.
+
+    python generate_data.py --db rehab_bench.db --doctors 20 --patients 5000 --sessions 2000000
+    python generate_data.py --db rehab_bench.db --patients 200 --sessions 20000 --frame-sessions 0.01
+
+Every generated account logs in with the password `synthetic123`.
+"""
+
+import argparse
+import hashlib
+import math
+import sys
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+import numpy as np
+
+from analytics import rebuild_cohort_summary, rebuild_daily_activity, rebuild_error_rollup
+from migrations import migrate
+from timeseries import SeriesBuilder, chunk_row
+from vocabulary import EXERCISE_ERRORS, EXERCISE_NAMES
+
+PASSWORD = "synthetic123"
+BATCH_ROWS = 100_000  # Rows per executemany; one transaction per batch
+INDEXED_TABLES = ('users', 'sessions', 'session_errors', 'user_exercise_limits')
+
+FAMILY_NAMES = ["Nguyễn", "Trần", "Lê", "Phạm", "Hoàng", "Huỳnh", "Phan", "Vũ", "Võ", "Đặng", "Bùi", "Đỗ"]
+MIDDLE_NAMES = ["Văn", "Thị", "Hữu", "Minh", "Ngọc", "Thanh", "Đức", "Quang"]
+GIVEN_NAMES = ["An", "Bình", "Chi", "Dũng", "Hà", "Hải", "Hoa", "Hùng", "Lan", "Long", "Mai", "Nam", "Phúc", "Quân", "Tâm", "Thảo", "Trung", "Vy"]
+MEDICAL_CONDITIONS = [None, None, "Thoái hóa khớp gối", "Đau lưng mãn tính", "Sau phẫu thuật thay khớp háng", "Loãng xương"]
+MOBILITY_LEVELS = ["beginner", "intermediate", "advanced"]
+# Severities the error detectors report, and how often a recorded error has each
+SEVERITIES = ["medium", "high", "critical"]
+SEVERITY_WEIGHTS = [0.45, 0.45, 0.1]
+
+# Synthetic motion per exercise: angle columns, resting angle, angle at the top of a rep, seconds per rep
+MOTION = {
+    'squat': (['left_knee', 'right_knee'], 175.0, 80.0, 3.0),
+    'arm_raise': (['left_shoulder', 'right_shoulder', 'left_elbow', 'right_elbow'], 15.0, 165.0, 3.0),
+    'calf_raise': (['left_ankle', 'right_ankle', 'left_knee', 'right_knee'], 95.0, 125.0, 2.0),
+    'single_leg_stand': (['left_knee', 'right_knee'], 175.0, 90.0, 5.0),
+}
+
+
+def full_name(rng: np.random.Generator) -> str:
+    return f"{rng.choice(FAMILY_NAMES)} {rng.choice(MIDDLE_NAMES)} {rng.choice(GIVEN_NAMES)}"
+
+
+class Loader:
+    """Buffers rows per INSERT statement and flushes them with executemany, one transaction per batch"""
+
+    def __init__(self, conn, batch_rows: int = BATCH_ROWS):
+        self.conn = conn
+        self.batch_rows = batch_rows
+        self.pending: Dict[str, List[tuple]] = {}
+        self.counts: Dict[str, int] = {}
+
+    def add(self, sql: str, rows: List[tuple]):
+        buffer = self.pending.setdefault(sql, [])
+        buffer.extend(rows)
+        if len(buffer) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        with self.conn:
+            for sql, rows in self.pending.items():
+                if rows:
+                    self.conn.executemany(sql, rows)
+                    table = sql.split()[2]
+                    self.counts[table] = self.counts.get(table, 0) + len(rows)
+                    rows.clear()
+
+
+INSERT_USER = """
+    INSERT INTO users (id, username, password_hash, role, full_name, age, gender, height_cm, weight_kg, bmi,
+                       medical_conditions, mobility_level, pain_level, created_at, doctor_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+INSERT_SESSION = """
+    INSERT INTO sessions (id, patient_id, exercise_name, start_time, end_time, total_reps, correct_reps, accuracy, duration_seconds)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+INSERT_ERROR = "INSERT INTO session_errors (session_id, error_name, count, severity) VALUES (?, ?, ?, ?)"
+INSERT_LIMITS = """
+    INSERT INTO user_exercise_limits (user_id, exercise_type, max_depth_angle, min_raise_angle, max_reps_per_set,
+                                      recommended_rest_seconds, difficulty_score, injury_risk_score, created_at, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+INSERT_SERIES = "INSERT INTO session_timeseries (session_id, header) VALUES (?, ?)"
+INSERT_SERIES_CHUNK = """
+    INSERT INTO session_timeseries_chunks (session_id, seq, frames, t0, t1, offsets, data)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def patient_sessions(rng: np.random.Generator, patient_id: int, count: int, joined: datetime, end: datetime,
+                     first_session_id: int) -> Iterator[tuple]:
+    """(session row, [(error_name, count, severity), ...]) of one patient, oldest first"""
+    exercises = rng.choice(list(EXERCISE_NAMES), size=rng.integers(1, len(EXERCISE_NAMES) + 1), replace=False)
+    base_accuracy = rng.uniform(0.35, 0.8)
+    improvement = rng.uniform(0.0, 0.3)  # Gained over the patient's whole history
+    error_mix = {exercise: rng.dirichlet(np.ones(len(EXERCISE_ERRORS[exercise])) * 0.7) for exercise in exercises}
+
+    span = max((end - joined).total_seconds(), 1.0)
+    # Sessions happen at daytime hours: pick days, then a time between 07:00 and 20:00
+    days = np.sort(rng.integers(0, max(int(span // 86400), 1), size=count))
+    seconds = rng.integers(7 * 3600, 20 * 3600, size=count)
+    progress = days / max(days[-1], 1) if count else days
+    session_exercises = rng.choice(exercises, size=count)
+    total_reps = rng.integers(6, 21, size=count)
+    probability = np.clip(base_accuracy + improvement * progress + rng.normal(0, 0.08, size=count), 0.02, 0.99)
+    correct_reps = rng.binomial(total_reps, probability)
+    duration = (total_reps * rng.uniform(2.5, 5.0, size=count) + rng.integers(10, 60, size=count)).astype(int)
+    # Each wrong rep has at least one error; some have two
+    error_reps = total_reps - correct_reps + rng.binomial(total_reps - correct_reps, 0.25)
+
+    day0 = datetime.combine(joined.date(), datetime.min.time())
+    for i in range(count):
+        start = day0 + timedelta(days=int(days[i]), seconds=int(seconds[i]), microseconds=int(rng.integers(0, 10**6)))
+        exercise = str(session_exercises[i])
+        reps, correct = int(total_reps[i]), int(correct_reps[i])
+        errors = []
+        if error_reps[i]:
+            counts = rng.multinomial(int(error_reps[i]), error_mix[exercise])
+            errors = [(name, int(n)) for name, n in zip(EXERCISE_ERRORS[exercise], counts) if n]
+            severities = rng.choice(SEVERITIES, size=len(errors), p=SEVERITY_WEIGHTS)
+            errors = [(name, n, str(severity)) for (name, n), severity in zip(errors, severities)]
+        yield (
+            first_session_id + i, patient_id, exercise, start.isoformat(),
+            (start + timedelta(seconds=int(duration[i]))).isoformat(),
+            reps, correct, correct / reps * 100 if reps else 0.0, int(duration[i]),
+        ), errors
+
+
+def synthetic_series(rng: np.random.Generator, session: tuple, errors: list, fps: float, chunk_frames: int):
+    """(header JSON, chunk rows) of a plausible frame series for a generated session"""
+    session_id, _, exercise, start_time, _, reps, correct, _, duration = session
+    angle_names, rest, peak, rep_seconds = MOTION[exercise]
+    start = datetime.fromisoformat(start_time).timestamp()
+    builder = SeriesBuilder(session_id, start, capacity=chunk_frames)
+    wrong = set(rng.choice(reps, size=reps - correct, replace=False).tolist()) if reps > correct else set()
+    error_names = [name for name, _, _ in errors] or [None]
+    frames = int(min(duration, reps * rep_seconds + 2) * fps)
+    chunks = []
+    for frame in range(frames):
+        t = frame / fps
+        rep, phase = divmod(t / rep_seconds, 1.0)
+        rep = int(rep)
+        depth = 0.5 * (1 - math.cos(2 * math.pi * phase)) if rep < reps else 0.0
+        if rep in wrong:
+            depth *= 0.7  # Wrong reps fall short of the target
+        angles = {name: rest + (peak - rest) * depth + float(rng.normal(0, 2)) for name in angle_names}
+        frame_errors = [error_names[rep % len(error_names)]] if rep in wrong and error_names[0] and depth > 0.5 else []
+        builder.append(start + t, min(rep, reps), 'up' if depth > 0.5 else 'down', angles, frame_errors)
+        if builder.full:
+            chunks.append(chunk_row(session_id, *builder.encode_chunk()))
+    if len(builder):
+        chunks.append(chunk_row(session_id, *builder.encode_chunk()))
+    return builder.header_json(), chunks
+
+
+def drop_indexes(conn) -> List[tuple]:
+    """Drop the secondary indexes of the bulk-loaded tables; returns (name, sql) to recreate them"""
+    indexes = conn.execute(f"""
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({','.join('?' * len(INDEXED_TABLES))})
+    """, INDEXED_TABLES).fetchall()
+    with conn:
+        for name, _ in indexes:
+            conn.execute(f"DROP INDEX {name}")
+    return indexes
+
+
+def generate(conn, doctors: int, patients: int, sessions: int, seed: int, end: date, days: int,
+             frame_sessions: float = 0.0, fps: float = 10.0, chunk_frames: int = 750,
+             batch_rows: int = BATCH_ROWS, log=print) -> Dict[str, int]:
+    prefix = f"syn{seed}"
+    if conn.execute("SELECT 1 FROM users WHERE username IN (?, ?)", (f"{prefix}_doctor1", f"{prefix}_patient1")).fetchone():
+        raise ValueError(f"Users of seed {seed} already exist in this database; use another --seed or database")
+
+    rng = np.random.default_rng(seed)
+    end_time = datetime.combine(end, datetime.min.time()) + timedelta(days=1)
+    history_start = end_time - timedelta(days=days)
+    password_hash = hashlib.sha256(PASSWORD.encode()).hexdigest()
+    next_user = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM users").fetchone()[0]
+    next_session = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM sessions").fetchone()[0]
+
+    # Patients get a share of the sessions proportional to their adherence
+    adherence = rng.gamma(2.0, 1.0, size=patients)
+    session_counts = rng.multinomial(sessions, adherence / adherence.sum()) if patients else []
+
+    loader = Loader(conn, batch_rows)
+    doctor_ids = list(range(next_user, next_user + doctors))
+    loader.add(INSERT_USER, [
+        (doctor_id, f"{prefix}_doctor{i + 1}", password_hash, 'doctor', f"BS. {full_name(rng)}",
+         None, None, None, None, None, None, None, None, history_start.isoformat(), None)
+        for i, doctor_id in enumerate(doctor_ids)
+    ])
+    started = time.perf_counter()
+    for j in range(patients):
+        patient_id = next_user + doctors + j
+        # Own stream per patient: the data of patient j does not depend on --batch-rows or on other patients
+        prng = np.random.default_rng([seed, j])
+        joined = history_start + timedelta(seconds=float(prng.uniform(0, 0.6)) * days * 86400)
+        height = float(prng.normal(160, 8))
+        weight = float(prng.normal(60, 10))
+        loader.add(INSERT_USER, [(
+            patient_id, f"{prefix}_patient{j + 1}", password_hash, 'patient', full_name(prng),
+            int(prng.integers(25, 86)), str(prng.choice(['female', 'male'])), round(height, 1), round(weight, 1),
+            round(weight / (height / 100) ** 2, 1), prng.choice(MEDICAL_CONDITIONS), str(prng.choice(MOBILITY_LEVELS)),
+            int(prng.integers(0, 8)), joined.isoformat(), doctor_ids[j % doctors] if doctors else None,
+        )])
+
+        count = int(session_counts[j])
+        practised = set()
+        for session, errors in patient_sessions(prng, patient_id, count, joined, end_time, next_session):
+            practised.add(session[2])
+            loader.add(INSERT_SESSION, [session])
+            if errors:
+                loader.add(INSERT_ERROR, [(session[0], name, n, severity) for name, n, severity in errors])
+            if frame_sessions and prng.random() < frame_sessions:
+                header, chunks = synthetic_series(prng, session, errors, fps, chunk_frames)
+                loader.add(INSERT_SERIES, [(session[0], header)])
+                loader.add(INSERT_SERIES_CHUNK, chunks)
+        next_session += count
+
+        loader.add(INSERT_LIMITS, [(
+            patient_id, exercise, float(prng.uniform(60, 100)), float(prng.uniform(120, 170)),
+            int(prng.integers(8, 16)), int(prng.integers(30, 91)), round(float(prng.uniform(0.2, 0.9)), 2),
+            round(float(prng.uniform(0.0, 0.5)), 2), joined.isoformat(), end_time.isoformat(),
+        ) for exercise in sorted(practised)])
+
+        if (j + 1) % max(patients // 10, 1) == 0:
+            log(f"   {j + 1:,}/{patients:,} patients, {next_session - 1:,} sessions ({time.perf_counter() - started:.1f}s)")
+    loader.flush()
+    return loader.counts
+
+
+def main(argv=None):
+    from db import Database
+
+    parser = argparse.ArgumentParser(description="Generate synthetic doctors, patients and sessions")
+    parser.add_argument("--db", default="rehab_synthetic.db", help="database file, created if missing (default: rehab_synthetic.db)")
+    parser.add_argument("--doctors", type=int, default=10)
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--sessions", type=int, default=100_000, help="total sessions across all patients")
+    parser.add_argument("--days", type=int, default=365, help="length of the generated history")
+    parser.add_argument("--end", type=date.fromisoformat, default=date.today(), help="last day of the history (default: today)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--frame-sessions", type=float, default=0.0, help="fraction of sessions that get a frame time series")
+    parser.add_argument("--fps", type=float, default=10.0, help="frame rate of generated time series")
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS, help=f"rows per executemany / transaction (default: {BATCH_ROWS})")
+    args = parser.parse_args(argv)
+    if args.doctors < 1 and args.patients:
+        parser.error("patients need at least one doctor")
+
+    # Bulk load: no fsync per transaction, bigger page cache
+    db = Database(Path(args.db), size=1, read_size=1, pragmas={'synchronous': 'OFF', 'cache_size': -262144})
+    conn = db.connect()
+    try:
+        for migration in migrate(conn):
+            print(f"✅ Applied migration {migration.version}: {migration.description}")
+
+        started = time.perf_counter()
+        indexes = drop_indexes(conn)
+        print(f"🗑️ Dropped {len(indexes)} indexes for the bulk load")
+        try:
+            counts = generate(conn, args.doctors, args.patients, args.sessions, args.seed, args.end, args.days,
+                              args.frame_sessions, args.fps, batch_rows=args.batch_rows)
+        finally:
+            phase = time.perf_counter()
+            with conn:
+                for name, sql in indexes:
+                    conn.execute(sql)
+            print(f"🔧 Rebuilt {len(indexes)} indexes ({time.perf_counter() - phase:.1f}s)")
+        loaded = time.perf_counter() - started
+        for table, rows in counts.items():
+            print(f"✅ {table}: {rows:,} rows ({rows / loaded:,.0f} rows/s)")
+
+        phase = time.perf_counter()
+        with conn:
+            cursor = conn.cursor()
+            rebuild_error_rollup(cursor)
+            rebuild_daily_activity(cursor)
+            rebuild_cohort_summary(cursor)
+        conn.execute("ANALYZE")
+        print(f"📈 Rebuilt analytics rollups ({time.perf_counter() - phase:.1f}s)")
+        print(f"👤 Log in as syn{args.seed}_doctor1 / syn{args.seed}_patient1 with password '{PASSWORD}'")
+        return 0
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+    finally:
+        conn.close()
+        db.close_all()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
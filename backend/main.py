@@ -3,22 +3,25 @@ AI Rehabilitation System V3 - Complete Backend
 With Authentication, Database, Session Management, AI Personalization
 """
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends, Query, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-import cv2
 import mediapipe as mp
 import numpy as np
-import base64
+import asyncio
 import json
 import time
 import sqlite3
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
 import jwt
 import hashlib
+import logging
+import os
+import threading
 from pathlib import Path
 from enum import Enum
 from collections import deque
@@ -26,45 +29,80 @@ import time
 
 # Import AI models
 from ai_models import PersonalizationEngine, BiometricFeatures
+import ws_protocol
+from pose_workers import NUM_LANDMARKS, PoseInferenceExecutor, landmarks_from_array, landmarks_to_array
+from frame_mailbox import FrameMailbox
+from frame_pipeline import PipelineStats
+from pipeline_metrics import PipelineMetrics, StageTimer, StageTimings
+from session_trace import RateLimiter, SessionTrace, TraceArchive
+from frame_writer import FrameWriter
+from timeseries import open_series
+from db import Database, statement_kind
+from migrations import migrate
+from analytics import (first_active_day, load_calendar, load_cohort, load_error_rollup, record_daily_activity,
+                       record_session_errors)
+from response_cache import ResponseCache, Scope
+from export import DATASETS, FORMATS, ExportFilter, available_formats, stream_export
+from vocabulary import ERROR_NAMES, EXERCISE_NAMES
 
 # Config
 SECRET_KEY = "your-secret-key-change-in-production"
 ALGORITHM = "HS256"
 DB_PATH = Path("rehab_v3.db")
+# Idle connections kept per pool; read-only connections serve history and analytics queries
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 8))
+DB_READ_POOL_SIZE = int(os.environ.get("DB_READ_POOL_SIZE", 4))
+DB_BUSY_TIMEOUT = float(os.environ.get("DB_BUSY_TIMEOUT", 5.0))  # seconds a writer waits for the lock
+DB_WORKERS = int(os.environ.get("DB_WORKERS", 4))  # threads running API database work off the event loop
+HISTORY_MAX_LIMIT = 100  # sessions per history page
+CALENDAR_MAX_DAYS = 3 * 366  # longest range /api/sessions/calendar returns
+COHORT_MAX_WEEKS = 52  # longest accuracy trend /api/doctor/cohort returns
+# History and analytics responses kept in memory, least recently used evicted first
+RESPONSE_CACHE_ENTRIES = int(os.environ.get("RESPONSE_CACHE_ENTRIES", 1024))
+RESPONSE_CACHE_MB = int(os.environ.get("RESPONSE_CACHE_MB", 32))
+
+# Pose inference workers (0 = run inference on a single background thread)
+POSE_WORKERS = int(os.environ.get("POSE_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+POSE_THREADS_PER_WORKER = int(os.environ.get("POSE_THREADS_PER_WORKER", 1))
+# Pose graphs shared by all workers; each connection leases one for its lifetime
+POSE_POOL_SIZE = int(os.environ.get("POSE_POOL_SIZE", max(1, POSE_WORKERS) * 2))
+POSE_MODEL_COMPLEXITY = int(os.environ.get("POSE_MODEL_COMPLEXITY", 1))
+# Longest side of the crop around the patient fed to the model (0 = always use the full frame)
+POSE_ROI_SIZE = int(os.environ.get("POSE_ROI_SIZE", 384))
+# Decode JPEGs at 1/2, 1/4 or 1/8 scale while the longest side stays >= this (0 = full-size decode)
+POSE_DECODE_SIZE = int(os.environ.get("POSE_DECODE_SIZE", 640))
+POSE_LEASE_TIMEOUT = 30  # seconds a connection may wait for a free Pose graph
+FRAME_CREDIT_WINDOW = 2  # frames a credit-mode client may have in flight
+
+# Session trace: recent frames kept per session (~30 s at 25 fps), every Nth frame logged at DEBUG
+TRACE_CAPACITY = int(os.environ.get("TRACE_CAPACITY", 750))
+TRACE_SAMPLE_EVERY = int(os.environ.get("TRACE_SAMPLE_EVERY", 25))
+TRACE_LOGS_PER_SECOND = float(os.environ.get("TRACE_LOGS_PER_SECOND", 20))
+TRACE_ARCHIVE_SIZE = 50  # finished sessions whose trace can still be dumped
+
+# Sessions with no WebSocket and no frames for this long are ended automatically
+SESSION_IDLE_TIMEOUT = int(os.environ.get("SESSION_IDLE_TIMEOUT", 15 * 60))
+SESSION_REAP_INTERVAL = 60  # seconds between idle-session sweeps
+
+# Frames are written in batches: every FRAME_WRITE_BATCH frames or FRAME_FLUSH_MS after the first;
+# a session's open time-series chunk is stored (rewritten) at most every FRAME_FLUSH_MS
+FRAME_WRITE_BATCH = int(os.environ.get("FRAME_WRITE_BATCH", 100))
+FRAME_FLUSH_MS = int(os.environ.get("FRAME_FLUSH_MS", 500))
+FRAME_QUEUE_SIZE = int(os.environ.get("FRAME_QUEUE_SIZE", 5000))
+# Frames per compressed time-series chunk, one session_timeseries_chunks row each (30 s at 25 fps);
+# also the size of each session's preallocated frame buffer, which is spilled to the DB when full
+TIMESERIES_CHUNK_FRAMES = int(os.environ.get("TIMESERIES_CHUNK_FRAMES", 750))
+
+logger = logging.getLogger("rehab")
+trace_log_limiter = RateLimiter(TRACE_LOGS_PER_SECOND)
+finished_traces = TraceArchive(TRACE_ARCHIVE_SIZE)
+db = Database(DB_PATH, DB_POOL_SIZE, DB_READ_POOL_SIZE, DB_WORKERS, busy_timeout=DB_BUSY_TIMEOUT)
+response_cache = ResponseCache(RESPONSE_CACHE_ENTRIES, RESPONSE_CACHE_MB * 1024 * 1024)
 
 # Initialize AI Personalization Engine
 personalization_engine = PersonalizationEngine()
 
-# Exercise name mapping (English to Vietnamese)
-EXERCISE_NAMES = {
-    "squat": "Bài Tập Squat",
-    "arm_raise": "Bài Tập Giơ Tay",
-    "calf_raise": "Bài Tập Nâng Bắp Chân",
-    "single_leg_stand": "Bài Tập Đứng Một Chân"
-}
-
-# Error name mapping (English to Vietnamese) - for legacy data
-ERROR_NAMES = {
-    # Arm raise errors
-    "not_high": "Góc vai chưa đủ",
-    "arms_bent": "Tay không thẳng",
-    "not_low": "Chưa hạ hết",
-    
-    # Squat errors
-    "not_deep": "Gập gối chưa đủ",
-    "knees_forward": "Gối đẩy ra trước",
-    "not_straight": "Chưa đứng thẳng",
-    
-    # Calf raise errors
-    "not_raised": "Chưa nâng đủ cao",
-    "knees_bent": "Gập gối",
-    "not_lowered": "Chưa hạ hết",
-    
-    # Single leg stand errors
-    "knee_not_bent": "Gối chưa gập đủ sâu",
-    "leg_not_behind": "Chân không ra sau"
-}
-
+# EXERCISE_NAMES / ERROR_NAMES (English to Vietnamese) live in vocabulary.py
 def get_vietnamese_exercise_name(exercise_type: str) -> str:
     """Convert exercise type to Vietnamese name"""
     return EXERCISE_NAMES.get(exercise_type, exercise_type)
@@ -90,11 +128,92 @@ security = HTTPBearer()
 
 # MediaPipe
 mp_pose = mp.solutions.pose
-pose = mp_pose.Pose(
-    min_detection_confidence=0.5,
-    min_tracking_confidence=0.5,
-    model_complexity=1
+pose_executor = PoseInferenceExecutor(
+    num_workers=POSE_WORKERS,
+    pool_size=POSE_POOL_SIZE,
+    model_complexity=POSE_MODEL_COMPLEXITY,
+    threads_per_worker=POSE_THREADS_PER_WORKER,
+    roi_size=POSE_ROI_SIZE,
+    decode_size=POSE_DECODE_SIZE
 )
+pipeline_stats = PipelineStats()
+pipeline_metrics = PipelineMetrics()
+pipeline_metrics.add_gauge('rehab_pose_graphs_free', 'Pose graphs not leased to a connection',
+                           lambda: pose_executor.available)
+db.add_hook(lambda pool, sql, ms: pipeline_metrics.queries.observe(pool, statement_kind(sql), ms))
+db.add_operation_hook(lambda name, wait_ms, run_ms: pipeline_metrics.db_operations.observe_stages(name, {'wait': wait_ms, 'run': run_ms}))
+pipeline_metrics.add_gauge('rehab_db_operations_queued', 'API database operations waiting for a DB thread',
+                           lambda: db.queued)
+pipeline_metrics.add_gauge('rehab_db_connections_opened_total', 'SQLite connections opened by the pools',
+                           lambda: db.pool.opened + db.read_pool.opened, kind='counter')
+pipeline_metrics.add_gauge('rehab_response_cache_entries', 'Responses held by the history/analytics cache',
+                           lambda: len(response_cache))
+pipeline_metrics.add_gauge('rehab_response_cache_bytes', 'Memory held by the history/analytics cache',
+                           lambda: response_cache.nbytes)
+pipeline_metrics.add_gauge('rehab_response_cache_hits_total', 'Cached responses served from memory',
+                           lambda: response_cache.hits, kind='counter')
+pipeline_metrics.add_gauge('rehab_response_cache_misses_total', 'Cacheable responses built from the database',
+                           lambda: response_cache.misses, kind='counter')
+pipeline_metrics.add_gauge('rehab_response_cache_not_modified_total', '304 responses to a current If-None-Match',
+                           lambda: response_cache.not_modified, kind='counter')
+pipeline_metrics.add_gauge('rehab_response_cache_evictions_total', 'Cached responses evicted to stay within the size bound',
+                           lambda: response_cache.evictions, kind='counter')
+frame_writer = FrameWriter(db.pool, FRAME_WRITE_BATCH, FRAME_FLUSH_MS, FRAME_QUEUE_SIZE, TIMESERIES_CHUNK_FRAMES)
+pipeline_metrics.add_gauge('rehab_frame_writer_queue', 'Session frames waiting to be written',
+                           lambda: frame_writer.queue.qsize())
+pipeline_metrics.add_gauge('rehab_frame_writer_written_total', 'Session frames written',
+                           lambda: frame_writer.written, kind='counter')
+pipeline_metrics.add_gauge('rehab_frame_writer_downsampled_total', 'Session frames skipped because the write queue was filling',
+                           lambda: frame_writer.downsampled, kind='counter')
+pipeline_metrics.add_gauge('rehab_frame_writer_dropped_total', 'Session frames dropped because the write queue was full',
+                           lambda: frame_writer.dropped, kind='counter')
+pipeline_metrics.add_gauge('rehab_frame_buffer_bytes', 'Memory held by the frame buffers of open sessions',
+                           lambda: frame_writer.buffered_bytes)
+pipeline_metrics.add_gauge('rehab_frame_buffer_session_peak_bytes', 'Largest frame buffer held by a single session',
+                           lambda: frame_writer.peak_session_bytes)
+
+
+@app.on_event("startup")
+def init_server():
+    """
+    Process setup that must not run at import time: spawned pose workers re-import
+    this module (as __mp_main__ under `python main.py`) and only need pose_workers
+    """
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    init_db()
+
+
+@app.on_event("startup")
+async def start_pose_workers():
+    await pose_executor.start()
+
+
+async def reap_idle_sessions():
+    while True:
+        await asyncio.sleep(SESSION_REAP_INTERVAL)
+        try:
+            for session in await db.call(session_registry.reclaim_idle):
+                session.release()
+        except Exception:
+            logger.exception("Idle session sweep failed")
+
+
+@app.on_event("startup")
+async def start_session_reaper():
+    app.state.session_reaper = asyncio.create_task(reap_idle_sessions())
+    frame_writer.start()
+
+
+@app.on_event("shutdown")
+async def stop_session_reaper():
+    app.state.session_reaper.cancel()
+    await frame_writer.stop()  # Flush frames still in the queue
+    db.close_all()
+
+
+@app.on_event("shutdown")
+async def stop_pose_workers():
+    pose_executor.shutdown()
 
 
 # ============= DATABASE =============
@@ -103,96 +222,12 @@ def hash_password(password: str) -> str:
 
 def init_db():
     """Initialize database with complete schema"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = db.connect()
     cursor = conn.cursor()
     
-    # Users table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            role TEXT NOT NULL CHECK(role IN ('patient', 'doctor')),
-            full_name TEXT,
-            age INTEGER,
-            gender TEXT CHECK(gender IN ('male', 'female', 'other')),
-            height_cm REAL,
-            weight_kg REAL,
-            bmi REAL,
-            medical_conditions TEXT,
-            injury_type TEXT,
-            mobility_level TEXT CHECK(mobility_level IN ('beginner', 'intermediate', 'advanced')),
-            pain_level INTEGER CHECK(pain_level BETWEEN 0 AND 10),
-            doctor_notes TEXT,
-            contraindicated_exercises TEXT,
-            created_at TEXT NOT NULL,
-            doctor_id INTEGER,
-            FOREIGN KEY (doctor_id) REFERENCES users(id)
-        )
-    """)
-    
-    # Sessions table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS sessions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            patient_id INTEGER NOT NULL,
-            exercise_name TEXT NOT NULL,
-            start_time TEXT NOT NULL,
-            end_time TEXT,
-            total_reps INTEGER DEFAULT 0,
-            correct_reps INTEGER DEFAULT 0,
-            accuracy REAL DEFAULT 0,
-            duration_seconds INTEGER DEFAULT 0,
-            avg_heart_rate INTEGER,
-            notes TEXT,
-            FOREIGN KEY (patient_id) REFERENCES users(id)
-        )
-    """)
-    
-    # Session frames table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS session_frames (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id INTEGER NOT NULL,
-            timestamp TEXT NOT NULL,
-            rep_count INTEGER,
-            angles TEXT,
-            errors TEXT,
-            FOREIGN KEY (session_id) REFERENCES sessions(id)
-        )
-    """)
-    
-    # Errors table (aggregated)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS session_errors (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id INTEGER NOT NULL,
-            error_name TEXT NOT NULL,
-            count INTEGER DEFAULT 0,
-            severity TEXT,
-            FOREIGN KEY (session_id) REFERENCES sessions(id)
-        )
-    """)
-    
-    # User exercise limits table (AI personalization)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS user_exercise_limits (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            exercise_type TEXT NOT NULL,
-            max_depth_angle REAL,
-            min_raise_angle REAL,
-            max_reps_per_set INTEGER,
-            recommended_rest_seconds INTEGER,
-            difficulty_score REAL,
-            injury_risk_score REAL,
-            created_at TEXT NOT NULL,
-            updated_at TEXT NOT NULL,
-            FOREIGN KEY (user_id) REFERENCES users(id)
-        )
-    """)
-    
-    conn.commit()
+    # Schema is created and upgraded by numbered migrations (see migrations.py)
+    for migration in migrate(conn):
+        logger.info("Applied schema migration %d: %s", migration.version, migration.description)
     
     # Create default users if not exist
     cursor.execute("SELECT COUNT(*) FROM users")
@@ -207,8 +242,8 @@ def init_db():
         
         # Default patients
         patients = [
-            ('patient1', 'patient123', 'Trần Thị B', 65, 'Nữ'),
-            ('patient2', 'patient123', 'Lê Văn C', 70, 'Nam'),
+            ('patient1', 'patient123', 'Trần Thị B', 65, 'female'),
+            ('patient2', 'patient123', 'Lê Văn C', 70, 'male'),
         ]
         
         for username, password, name, age, gender in patients:
@@ -221,8 +256,6 @@ def init_db():
     
     conn.close()
 
-init_db()
-
 
 # ============= AUTH MODELS =============
 
@@ -286,155 +319,137 @@ def get_current_user(token_data = Depends(verify_token)):
 
 # ============= POSE LOGIC (from V2) =============
 
+# Landmarks each exercise's rules look at - sent to compact clients that ask for landmarks='exercise'
+_L = mp_pose.PoseLandmark
+EXERCISE_LANDMARKS = {
+    'squat': [_L.LEFT_SHOULDER, _L.RIGHT_SHOULDER, _L.LEFT_HIP, _L.RIGHT_HIP,
+              _L.LEFT_KNEE, _L.RIGHT_KNEE, _L.LEFT_ANKLE, _L.RIGHT_ANKLE],
+    'arm_raise': [_L.LEFT_SHOULDER, _L.RIGHT_SHOULDER, _L.LEFT_ELBOW, _L.RIGHT_ELBOW,
+                  _L.LEFT_WRIST, _L.RIGHT_WRIST, _L.LEFT_HIP, _L.RIGHT_HIP],
+    'single_leg_stand': [_L.LEFT_SHOULDER, _L.RIGHT_SHOULDER, _L.LEFT_HIP, _L.RIGHT_HIP,
+                         _L.LEFT_KNEE, _L.RIGHT_KNEE, _L.LEFT_ANKLE, _L.RIGHT_ANKLE],
+    'calf_raise': [_L.LEFT_HIP, _L.RIGHT_HIP, _L.LEFT_KNEE, _L.RIGHT_KNEE, _L.LEFT_ANKLE, _L.RIGHT_ANKLE,
+                   _L.LEFT_HEEL, _L.RIGHT_HEEL, _L.LEFT_FOOT_INDEX, _L.RIGHT_FOOT_INDEX],
+}
+EXERCISE_LANDMARKS = {exercise: sorted(int(lm) for lm in lms) for exercise, lms in EXERCISE_LANDMARKS.items()}
+
+# Joint angles per exercise: name -> (A, B, C), angle measured at B
+ANGLE_TRIPLETS = {
+    'squat': [
+        ('left_knee', (_L.LEFT_HIP, _L.LEFT_KNEE, _L.LEFT_ANKLE)),
+        ('right_knee', (_L.RIGHT_HIP, _L.RIGHT_KNEE, _L.RIGHT_ANKLE)),
+    ],
+    'arm_raise': [
+        ('left_shoulder', (_L.LEFT_HIP, _L.LEFT_SHOULDER, _L.LEFT_ELBOW)),
+        ('right_shoulder', (_L.RIGHT_HIP, _L.RIGHT_SHOULDER, _L.RIGHT_ELBOW)),
+        ('left_elbow', (_L.LEFT_SHOULDER, _L.LEFT_ELBOW, _L.LEFT_WRIST)),
+        ('right_elbow', (_L.RIGHT_SHOULDER, _L.RIGHT_ELBOW, _L.RIGHT_WRIST)),
+    ],
+    'single_leg_stand': [
+        # GÓC KNEE FLEXION (gập gối): HIP -> KNEE -> ANKLE
+        ('left_knee', (_L.LEFT_HIP, _L.LEFT_KNEE, _L.LEFT_ANKLE)),
+        ('right_knee', (_L.RIGHT_HIP, _L.RIGHT_KNEE, _L.RIGHT_ANKLE)),
+    ],
+    'calf_raise': [
+        # Góc mắt cá chân (ankle)
+        ('left_ankle', (_L.LEFT_KNEE, _L.LEFT_ANKLE, _L.LEFT_FOOT_INDEX)),
+        ('right_ankle', (_L.RIGHT_KNEE, _L.RIGHT_ANKLE, _L.RIGHT_FOOT_INDEX)),
+        # Góc gối (đảm bảo chân thẳng)
+        ('left_knee', (_L.LEFT_HIP, _L.LEFT_KNEE, _L.LEFT_ANKLE)),
+        ('right_knee', (_L.RIGHT_HIP, _L.RIGHT_KNEE, _L.RIGHT_ANKLE)),
+    ],
+}
+
+# Raw coordinates per exercise: name -> (landmark, axis, reference landmark or None)
+# With a reference the value is landmark[axis] - reference[axis]
+_Y, _Z = 1, 2
+POSITION_FEATURES = {
+    'single_leg_stand': [
+        # KIỂM TRA CHÂN RA SAU bằng Z-coordinate: knee.z - hip.z > 0 => chân ra SAU
+        ('left_leg_behind', (_L.LEFT_KNEE, _Z, _L.LEFT_HIP)),
+        ('right_leg_behind', (_L.RIGHT_KNEE, _Z, _L.RIGHT_HIP)),
+        # Keep Y positions for height check
+        ('left_knee_y', (_L.LEFT_KNEE, _Y, None)),
+        ('right_knee_y', (_L.RIGHT_KNEE, _Y, None)),
+        ('left_hip_y', (_L.LEFT_HIP, _Y, None)),
+        ('right_hip_y', (_L.RIGHT_HIP, _Y, None)),
+    ],
+    'calf_raise': [
+        # Vị trí Y của gót và mũi chân
+        ('left_heel_y', (_L.LEFT_HEEL, _Y, None)),
+        ('right_heel_y', (_L.RIGHT_HEEL, _Y, None)),
+        ('left_foot_index_y', (_L.LEFT_FOOT_INDEX, _Y, None)),
+        ('right_foot_index_y', (_L.RIGHT_FOOT_INDEX, _Y, None)),
+    ],
+}
+del _L
+
+
+class _AngleTable:
+    """Index arrays for one exercise, built once at import"""
+
+    def __init__(self, triplets, positions):
+        self.angle_names = [name for name, _ in triplets]
+        self.triplets = np.array([[int(i) for i in joints] for _, joints in triplets], dtype=np.intp).reshape(-1, 3)
+        # Position features are linear in the flattened (33 * 4) landmarks: one matmul computes them all
+        self.position_names = [name for name, _ in positions]
+        self.position_weights = np.zeros((NUM_LANDMARKS * 4, len(positions)), dtype=np.float32)
+        for column, (_, (landmark, axis, reference)) in enumerate(positions):
+            self.position_weights[int(landmark) * 4 + axis, column] = 1.0
+            if reference is not None:
+                self.position_weights[int(reference) * 4 + axis, column] = -1.0
+
+
+ANGLE_TABLES = {
+    exercise: _AngleTable(ANGLE_TRIPLETS.get(exercise, []), POSITION_FEATURES.get(exercise, []))
+    for exercise in set(ANGLE_TRIPLETS) | set(POSITION_FEATURES)
+}
+
+
 class AngleCalculator:
     @staticmethod
     def calculate_angle(point1, point2, point3):
-        a = np.array([point1.x, point1.y])
-        b = np.array([point2.x, point2.y])
-        c = np.array([point3.x, point3.y])
-        
-        ba = a - b
-        bc = c - b
-        
-        cosine_angle = np.dot(ba, bc) / (np.linalg.norm(ba) * np.linalg.norm(bc) + 1e-6)
-        angle = np.arccos(np.clip(cosine_angle, -1.0, 1.0))
-        
-        return np.degrees(angle)
+        points = np.array([[point1.x, point1.y], [point2.x, point2.y], [point3.x, point3.y]], dtype=np.float32)
+        return float(AngleCalculator.joint_angles(points, np.array([[0, 1, 2]]))[0])
     
     @staticmethod
-    def get_angles(landmarks, exercise_type):
-        if exercise_type == "squat":
-            return {
-                'left_knee': AngleCalculator.calculate_angle(
-                    landmarks[mp_pose.PoseLandmark.LEFT_HIP],
-                    landmarks[mp_pose.PoseLandmark.LEFT_KNEE],
-                    landmarks[mp_pose.PoseLandmark.LEFT_ANKLE]
-                ),
-                'right_knee': AngleCalculator.calculate_angle(
-                    landmarks[mp_pose.PoseLandmark.RIGHT_HIP],
-                    landmarks[mp_pose.PoseLandmark.RIGHT_KNEE],
-                    landmarks[mp_pose.PoseLandmark.RIGHT_ANKLE]
-                ),
-            }
-        elif exercise_type == "arm_raise":
-            return {
-                'left_shoulder': AngleCalculator.calculate_angle(
-                    landmarks[mp_pose.PoseLandmark.LEFT_HIP],
-                    landmarks[mp_pose.PoseLandmark.LEFT_SHOULDER],
-                    landmarks[mp_pose.PoseLandmark.LEFT_ELBOW]
-                ),
-                'right_shoulder': AngleCalculator.calculate_angle(
-                    landmarks[mp_pose.PoseLandmark.RIGHT_HIP],
-                    landmarks[mp_pose.PoseLandmark.RIGHT_SHOULDER],
-                    landmarks[mp_pose.PoseLandmark.RIGHT_ELBOW]
-                ),
-                'left_elbow': AngleCalculator.calculate_angle(
-                    landmarks[mp_pose.PoseLandmark.LEFT_SHOULDER],
-                    landmarks[mp_pose.PoseLandmark.LEFT_ELBOW],
-                    landmarks[mp_pose.PoseLandmark.LEFT_WRIST]
-                ),
-                'right_elbow': AngleCalculator.calculate_angle(
-                    landmarks[mp_pose.PoseLandmark.RIGHT_SHOULDER],
-                    landmarks[mp_pose.PoseLandmark.RIGHT_ELBOW],
-                    landmarks[mp_pose.PoseLandmark.RIGHT_WRIST]
-                ),
-            }
-        # ✅ THÊM MỚI: single_leg_stand
-        elif exercise_type == "single_leg_stand":
-            # GÓC KNEE FLEXION (gập gối): HIP -> KNEE -> ANKLE
-            left_knee_flexion = AngleCalculator.calculate_angle(
-                landmarks[mp_pose.PoseLandmark.LEFT_HIP],
-                landmarks[mp_pose.PoseLandmark.LEFT_KNEE],
-                landmarks[mp_pose.PoseLandmark.LEFT_ANKLE]
-            )
-            right_knee_flexion = AngleCalculator.calculate_angle(
-                landmarks[mp_pose.PoseLandmark.RIGHT_HIP],
-                landmarks[mp_pose.PoseLandmark.RIGHT_KNEE],
-                landmarks[mp_pose.PoseLandmark.RIGHT_ANKLE]
-            )
-
-            # KIỂM TRA CHÂN RA SAU bằng Z-coordinate (độ sâu)
-            # Nếu knee.z > hip.z => chân ra SAU (gối xa camera hơn hông)
-            left_knee_z = landmarks[mp_pose.PoseLandmark.LEFT_KNEE].z
-            left_hip_z = landmarks[mp_pose.PoseLandmark.LEFT_HIP].z
-            left_leg_behind = left_knee_z - left_hip_z  # Dương = ra sau, Âm = ra trước
-
-            right_knee_z = landmarks[mp_pose.PoseLandmark.RIGHT_KNEE].z
-            right_hip_z = landmarks[mp_pose.PoseLandmark.RIGHT_HIP].z
-            right_leg_behind = right_knee_z - right_hip_z  # Dương = ra sau, Âm = ra trước
-
-            angles = {
-                # Gập gối (knee flexion)
-                'left_knee': left_knee_flexion,
-                'right_knee': right_knee_flexion,
-
-                # Chân ra sau (dùng Z-coordinate thay vì góc)
-                'left_leg_behind': left_leg_behind,
-                'right_leg_behind': right_leg_behind,
-
-                # Keep Y positions for height check
-                'left_knee_y': landmarks[mp_pose.PoseLandmark.LEFT_KNEE].y,
-                'right_knee_y': landmarks[mp_pose.PoseLandmark.RIGHT_KNEE].y,
-                'left_hip_y': landmarks[mp_pose.PoseLandmark.LEFT_HIP].y,
-                'right_hip_y': landmarks[mp_pose.PoseLandmark.RIGHT_HIP].y,
-            }
-
-            # Debug information
-            print(f"🦵 Left - Knee Flexion: {left_knee_flexion:.1f}°, Leg Behind: {left_leg_behind:.3f} {'✅RA SAU' if left_leg_behind > 0.05 else '❌RA TRƯỚC'}")
-            print(f"🦵 Right - Knee Flexion: {right_knee_flexion:.1f}°, Leg Behind: {right_leg_behind:.3f} {'✅RA SAU' if right_leg_behind > 0.05 else '❌RA TRƯỚC'}")
-
-            return angles
-
-        # ✅ THÊM MỚI: calf_raise
-        elif exercise_type == "calf_raise":
-            # Tính góc mắt cá chân (ankle)
-            left_ankle_angle = AngleCalculator.calculate_angle(
-                landmarks[mp_pose.PoseLandmark.LEFT_KNEE],
-                landmarks[mp_pose.PoseLandmark.LEFT_ANKLE],
-                landmarks[mp_pose.PoseLandmark.LEFT_FOOT_INDEX]
-            )
-            right_ankle_angle = AngleCalculator.calculate_angle(
-                landmarks[mp_pose.PoseLandmark.RIGHT_KNEE],
-                landmarks[mp_pose.PoseLandmark.RIGHT_ANKLE],
-                landmarks[mp_pose.PoseLandmark.RIGHT_FOOT_INDEX]
-            )
-            
-            # Tính góc gối (đảm bảo chân thẳng)
-            left_knee_angle = AngleCalculator.calculate_angle(
-                landmarks[mp_pose.PoseLandmark.LEFT_HIP],
-                landmarks[mp_pose.PoseLandmark.LEFT_KNEE],
-                landmarks[mp_pose.PoseLandmark.LEFT_ANKLE]
-            )
-            right_knee_angle = AngleCalculator.calculate_angle(
-                landmarks[mp_pose.PoseLandmark.RIGHT_HIP],
-                landmarks[mp_pose.PoseLandmark.RIGHT_KNEE],
-                landmarks[mp_pose.PoseLandmark.RIGHT_ANKLE]
-            )
-            
-            # Lấy vị trí Y của gót và mũi chân
-            left_heel_y = landmarks[mp_pose.PoseLandmark.LEFT_HEEL].y
-            right_heel_y = landmarks[mp_pose.PoseLandmark.RIGHT_HEEL].y
-            left_foot_index_y = landmarks[mp_pose.PoseLandmark.LEFT_FOOT_INDEX].y
-            right_foot_index_y = landmarks[mp_pose.PoseLandmark.RIGHT_FOOT_INDEX].y
-            
-            angles = {
-                'left_ankle': left_ankle_angle,
-                'right_ankle': right_ankle_angle,
-                'left_knee': left_knee_angle,
-                'right_knee': right_knee_angle,
-                'left_heel_y': left_heel_y,
-                'right_heel_y': right_heel_y,
-                'left_foot_index_y': left_foot_index_y,
-                'right_foot_index_y': right_foot_index_y,
-            }
-            
-            # Debug
-            print(f"Ankle angles - Left: {left_ankle_angle:.1f}°, Right: {right_ankle_angle:.1f}°")
-            print(f"Heel height - Left: {left_heel_y:.3f}, Right: {right_heel_y:.3f}")
+    def joint_angles(landmark_array, triplets):
+        """
+        Angles in degrees at the middle joint of every (A, B, C) triplet
 
-            return angles
+        landmark_array is (..., 33, >=2); returns (..., k) for k triplets.
+        """
+        points = landmark_array[..., triplets, :2]  # (..., k, 3, 2)
+        vectors = points - points[..., 1:2, :]
+        ba = vectors[..., 0, :]
+        bc = vectors[..., 2, :]
+        dot = (ba * bc).sum(axis=-1)
+        norms = np.sqrt((ba * ba).sum(axis=-1) * (bc * bc).sum(axis=-1))
+        cosine_angle = dot / (norms + 1e-6)
+        return np.degrees(np.arccos(np.clip(cosine_angle, -1.0, 1.0)))
+    
+    @staticmethod
+    def get_angles(landmarks, exercise_type):
+        """
+        Angles and position features for an exercise
 
-        return {}
+        landmarks may be a list of landmark objects, a (33, 4) array (returns
+        a dict of floats) or an (N, 33, 4) batch (returns a dict of (N,) arrays).
+        """
+        table = ANGLE_TABLES.get(exercise_type)
+        if table is None:
+            return {}
+        
+        landmark_array = landmarks if isinstance(landmarks, np.ndarray) else landmarks_to_array(landmarks)
+        batched = landmark_array.ndim == 3
+        
+        angles = AngleCalculator.joint_angles(landmark_array, table.triplets)
+        positions = landmark_array.reshape(*landmark_array.shape[:-2], -1) @ table.position_weights
+        
+        if batched:
+            columns = [angles[:, i] for i in range(angles.shape[1])] + [positions[:, i] for i in range(positions.shape[1])]
+            return dict(zip(table.angle_names + table.position_names, columns))
+        return dict(zip(table.angle_names + table.position_names, angles.tolist() + positions.tolist()))
 
 
 class ExerciseState(Enum):
@@ -453,6 +468,8 @@ class RepetitionCounter:
     def __init__(self, exercise_type):
         self.exercise_type = exercise_type
         self.rep_count = 0
+        # Frames + state transitions for debugging (replaces per-frame print)
+        self.trace = SessionTrace(exercise_type, TRACE_CAPACITY, TRACE_SAMPLE_EVERY, trace_log_limiter)
 
         # Khởi tạo state dựa trên exercise type
         if exercise_type == "single_leg_stand":
@@ -509,24 +526,30 @@ class RepetitionCounter:
         """Called when a rep is completed - save errors for this rep"""
         self.rep_count += 1
         self.all_rep_errors.append(list(self.current_rep_errors))
-        print(f"✅ Rep {self.rep_count} completed! Errors in this rep: {list(self.current_rep_errors)}")
-        print(f"   Total all_rep_errors so far: {self.all_rep_errors}")
+        self.trace.event('rep_completed', rep=self.rep_count, errors=list(self.current_rep_errors))
         self.current_rep_errors.clear()  # Reset for next rep
         self.rep_completed = True
     
     def update(self, angles):
         """Update state machine and return current rep count"""
         self.rep_completed = False  # Reset flag
+        previous_state = self.state
         
         if self.exercise_type == "arm_raise":
-            return self._count_arm_raise(angles)
+            rep_count = self._count_arm_raise(angles)
         elif self.exercise_type == "squat":
-            return self._count_squat(angles)
+            rep_count = self._count_squat(angles)
         elif self.exercise_type == "single_leg_stand":
-            return self._count_single_leg(angles)
+            rep_count = self._count_single_leg(angles)
         elif self.exercise_type == "calf_raise":
-            return self._count_calf_raise(angles)
-        return self.rep_count
+            rep_count = self._count_calf_raise(angles)
+        else:
+            rep_count = self.rep_count
+        
+        if self.state != previous_state:
+            self.trace.event('state', previous=previous_state.value, state=self.state.value)
+        self.trace.frame(rep_count, self.state.value, angles)
+        return rep_count
     
     def _count_single_leg(self, angles):
         """State machine for single leg stand - CHÂN RA SAU"""
@@ -550,11 +573,6 @@ class RepetitionCounter:
         # Tư thế đúng khi: gối gập + chân ra sau
         is_correct_position = knee_bent_enough and leg_behind
 
-        # Debug information
-        print(f"🎯 {self.current_side.upper()} side:")
-        print(f"   Knee Flexion: {knee_flexion:.1f}° ({'✅' if knee_bent_enough else '❌'} <50°)")
-        print(f"   Leg Behind: {leg_behind_value:.3f} ({'✅' if leg_behind else '❌'} >0.05)")
-        print(f"   Correct Position: {'✅ YES' if is_correct_position else '❌ NO'}")
         
         # State machine
         if self.state == ExerciseState.READY:
@@ -590,7 +608,7 @@ class RepetitionCounter:
                     self.state = ExerciseState.LOWERING
                     self.hold_start_time = None
                     self.last_state_change = current_time
-                    print(f"⚠️ Mất tư thế! Knee: {knee_flexion:.1f}°, Leg Behind: {leg_behind_value:.3f}")
+                    self.trace.event('position_lost', side=self.current_side, knee=round(knee_flexion, 1), leg_behind=round(leg_behind_value, 3))
 
                 elif elapsed >= self.hold_duration:
                     # Giữ đủ 10 giây!
@@ -601,10 +619,9 @@ class RepetitionCounter:
                     # Mark side as completed
                     if self.current_side == "left":
                         self.left_completed = True
-                        print("✅ Hoàn thành bên TRÁI!")
                     else:
                         self.right_completed = True
-                        print("✅ Hoàn thành bên PHẢI!")
+                    self.trace.event('side_completed', side=self.current_side)
 
         elif self.state == ExerciseState.LOWERING:
             # Lowering the leg - đang hạ chân xuống
@@ -618,13 +635,12 @@ class RepetitionCounter:
                     self.left_completed = False
                     self.right_completed = False
                     self.last_state_change = current_time
-                    print("🎉 Hoàn thành CẢ 2 BÊN! +1 Rep")
                 else:
                     # Switch to other side
                     self.state = ExerciseState.SWITCH_SIDE
                     self.current_side = "right" if self.current_side == "left" else "left"
                     self.last_state_change = current_time
-                    print(f"🔄 Chuyển sang bên {self.current_side.upper()}")
+                    self.trace.event('side_switch', side=self.current_side)
                     
         elif self.state == ExerciseState.SWITCH_SIDE:
             # Wait a moment, then ready for other side
@@ -1100,66 +1116,66 @@ class ErrorDetector:
     
     # ✅ Xóa các methods không còn dùng
     # _should_report_error và _cleanup_timers không còn cần thiết
-# ============= SESSION MANAGER =============
-
-class SessionManager:
-    def __init__(self):
-        self.current_session = None
-        self.frame_data = []
-        self.active_rep_counter: Optional[RepetitionCounter] = None  # ✅ Reference to active rep counter
-    
-    def start_session(self, patient_id: int, exercise_name: str):
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT INTO sessions (patient_id, exercise_name, start_time)
-            VALUES (?, ?, ?)
-        """, (patient_id, exercise_name, datetime.now().isoformat()))
-        
-        session_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        
-        self.current_session = {
-            'id': session_id,
-            'patient_id': patient_id,
-            'exercise_name': exercise_name
-        }
-        self.frame_data = []
-        
-        return session_id
-    
-    def log_frame(self, rep_count: int, angles: dict, errors: list):
-        if not self.current_session:
-            return
-        
-        self.frame_data.append({
-            'timestamp': datetime.now().isoformat(),
-            'rep_count': rep_count,
-            'angles': angles,
-            'errors': errors
-        })
-    
-    def end_session(self):
-        if not self.current_session:
-            return None
-        
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Get session start time
-        cursor.execute("SELECT start_time FROM sessions WHERE id = ?", (self.current_session['id'],))
-        start_time_str = cursor.fetchone()[0]
-        start_time = datetime.fromisoformat(start_time_str)
+# ============= SESSION REGISTRY =============
+
+class ExerciseSession:
+    """State of one started session; every mutation happens under `lock`"""
+    
+    def __init__(self, session_id: int, patient_id: int, exercise_name: str, start_time: datetime):
+        self.id = session_id
+        self.patient_id = patient_id
+        self.exercise_name = exercise_name
+        self.start_time = start_time
+        self.rep_counter: Optional[RepetitionCounter] = None  # ✅ Set when a WebSocket binds
+        self.connections = 0
+        self.last_activity = time.monotonic()
+        self.ended = False
+        self.doctor_id: Optional[int] = None  # Looked up by start_session() and finish()
+        self.lock = threading.Lock()
+    
+    def attach(self, exercise_type: str) -> RepetitionCounter:
+        """Bind a WebSocket; a reconnect to the same exercise keeps the rep count"""
+        with self.lock:
+            if self.rep_counter is None or self.rep_counter.exercise_type != exercise_type:
+                self.rep_counter = RepetitionCounter(exercise_type)
+                self.rep_counter.trace.session_id = self.id
+            self.connections += 1
+            self.last_activity = time.monotonic()
+            return self.rep_counter
+    
+    def detach(self):
+        with self.lock:
+            self.connections -= 1
+            self.last_activity = time.monotonic()
+    
+    def log_frame(self, rep_count: int, state: str, angles: dict, errors: list):
+        """Queue the frame for the session's time series (written in chunks by frame_writer)"""
+        with self.lock:
+            if self.ended:
+                return
+            self.last_activity = time.monotonic()
+        frame_writer.submit(self.id, time.time(), rep_count, state, angles, errors)
+    
+    def finish(self):
+        """
+        Write the summary to the database; returns it (None if already ended)
+        Runs on a DB pool thread: the caller must release() the session on the event loop afterwards
+        """
+        # Only the state change is under the lock: log_frame()/attach() take it on the event loop
+        with self.lock:
+            if self.ended:
+                return None
+            self.ended = True
+            rep_counter = self.rep_counter
+            start_time = self.start_time
         
         end_time = datetime.now()
         duration = (end_time - start_time).seconds
         
         # ✅ GET ERROR SUMMARY FROM REP COUNTER (instead of counting frames)
         error_counts = {}
-        if self.active_rep_counter:
-            error_summary = self.active_rep_counter.get_error_summary()
+        if rep_counter:
+            error_summary = rep_counter.get_error_summary()
             # Convert to format expected by database
             for error_name, count in error_summary.items():
                 error_counts[error_name] = {
@@ -1168,77 +1184,167 @@ class SessionManager:
                 }
         
         # Calculate stats
-        total_reps = self.active_rep_counter.rep_count if self.active_rep_counter else 0
+        total_reps = rep_counter.rep_count if rep_counter else 0
         
         # ✅ Calculate accuracy: Count reps with NO errors (empty error list)
         correct_reps = 0
-        if self.active_rep_counter and self.active_rep_counter.all_rep_errors:
+        if rep_counter and rep_counter.all_rep_errors:
             # A rep is correct if its error list is EMPTY
-            correct_reps = sum(1 for rep_errors in self.active_rep_counter.all_rep_errors if len(rep_errors) == 0)
-            
-            # Debug log
-            print(f"\n📊 SESSION SUMMARY:")
-            print(f"   Total reps: {total_reps}")
-            print(f"   All rep errors: {self.active_rep_counter.all_rep_errors}")
-            print(f"   Correct reps (no errors): {correct_reps}")
-            for i, rep_errors in enumerate(self.active_rep_counter.all_rep_errors, 1):
-                if len(rep_errors) == 0:
-                    print(f"   Rep {i}: ✅ CORRECT (no errors)")
-                else:
-                    print(f"   Rep {i}: ❌ ERRORS: {rep_errors}")
+            correct_reps = sum(1 for rep_errors in rep_counter.all_rep_errors if len(rep_errors) == 0)
+            logger.info("Session %s summary: %d reps, %d correct", self.id, total_reps, correct_reps)
         
         accuracy = (correct_reps / total_reps * 100) if total_reps > 0 else 0
         
+        conn = db.connect()
+        cursor = conn.cursor()
+        
         # Update session
         cursor.execute("""
             UPDATE sessions
             SET end_time = ?, total_reps = ?, correct_reps = ?, accuracy = ?, duration_seconds = ?
             WHERE id = ?
-        """, (end_time.isoformat(), total_reps, correct_reps, accuracy, duration, self.current_session['id']))
+        """, (end_time.isoformat(), total_reps, correct_reps, accuracy, duration, self.id))
         
         # Save error stats (now per-rep counts, not per-frame!)
         for error_name, info in error_counts.items():
             cursor.execute("""
                 INSERT INTO session_errors (session_id, error_name, count, severity)
                 VALUES (?, ?, ?, ?)
-            """, (self.current_session['id'], error_name, info['count'], info['severity']))
+            """, (self.id, error_name, info['count'], info['severity']))
+        
+        # Keep the error analytics rollup current in the same transaction
+        record_session_errors(cursor, self.patient_id, self.exercise_name,
+                              {name: info['count'] for name, info in error_counts.items()},
+                              start_time.isoformat())
+        record_daily_activity(cursor, self.patient_id, start_time.date().isoformat(), self.exercise_name,
+                              total_reps, correct_reps, duration)
         
         conn.commit()
+        doctor = cursor.execute("SELECT doctor_id FROM users WHERE id = ?", (self.patient_id,)).fetchone()
         conn.close()
+        self.doctor_id = doctor[0] if doctor else None
         
-        result = {
-            'session_id': self.current_session['id'],
+        return {
+            'session_id': self.id,
             'total_reps': total_reps,
             'correct_reps': correct_reps,
             'accuracy': round(accuracy, 2),
             'duration_seconds': duration,
             'common_errors': error_counts
         }
+
+
+    def release(self):
+        """Event-loop side of finish() (frame_writer's queue and the caches are not thread-safe)"""
+        # Cached history/analytics of this patient (and their doctor's patient list) are now stale
+        response_cache.bump(self.patient_id, self.doctor_id)
+        if self.rep_counter:
+            finished_traces.add(self.id, self.rep_counter.trace)
+        frame_writer.close_session(self.id)
+
+
+class SessionRegistry:
+    """
+    Active sessions keyed by session id, one per patient
+
+    Starting a new session ends the patient's previous one. Sessions with no
+    connected WebSocket and no activity for `idle_timeout` seconds are ended
+    by reclaim_idle().
+    
+    The methods run on DB pool threads; every session they end is returned
+    and must be release()d on the event loop.
+    """
+    
+    def __init__(self, idle_timeout: float):
+        self.idle_timeout = idle_timeout
+        self._sessions: Dict[int, ExerciseSession] = {}
+        self._by_patient: Dict[int, int] = {}
+        self._lock = threading.Lock()
+    
+    def start_session(self, patient_id: int, exercise_name: str) -> Tuple[ExerciseSession, Optional[ExerciseSession]]:
+        """The new session, and the patient's previous one if starting this one ended it"""
+        previous = self._pop(self._by_patient.get(patient_id))
+        if previous and previous.finish() is None:
+            previous = None  # Already ended (and released) elsewhere
         
-        self.current_session = None
-        self.frame_data = []
-        self.active_rep_counter = None  # ✅ Clear reference
+        start_time = datetime.now()
+        conn = db.connect()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            INSERT INTO sessions (patient_id, exercise_name, start_time)
+            VALUES (?, ?, ?)
+        """, (patient_id, exercise_name, start_time.isoformat()))
         
-        return result
+        session_id = cursor.lastrowid
+        conn.commit()
+        doctor = cursor.execute("SELECT doctor_id FROM users WHERE id = ?", (patient_id,)).fetchone()
+        conn.close()
+        
+        session = ExerciseSession(session_id, patient_id, exercise_name, start_time)
+        session.doctor_id = doctor[0] if doctor else None
+        with self._lock:
+            self._sessions[session_id] = session
+            self._by_patient[patient_id] = session_id
+        return session, previous
+    
+    def get(self, session_id: int, patient_id: Optional[int] = None) -> Optional[ExerciseSession]:
+        """Active session by id; with patient_id, only if it belongs to that patient"""
+        session = self._sessions.get(session_id)
+        if session is None or (patient_id is not None and session.patient_id != patient_id):
+            return None
+        return session
+    
+    def _pop(self, session_id: Optional[int]) -> Optional[ExerciseSession]:
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session and self._by_patient.get(session.patient_id) == session_id:
+                del self._by_patient[session.patient_id]
+            return session
+    
+    def end_session(self, session_id: int, patient_id: int) -> Optional[Tuple[ExerciseSession, dict]]:
+        """End a patient's session: (session, summary), or None if it is not an active session of theirs"""
+        if self.get(session_id, patient_id) is None:
+            return None
+        session = self._pop(session_id)
+        summary = session.finish() if session else None
+        return (session, summary) if summary is not None else None
+    
+    def reclaim_idle(self) -> List[ExerciseSession]:
+        """End abandoned sessions; returns the ones reclaimed"""
+        now = time.monotonic()
+        idle = [
+            session for session in list(self._sessions.values())
+            if session.connections <= 0 and now - session.last_activity > self.idle_timeout
+        ]
+        reclaimed = []
+        for session in idle:
+            if self._pop(session.id):
+                logger.info("Reclaiming idle session %s", session.id)
+                if session.finish() is not None:
+                    reclaimed.append(session)
+        return reclaimed
+    
+    def __len__(self):
+        return len(self._sessions)
 
 
-session_manager = SessionManager()
+session_registry = SessionRegistry(SESSION_IDLE_TIMEOUT)
+pipeline_metrics.add_gauge('rehab_active_sessions', 'Started sessions that have not ended yet',
+                           lambda: len(session_registry))
 
 
 # ============= API ROUTES =============
 
 @app.post("/api/auth/login")
 async def login(request: LoginRequest):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT id, username, role, full_name, age, gender, doctor_id
-        FROM users WHERE username = ? AND password_hash = ?
-    """, (request.username, hash_password(request.password)))
+    def query(conn):
+        return conn.execute("""
+            SELECT id, username, role, full_name, age, gender, doctor_id
+            FROM users WHERE username = ? AND password_hash = ?
+        """, (request.username, hash_password(request.password))).fetchone()
     
-    user = cursor.fetchone()
-    conn.close()
+    user = await db.run(query, readonly=True)
     
     if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
@@ -1263,10 +1369,8 @@ async def login(request: LoginRequest):
 
 @app.post("/api/auth/register")
 async def register(request: RegisterRequest):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    try:
+    def query(conn):
+        cursor = conn.cursor()
         cursor.execute("""
             INSERT INTO users (username, password_hash, role, full_name, age, gender, created_at, doctor_id)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
@@ -1280,25 +1384,27 @@ async def register(request: RegisterRequest):
             datetime.now().isoformat(),
             request.doctor_id
         ))
-        
-        user_id = cursor.lastrowid
         conn.commit()
-        
-        token = create_token(user_id, request.username, request.role)
-        
-        return {
-            'token': token,
-            'user': {
-                'id': user_id,
-                'username': request.username,
-                'role': request.role,
-                'full_name': request.full_name
-            }
-        }
+        return cursor.lastrowid
+    
+    try:
+        user_id = await db.run(query)
     except sqlite3.IntegrityError:
         raise HTTPException(status_code=400, detail="Username already exists")
-    finally:
-        conn.close()
+    if request.role == 'patient':
+        response_cache.bump(doctor_id=request.doctor_id)  # New entry in the doctor's patient list
+    
+    token = create_token(user_id, request.username, request.role)
+    
+    return {
+        'token': token,
+        'user': {
+            'id': user_id,
+            'username': request.username,
+            'role': request.role,
+            'full_name': request.full_name
+        }
+    }
 
 
 @app.get("/api/exercises")
@@ -1315,282 +1421,373 @@ async def get_exercises(current_user = Depends(get_current_user)):
 
 @app.post("/api/sessions/start")
 async def start_session(exercise_name: str, current_user = Depends(get_current_user)):
-    session_id = session_manager.start_session(current_user['user_id'], exercise_name)
-    return {'session_id': session_id}
+    session, previous = await db.call(session_registry.start_session, current_user['user_id'], exercise_name)
+    if previous:
+        previous.release()
+    response_cache.bump(session.patient_id, session.doctor_id)  # The new session shows in their history and patient list
+    return {'session_id': session.id}
 
 
 @app.post("/api/sessions/{session_id}/end")
 async def end_session(session_id: int, current_user = Depends(get_current_user)):
-    result = session_manager.end_session()
-    return result
+    ended = await db.call(session_registry.end_session, session_id, current_user['user_id'])
+    if ended is None:
+        raise HTTPException(status_code=404, detail="No active session with this id")
+    session, summary = ended
+    session.release()
+    return summary
 
 
-@app.get("/api/sessions/my-history")
-async def get_my_history(limit: int = 20, current_user = Depends(get_current_user)):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT id, exercise_name, start_time, total_reps, correct_reps, accuracy, duration_seconds
-        FROM sessions
-        WHERE patient_id = ?
-        ORDER BY start_time DESC
-        LIMIT ?
-    """, (current_user['user_id'], limit))
-
-    sessions = []
-    for row in cursor.fetchall():
-        # Get errors for this session
+async def cached_json(request: Request, user_id: int, scope: Scope, build, vary: tuple = ()) -> Response:
+    """
+    Serve the JSON of `await build()` through response_cache
+    Keyed by (path, query, user, *vary) and versioned by the generation of `scope`; a current
+    If-None-Match gets a 304 before anything is queried or serialized
+    """
+    key = (request.url.path, tuple(sorted(request.query_params.multi_items())), user_id, *vary)
+    etag = response_cache.etag(key, scope)  # Taken before the query, so the body is never older than its ETag
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if response_cache.matches(request.headers.get('if-none-match'), etag):
+        response_cache.not_modified += 1
+        return Response(status_code=304, headers=headers)
+    
+    body = response_cache.get(key, etag)
+    if body is None:
+        body = JSONResponse(await build()).body
+        response_cache.put(key, etag, body)
+    return Response(body, media_type='application/json', headers=headers)
+
+
+def parse_history_cursor(before: Optional[str]):
+    """`before=<start_time>,<id>` from a previous page's next_before"""
+    if not before:
+        return None
+    start_time, _, session_id = before.rpartition(',')
+    if not start_time or not session_id.isdigit():
+        raise HTTPException(status_code=400, detail="before must be '<start_time>,<session id>'")
+    return start_time, int(session_id)
+
+
+def fetch_session_history(cursor, patient_id: int, limit: int, before: Optional[str]):
+    """
+    One page of a patient's sessions, newest first, with their errors
+    Keyset pagination on (start_time, id) keeps every page an index range scan; two queries per page
+    """
+    limit = max(1, min(limit, HISTORY_MAX_LIMIT))
+    keyset = parse_history_cursor(before)
+    if keyset is None:
+        cursor.execute("""
+            SELECT id, exercise_name, start_time, total_reps, correct_reps, accuracy, duration_seconds
+            FROM sessions
+            WHERE patient_id = ?
+            ORDER BY start_time DESC, id DESC
+            LIMIT ?
+        """, (patient_id, limit))
+    else:
         cursor.execute("""
-            SELECT error_name, count, severity
+            SELECT id, exercise_name, start_time, total_reps, correct_reps, accuracy, duration_seconds
+            FROM sessions
+            WHERE patient_id = ? AND (start_time, id) < (?, ?)
+            ORDER BY start_time DESC, id DESC
+            LIMIT ?
+        """, (patient_id, *keyset, limit))
+    rows = cursor.fetchall()
+
+    errors_by_session = {row[0]: [] for row in rows}
+    if rows:
+        cursor.execute(f"""
+            SELECT session_id, error_name, count, severity
             FROM session_errors
-            WHERE session_id = ?
-        """, (row[0],))
-
-        errors = [{'name': get_vietnamese_error_name(e[0]), 'count': e[1], 'severity': e[2]} for e in cursor.fetchall()]
-
-        sessions.append({
-            'id': row[0],
-            'exercise_name': get_vietnamese_exercise_name(row[1]),
-            'start_time': row[2],
-            'total_reps': row[3],
-            'correct_reps': row[4],
-            'accuracy': row[5],
-            'duration_seconds': row[6],
-            'errors': errors
-        })
+            WHERE session_id IN ({','.join('?' * len(rows))})
+            ORDER BY id
+        """, list(errors_by_session))
+        for session_id, error_name, count, severity in cursor.fetchall():
+            errors_by_session[session_id].append({'name': get_vietnamese_error_name(error_name), 'count': count, 'severity': severity})
+
+    sessions = [{
+        'id': row[0],
+        'exercise_name': get_vietnamese_exercise_name(row[1]),
+        'start_time': row[2],
+        'total_reps': row[3],
+        'correct_reps': row[4],
+        'accuracy': row[5],
+        'duration_seconds': row[6],
+        'errors': errors_by_session[row[0]]
+    } for row in rows]
+    next_before = f"{rows[-1][2]},{rows[-1][0]}" if len(rows) == limit else None
+    return {'sessions': sessions, 'next_before': next_before}
 
-    conn.close()
-    return {'sessions': sessions}
 
+@app.get("/api/sessions/my-history")
+async def get_my_history(request: Request, limit: int = 20, before: Optional[str] = None,
+                         current_user = Depends(get_current_user)):
+    """before: next_before of the previous page"""
+    def query(conn):
+        return fetch_session_history(conn.cursor(), current_user['user_id'], limit, before)
+    
+    async def build():
+        return await db.run(query, readonly=True)
+    
+    return await cached_json(request, current_user['user_id'], ('patient', current_user['user_id']), build)
 
-@app.get("/api/sessions/error-analytics")
-async def get_error_analytics(current_user = Depends(get_current_user)):
-    """Get error analytics grouped by exercise type"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+
+@app.get("/api/sessions/{session_id}/timeseries")
+async def get_session_timeseries(session_id: int, columns: Optional[str] = None,
+                                 start: Optional[float] = None, end: Optional[float] = None,
+                                 current_user = Depends(get_current_user)):
+    """
+    Frame-by-frame angles, rep count and state of a session
+    columns: comma-separated subset (default all); start/end: seconds since the first frame
+    """
+    def query(conn):
+        owner = conn.execute("SELECT patient_id FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if owner is None:
+            raise HTTPException(status_code=404, detail="Session not found")
+        if current_user['role'] != 'doctor' and owner[0] != current_user['user_id']:
+            raise HTTPException(status_code=403, detail="Not your session")
+        
+        reader = open_series(conn, session_id)
+        if reader is None:
+            raise HTTPException(status_code=404, detail="No time series recorded for this session")
+        try:
+            return reader, reader.read(columns.split(',') if columns else None, start, end)
+        except KeyError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    reader, data = await db.run(query, readonly=True)
     
-    # Get error statistics grouped by exercise type
-    cursor.execute("""
-        SELECT 
-            s.exercise_name,
-            se.error_name,
-            SUM(se.count) as total_count,
-            COUNT(DISTINCT s.id) as session_count
-        FROM session_errors se
-        JOIN sessions s ON se.session_id = s.id
-        WHERE s.patient_id = ?
-        GROUP BY s.exercise_name, se.error_name
-        ORDER BY s.exercise_name, total_count DESC
-    """, (current_user['user_id'],))
-    
-    # Organize by exercise type and merge duplicate errors after Vietnamese translation
+    return {
+        'session_id': session_id,
+        'start_time': reader.header['start_time'],
+        'state_codes': reader.header['state_codes'],
+        'error_names': reader.header['error_names'],
+        'frames': len(next(iter(data.values()))) if data else 0,
+        # NaN (angle missing in a frame) is not valid JSON
+        'columns': {name: np.where(np.isnan(values), None, values.astype(np.float64).round(3)).tolist() for name, values in data.items()},
+    }
+
+
+def build_error_analytics(rows):
+    """Group rollup rows by exercise, merging errors that share a Vietnamese name"""
     analytics = {}
-    for row in cursor.fetchall():
-        exercise_name = row[0]
-        error_name = row[1]
-        total_count = row[2]
-        session_count = row[3]
-        
+    for exercise_name, error_name, total_count, session_count, last_seen in rows:
         # Convert to Vietnamese names
         vietnamese_exercise = get_vietnamese_exercise_name(exercise_name)
         vietnamese_error = get_vietnamese_error_name(error_name)
         
-        if vietnamese_exercise not in analytics:
-            analytics[vietnamese_exercise] = {
-                'exercise_name': vietnamese_exercise,
-                'errors': {}  # Use dict to merge duplicates
-            }
-        
-        # Merge errors with same Vietnamese name
-        if vietnamese_error not in analytics[vietnamese_exercise]['errors']:
-            analytics[vietnamese_exercise]['errors'][vietnamese_error] = {
-                'error_name': vietnamese_error,
-                'total_count': 0,
-                'session_count': 0
-            }
-        
-        analytics[vietnamese_exercise]['errors'][vietnamese_error]['total_count'] += total_count
-        analytics[vietnamese_exercise]['errors'][vietnamese_error]['session_count'] += session_count
+        errors = analytics.setdefault(vietnamese_exercise, {})
+        error = errors.setdefault(vietnamese_error, {
+            'error_name': vietnamese_error,
+            'total_count': 0,
+            'session_count': 0,
+            'last_seen': last_seen
+        })
+        error['total_count'] += total_count
+        error['session_count'] += session_count
+        error['last_seen'] = max(error['last_seen'] or '', last_seen or '') or None
     
-    # Convert errors dict to list and calculate averages
     result = []
-    for exercise in analytics.values():
-        errors_list = []
-        for error in exercise['errors'].values():
-            errors_list.append({
-                'error_name': error['error_name'],
-                'total_count': error['total_count'],
-                'session_count': error['session_count'],
-                'avg_per_session': round(error['total_count'] / error['session_count'], 1) if error['session_count'] > 0 else 0
-            })
+    for exercise_name, errors in analytics.items():
+        for error in errors.values():
+            error['avg_per_session'] = round(error['total_count'] / error['session_count'], 1) if error['session_count'] > 0 else 0
         result.append({
-            'exercise_name': exercise['exercise_name'],
-            'errors': sorted(errors_list, key=lambda x: x['total_count'], reverse=True)
+            'exercise_name': exercise_name,
+            'errors': sorted(errors.values(), key=lambda x: x['total_count'], reverse=True)
         })
-    
-    conn.close()
     return {'analytics': result}
 
 
+@app.get("/api/sessions/error-analytics")
+async def get_error_analytics(request: Request, current_user = Depends(get_current_user)):
+    """Get error analytics grouped by exercise type (from the error_rollup table)"""
+    def query(conn):
+        return load_error_rollup(conn.cursor(), current_user['user_id'])
+    
+    async def build():
+        return build_error_analytics(await db.run(query, readonly=True))
+    
+    return await cached_json(request, current_user['user_id'], ('patient', current_user['user_id']), build)
+
+
+@app.get("/api/sessions/calendar")
+async def get_activity_calendar(from_: Optional[str] = Query(None, alias="from"), to: Optional[str] = None,
+                                current_user = Depends(get_current_user)):
+    """
+    Per-day activity for the heatmap (from the daily_activity rollup)
+    from/to: YYYY-MM-DD, inclusive; defaults to the first active day .. today
+    days[i] is day from+i: [sessions, total_reps, correct_reps, duration_seconds]
+    """
+    try:
+        end = date.fromisoformat(to) if to else date.today()
+        start = date.fromisoformat(from_) if from_ else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="from/to must be YYYY-MM-DD")
+    
+    def query(conn, start):
+        cursor = conn.cursor()
+        if start is None:
+            first = first_active_day(cursor, current_user['user_id'])
+            start = max(date.fromisoformat(first) if first else end, end - timedelta(days=CALENDAR_MAX_DAYS - 1))
+            start = min(start, end)
+        if start > end or (end - start).days >= CALENDAR_MAX_DAYS:
+            raise HTTPException(status_code=400, detail=f"from must be before to and at most {CALENDAR_MAX_DAYS} days apart")
+        return load_calendar(cursor, current_user['user_id'], start, end)
+    
+    calendar = await db.run(query, start, readonly=True)
+    calendar['exercises'] = {get_vietnamese_exercise_name(name): rows for name, rows in calendar['exercises'].items()}
+    return calendar
+
+
 @app.get("/api/doctor/patients")
-async def get_my_patients(current_user = Depends(get_current_user)):
+async def get_my_patients(request: Request, current_user = Depends(get_current_user)):
     if current_user['role'] != 'doctor':
         raise HTTPException(status_code=403, detail="Doctors only")
     
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT id, username, full_name, age, gender, created_at
-        FROM users
-        WHERE role = 'patient' AND doctor_id = ?
-        ORDER BY full_name
-    """, (current_user['user_id'],))
-    
-    patients = []
-    for row in cursor.fetchall():
-        # Get latest session
-        cursor.execute("""
-            SELECT start_time, exercise_name, accuracy
-            FROM sessions
-            WHERE patient_id = ?
-            ORDER BY start_time DESC
-            LIMIT 1
-        """, (row[0],))
-        
-        last_session = cursor.fetchone()
-        
-        patients.append({
-            'id': row[0],
-            'username': row[1],
-            'full_name': row[2],
-            'age': row[3],
-            'gender': row[4],
-            'created_at': row[5],
-            'last_session': {
-                'date': last_session[0] if last_session else None,
-                'exercise': last_session[1] if last_session else None,
-                'accuracy': last_session[2] if last_session else None
-            } if last_session else None
-        })
+    def query(conn):
+        # Patients and their latest session in one query
+        return conn.execute("""
+            SELECT u.id, u.username, u.full_name, u.age, u.gender, u.created_at,
+                   latest.start_time, latest.exercise_name, latest.accuracy
+            FROM users u
+            LEFT JOIN (
+                SELECT patient_id, start_time, exercise_name, accuracy,
+                       ROW_NUMBER() OVER (PARTITION BY patient_id ORDER BY start_time DESC, id DESC) AS rn
+                FROM sessions
+                WHERE patient_id IN (SELECT id FROM users WHERE role = 'patient' AND doctor_id = ?)
+            ) latest ON latest.patient_id = u.id AND latest.rn = 1
+            WHERE u.role = 'patient' AND u.doctor_id = ?
+            ORDER BY u.full_name
+        """, (current_user['user_id'], current_user['user_id'])).fetchall()
+    
+    async def build():
+        patients = []
+        for row in await db.run(query, readonly=True):
+            patients.append({
+                'id': row[0],
+                'username': row[1],
+                'full_name': row[2],
+                'age': row[3],
+                'gender': row[4],
+                'created_at': row[5],
+                'last_session': {
+                    'date': row[6],
+                    'exercise': row[7],
+                    'accuracy': row[8]
+                } if row[6] is not None else None
+            })
+        return {'patients': patients}
     
-    conn.close()
-    return {'patients': patients}
+    return await cached_json(request, current_user['user_id'], ('doctor', current_user['user_id']), build)
 
 
 @app.get("/api/doctor/patient/{patient_id}/history")
-async def get_patient_history(patient_id: int, limit: int = 20, current_user = Depends(get_current_user)):
+async def get_patient_history(request: Request, patient_id: int, limit: int = 20, before: Optional[str] = None,
+                              current_user = Depends(get_current_user)):
     if current_user['role'] != 'doctor':
         raise HTTPException(status_code=403, detail="Doctors only")
     
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    def query(conn):
+        return fetch_session_history(conn.cursor(), patient_id, limit, before)
     
-    cursor.execute("""
-        SELECT id, exercise_name, start_time, total_reps, correct_reps, accuracy, duration_seconds
-        FROM sessions
-        WHERE patient_id = ?
-        ORDER BY start_time DESC
-        LIMIT ?
-    """, (patient_id, limit))
-    
-    sessions = []
-    for row in cursor.fetchall():
-        # Get errors
-        cursor.execute("""
-            SELECT error_name, count, severity
-            FROM session_errors
-            WHERE session_id = ?
-        """, (row[0],))
-        
-        errors = [{'name': get_vietnamese_error_name(e[0]), 'count': e[1], 'severity': e[2]} for e in cursor.fetchall()]
-        
-        sessions.append({
-            'id': row[0],
-            'exercise_name': get_vietnamese_exercise_name(row[1]),
-            'start_time': row[2],
-            'total_reps': row[3],
-            'correct_reps': row[4],
-            'accuracy': row[5],
-            'duration_seconds': row[6],
-            'errors': errors
-        })
+    async def build():
+        return await db.run(query, readonly=True)
     
-    conn.close()
-    return {'sessions': sessions}
+    return await cached_json(request, current_user['user_id'], ('patient', patient_id), build)
 
 
 @app.get("/api/doctor/patient/{patient_id}/error-analytics")
-async def get_patient_error_analytics(patient_id: int, current_user = Depends(get_current_user)):
+async def get_patient_error_analytics(request: Request, patient_id: int, current_user = Depends(get_current_user)):
     """Get error analytics for a specific patient grouped by exercise type"""
     if current_user['role'] != 'doctor':
         raise HTTPException(status_code=403, detail="Doctors only")
     
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Get error statistics grouped by exercise type
-    cursor.execute("""
-        SELECT 
-            s.exercise_name,
-            se.error_name,
-            SUM(se.count) as total_count,
-            COUNT(DISTINCT s.id) as session_count
-        FROM session_errors se
-        JOIN sessions s ON se.session_id = s.id
-        WHERE s.patient_id = ?
-        GROUP BY s.exercise_name, se.error_name
-        ORDER BY s.exercise_name, total_count DESC
-    """, (patient_id,))
-    
-    # Organize by exercise type and merge duplicate errors after Vietnamese translation
-    analytics = {}
-    for row in cursor.fetchall():
-        exercise_name = row[0]
-        error_name = row[1]
-        total_count = row[2]
-        session_count = row[3]
-        
-        # Convert to Vietnamese names
-        vietnamese_exercise = get_vietnamese_exercise_name(exercise_name)
-        vietnamese_error = get_vietnamese_error_name(error_name)
-        
-        if vietnamese_exercise not in analytics:
-            analytics[vietnamese_exercise] = {
-                'exercise_name': vietnamese_exercise,
-                'errors': {}  # Use dict to merge duplicates
-            }
-        
-        # Merge errors with same Vietnamese name
-        if vietnamese_error not in analytics[vietnamese_exercise]['errors']:
-            analytics[vietnamese_exercise]['errors'][vietnamese_error] = {
-                'error_name': vietnamese_error,
-                'total_count': 0,
-                'session_count': 0
-            }
-        
-        analytics[vietnamese_exercise]['errors'][vietnamese_error]['total_count'] += total_count
-        analytics[vietnamese_exercise]['errors'][vietnamese_error]['session_count'] += session_count
+    def query(conn):
+        return load_error_rollup(conn.cursor(), patient_id)
     
-    # Convert errors dict to list and calculate averages
-    result = []
-    for exercise in analytics.values():
-        errors_list = []
-        for error in exercise['errors'].values():
-            errors_list.append({
-                'error_name': error['error_name'],
-                'total_count': error['total_count'],
-                'session_count': error['session_count'],
-                'avg_per_session': round(error['total_count'] / error['session_count'], 1) if error['session_count'] > 0 else 0
-            })
-        result.append({
-            'exercise_name': exercise['exercise_name'],
-            'errors': sorted(errors_list, key=lambda x: x['total_count'], reverse=True)
-        })
+    async def build():
+        return build_error_analytics(await db.run(query, readonly=True))
     
-    conn.close()
-    return {'analytics': result}
+    return await cached_json(request, current_user['user_id'], ('patient', patient_id), build)
+
+
+@app.get("/api/doctor/cohort")
+async def get_cohort(request: Request, weeks: int = 12, current_user = Depends(get_current_user)):
+    """
+    Activity, weekly accuracy and top errors of every patient of the doctor, plus cohort totals
+    Served from the patient_summary, daily_activity, weekly_activity and error_rollup rollups; accuracy_trend[i] is the week starting week_starts[i]
+    """
+    if current_user['role'] != 'doctor':
+        raise HTTPException(status_code=403, detail="Doctors only")
+    if not 1 <= weeks <= COHORT_MAX_WEEKS:
+        raise HTTPException(status_code=400, detail=f"weeks must be between 1 and {COHORT_MAX_WEEKS}")
+    today = date.today()
+    
+    def query(conn):
+        return load_cohort(conn.cursor(), current_user['user_id'], today, weeks)
+    
+    async def build():
+        cohort = await db.run(query, readonly=True)
+        for error in cohort['cohort']['top_errors']:
+            error['error_name'] = get_vietnamese_error_name(error['error_name'])
+        for patient in cohort['patients']:
+            for error in patient['top_errors']:
+                error['error_name'] = get_vietnamese_error_name(error['error_name'])
+        return cohort
+    
+    # The 7/30-day windows move at midnight even when no data changes
+    return await cached_json(request, current_user['user_id'], ('doctor', current_user['user_id']), build, vary=(today,))
+
+
+@app.get("/api/export/{dataset}")
+async def export_data(dataset: str, format: str = "csv", patient_id: Optional[int] = None,
+                      exercise: Optional[str] = None, from_: Optional[str] = Query(None, alias="from"),
+                      to: Optional[str] = None, current_user = Depends(get_current_user)):
+    """
+    Stream sessions, errors or frames as CSV, NDJSON or Parquet (when pyarrow is installed)
+    Doctors export their own patients (optionally one of them), patients their own data
+    from/to: YYYY-MM-DD session start days, inclusive
+    """
+    if dataset not in DATASETS:
+        raise HTTPException(status_code=404, detail=f"Unknown dataset; choose from {', '.join(DATASETS)}")
+    if format not in available_formats():
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(available_formats())}")
+    try:
+        start = date.fromisoformat(from_) if from_ else None
+        end = date.fromisoformat(to) if to else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="from/to must be YYYY-MM-DD")
+    
+    if current_user['role'] == 'doctor':
+        filters = ExportFilter(patient_id, current_user['user_id'], exercise, start, end)
+    else:
+        filters = ExportFilter(current_user['user_id'], None, exercise, start, end)
+    
+    async def stream():
+        conn = db.connect(readonly=True)
+        chunks = stream_export(conn, dataset, format, filters)
+        # A client disconnect can cancel the stream while a chunk is still being read on a DB
+        # thread; the lock makes close_export wait for that read
+        lock = threading.Lock()
+        
+        def read_chunk():
+            with lock:
+                return next(chunks, None)
+        
+        def close_export():
+            with lock:
+                chunks.close()  # Closes the SELECT cursor before the connection goes back to the pool
+                conn.close()
+        
+        try:
+            # Each chunk is read on a DB thread, so a long export never blocks the event loop
+            while (data := await db.call(read_chunk)) is not None:
+                yield data
+        finally:
+            await db.call(close_export)  # Runs to the end on its thread even if this await is cancelled
+    
+    filename = f"{dataset}-{date.today().isoformat()}.{format}"
+    return StreamingResponse(stream(), media_type=FORMATS[format],
+                             headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
 
 # ============= AI PERSONALIZATION ENDPOINTS =============
@@ -1604,9 +1801,6 @@ async def update_profile(
     token_data = verify_token(credentials)
     user_id = token_data['user_id']
     
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     # Calculate BMI if height and weight provided
     bmi = None
     if request.height_cm and request.weight_kg:
@@ -1650,11 +1844,14 @@ async def update_profile(
     
     if update_fields:
         update_values.append(user_id)
-        query = f"UPDATE users SET {', '.join(update_fields)} WHERE id = ?"
-        cursor.execute(query, update_values)
-        conn.commit()
-    
-    conn.close()
+        
+        def query(conn):
+            conn.execute(f"UPDATE users SET {', '.join(update_fields)} WHERE id = ?", update_values)
+            conn.commit()
+            return conn.execute("SELECT doctor_id FROM users WHERE id = ?", (user_id,)).fetchone()
+        
+        doctor = await db.run(query)
+        response_cache.bump(user_id, doctor[0] if doctor else None)
     
     return {
         'success': True,
@@ -1669,25 +1866,22 @@ async def get_my_profile(credentials: HTTPAuthorizationCredentials = Depends(sec
     token_data = verify_token(credentials)
     user_id = token_data['user_id']
     
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT id, username, full_name, age, gender, height_cm, weight_kg, bmi,
-               medical_conditions, injury_type, mobility_level, pain_level, 
-               doctor_notes, contraindicated_exercises, role
-        FROM users
-        WHERE id = ?
-    """, (user_id,))
-    
-    user = cursor.fetchone()
-    conn.close()
+    def query(conn):
+        conn.row_factory = sqlite3.Row
+        user = conn.execute("""
+            SELECT id, username, full_name, age, gender, height_cm, weight_kg, bmi,
+                   medical_conditions, injury_type, mobility_level, pain_level, 
+                   doctor_notes, contraindicated_exercises, role
+            FROM users
+            WHERE id = ?
+        """, (user_id,)).fetchone()
+        return dict(user) if user else None
     
+    user = await db.run(query, readonly=True)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    return dict(user)
+    return user
 
 
 @app.post("/api/personalized-params")
@@ -1703,226 +1897,436 @@ async def get_personalized_params(
     token_data = verify_token(credentials)
     user_id = token_data['user_id']
     
-    # Get user data
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT age, gender, height_cm, weight_kg, bmi, medical_conditions,
-               injury_type, mobility_level, pain_level
-        FROM users
-        WHERE id = ?
-    """, (user_id,))
-    
-    user_row = cursor.fetchone()
-    
-    if not user_row:
-        conn.close()
-        raise HTTPException(status_code=404, detail="User not found")
+    def query(conn):
+        # Get user data
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT age, gender, height_cm, weight_kg, bmi, medical_conditions,
+                   injury_type, mobility_level, pain_level
+            FROM users
+            WHERE id = ?
+        """, (user_id,))
+        
+        user_row = cursor.fetchone()
+        if not user_row:
+            raise HTTPException(status_code=404, detail="User not found")
+        
+        # Calculate personalized parameters using AI engine
+        params = personalization_engine.calculate_personalized_params(
+            dict(user_row),
+            request.exercise_type
+        )
+        
+        # Save to database
+        cursor.execute("""
+            INSERT OR REPLACE INTO user_exercise_limits
+            (user_id, exercise_type, max_depth_angle, min_raise_angle,
+             max_reps_per_set, recommended_rest_seconds, difficulty_score,
+             injury_risk_score, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            user_id,
+            request.exercise_type,
+            params.get('down_angle'),
+            params.get('up_angle'),
+            params.get('max_reps'),
+            params.get('rest_seconds'),
+            params.get('difficulty_score'),
+            0.0,  # injury_risk_score - will implement later
+            datetime.now().isoformat(),
+            datetime.now().isoformat()
+        ))
+        
+        conn.commit()
+        return params
     
-    user_data = dict(user_row)
-    
-    # Calculate personalized parameters using AI engine
-    params = personalization_engine.calculate_personalized_params(
-        user_data,
-        request.exercise_type
-    )
-    
-    # Save to database
-    cursor.execute("""
-        INSERT OR REPLACE INTO user_exercise_limits
-        (user_id, exercise_type, max_depth_angle, min_raise_angle,
-         max_reps_per_set, recommended_rest_seconds, difficulty_score,
-         injury_risk_score, created_at, updated_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        user_id,
-        request.exercise_type,
-        params.get('down_angle'),
-        params.get('up_angle'),
-        params.get('max_reps'),
-        params.get('rest_seconds'),
-        params.get('difficulty_score'),
-        0.0,  # injury_risk_score - will implement later
-        datetime.now().isoformat(),
-        datetime.now().isoformat()
-    ))
-    
-    conn.commit()
-    conn.close()
+    return await db.run(query)
+
+
+@app.get("/api/pose/pipeline-stats")
+async def get_pipeline_stats(current_user = Depends(get_current_user)):
+    """Mean time per pose pipeline stage, with full-size decode baselines to show the savings"""
+    return pipeline_stats.snapshot()
+
+
+@app.get("/api/doctor/sessions/{session_id}/trace")
+async def get_session_trace(session_id: int, current_user = Depends(get_current_user)):
+    """Recent frames and state transitions of a live or recently finished session"""
+    if current_user['role'] != 'doctor':
+        raise HTTPException(status_code=403, detail="Doctors only")
     
-    return params
+    trace = None
+    session = session_registry.get(session_id)
+    if session and session.rep_counter:
+        trace = session.rep_counter.trace
+    if trace is None:
+        trace = finished_traces.get(session_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="No trace for this session")
+    return trace.dump()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus text exposition of pipeline latency histograms and gauges"""
+    return PlainTextResponse(pipeline_metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/pose/metrics")
+async def get_pipeline_metrics(current_user = Depends(get_current_user)):
+    """p50/p95/p99 per exercise and stage, plus the live gauges"""
+    return pipeline_metrics.snapshot()
+
+
+@app.post("/api/pose/metrics/reset")
+async def reset_pipeline_metrics(current_user = Depends(get_current_user)):
+    if current_user['role'] != 'doctor':
+        raise HTTPException(status_code=403, detail="Doctors only")
+    pipeline_metrics.reset()
+    return {"message": "Metrics reset"}
 
 
 @app.websocket("/ws/exercise/{exercise_type}")
-async def websocket_endpoint(websocket: WebSocket, exercise_type: str):
+async def websocket_endpoint(websocket: WebSocket, exercise_type: str,
+                             session_id: Optional[int] = None, token: Optional[str] = None):
+    # Bind to a started session (?session_id=..&token=..) so frames and reps are recorded for it
+    session = None
+    if session_id is not None:
+        try:
+            user = jwt.decode(token or '', SECRET_KEY, algorithms=[ALGORITHM])
+        except jwt.InvalidTokenError:
+            user = None
+        session = session_registry.get(session_id, user['user_id']) if user else None
+        if session is None:
+            await websocket.close(code=1008)  # Policy violation: not this user's active session
+            return
+    
     await websocket.accept()
+    pipeline_metrics.active_connections += 1
     
     angle_calc = AngleCalculator()
-    rep_counter = RepetitionCounter(exercise_type)
+    # ✅ The session keeps the rep counter, so a reconnect continues the count
+    rep_counter = session.attach(exercise_type) if session else RepetitionCounter(exercise_type)
     error_detector = ErrorDetector(exercise_type)
     
-    # ✅ Store rep_counter reference in session_manager
-    session_manager.active_rep_counter = rep_counter
-    
-    last_process_time = 0
     prev_rep_count = 0  # Track previous rep count to detect new reps
+    binary_mode = False  # Enabled by a `hello` message with binary=True
+    credit_mode = False  # Enabled by a `hello` message with credit=True
+    compact_encoder = None  # Set by a `hello` message with compact=True
+    connection_id = id(websocket)  # Key for this connection's Pose graph lease
+    pose_lease = None
+    lease_wait_start = None
+    mailbox = FrameMailbox()  # Only the newest unprocessed frame is kept
+    session_timings = StageTimings()  # This connection's stage latencies (`metrics` message)
+    metrics_label = exercise_type if exercise_type in ANGLE_TABLES else 'other'  # Bounded label set
+    dropped_reported = 0
+    
+    def analyze(landmark_array, timer, include_landmarks=True):
+        """Run angles, rep counting and error detection on one frame's (33, 4) landmark array"""
+        nonlocal prev_rep_count
+        
+        angles = angle_calc.get_angles(landmark_array, exercise_type)
+        landmarks = landmarks_from_array(landmark_array)
+        timer.lap('angles')
+        
+        # ✅ GỌI update() thay vì count()
+        rep_count = rep_counter.update(angles)
+        
+        # Reset error timers when new rep starts
+        if rep_count > prev_rep_count:
+            error_detector.reset_timers()
+            prev_rep_count = rep_count
+        
+        # Get current state
+        current_state = rep_counter.get_state()
+        
+        # Detect errors with state and rep_counter
+        timer.lap('rep_state')
+        errors = error_detector.detect_errors(landmarks, angles, current_state, rep_counter)
+        timer.lap('errors')
+        
+        if session:
+            session.log_frame(rep_count, current_state.value, angles, errors)
+        
+        # Client-side landmarks are not echoed back - the browser already has them
+        pose_landmarks = [
+            {'x': lm.x, 'y': lm.y, 'z': lm.z, 'visibility': lm.visibility}
+            for lm in landmarks
+        ] if include_landmarks else None
+        
+        # ✅ Feedback based on exercise type and state
+        if errors:
+            feedback_msg = errors[0]['message']
+        else:
+            if exercise_type == "single_leg_stand":
+                # Special feedback for single leg stand
+                if current_state == ExerciseState.READY:
+                    side_text = "trái" if rep_counter.get_current_side() == "left" else "phải"
+                    feedback_msg = f'🟢 Sẵn sàng - Co chân {side_text} lên'
+                elif current_state == ExerciseState.LIFTING:
+                    feedback_msg = '⬆️ Đang co chân lên...'
+                elif current_state == ExerciseState.HOLDING:
+                    remaining = rep_counter.get_hold_time_remaining()
+                    if remaining:
+                        feedback_msg = f'⏱️ Giữ vững! Còn {int(remaining)}s'
+                    else:
+                        feedback_msg = '⏱️ Giữ vững!'
+                elif current_state == ExerciseState.LOWERING:
+                    feedback_msg = '⬇️ Hạ chân từ từ...'
+                elif current_state == ExerciseState.SWITCH_SIDE:
+                    feedback_msg = '🔄 Tốt lắm! Đổi bên'
+                elif current_state == ExerciseState.COMPLETE:
+                    feedback_msg = '✅ Hoàn thành 1 rep!'
+                else:
+                    feedback_msg = '✓ Tư thế tốt!'
+            else:
+                # Existing feedback for other exercises
+                if current_state == ExerciseState.RAISING:
+                    feedback_msg = '⬆️ Đang nâng...'
+                elif current_state == ExerciseState.UP:
+                    feedback_msg = '✅ Giữ vững!'
+                elif current_state == ExerciseState.LOWERING:
+                    feedback_msg = '⬇️ Đang hạ...'
+                elif current_state == ExerciseState.DOWN:
+                    feedback_msg = '🟢 Sẵn sàng!'
+                else:
+                    feedback_msg = '✓ Tư thế tốt!'
+        
+        # ✅ Additional data for single_leg_stand
+        extra_data = {}
+        if exercise_type == "single_leg_stand":
+            extra_data['hold_time_remaining'] = rep_counter.get_hold_time_remaining()
+            extra_data['current_side'] = rep_counter.get_current_side()
+        # ✅ THÊM MỚI
+        elif exercise_type == "calf_raise":
+            if current_state == ExerciseState.DOWN:
+                feedback_msg = '🟢 Sẵn sàng - Nâng gót lên!'
+            elif current_state == ExerciseState.RAISING:
+                feedback_msg = '⬆️ Đang nâng gót...'
+            elif current_state == ExerciseState.UP:
+                feedback_msg = '✅ Giữ vững ở trên!'
+            elif current_state == ExerciseState.LOWERING:
+                feedback_msg = '⬇️ Hạ từ từ...'
+            else:
+                feedback_msg = '✓ Tư thế tốt!'
+        timer.lap('feedback')
+        return {
+            'type': 'analysis',
+            'pose_detected': True,
+            'landmarks': pose_landmarks,
+            'angles': angles,  # Full precision: CompactEncoder quantises positions to thousandths
+            'rep_count': rep_count,
+            'errors': errors,
+            'feedback': feedback_msg,
+            'state': current_state.value,
+            **extra_data
+        }
+    
+    async def receive_messages():
+        """Handle control messages immediately and park frames in the mailbox"""
+        nonlocal binary_mode, credit_mode, compact_encoder
+        try:
+            while True:
+                raw = await websocket.receive()
+                if raw['type'] == 'websocket.disconnect':
+                    break
+                
+                # Binary frame: fixed header + raw JPEG bytes (no JSON/base64 round trip)
+                if raw.get('bytes') is not None:
+                    if not binary_mode:
+                        await websocket.send_json({'type': 'error', 'message': 'Binary frames require hello negotiation'})
+                        continue
+                    try:
+                        header, payload = ws_protocol.unpack_message(raw['bytes'])
+                    except ws_protocol.ProtocolError as e:
+                        await websocket.send_json({'type': 'error', 'message': str(e)})
+                        continue
+                    frame_meta = {'seq': header.seq, 'client_ts': header.client_ts}
+                    if header.msg_type == ws_protocol.MSG_FRAME_JPEG:
+                        mailbox.put((payload.tobytes(), frame_meta))
+                    elif header.msg_type == ws_protocol.MSG_LANDMARKS:
+                        try:
+                            mailbox.put((ws_protocol.landmarks_from_payload(payload).copy(), frame_meta))
+                        except ws_protocol.ProtocolError as e:
+                            await websocket.send_json({'type': 'error', 'message': str(e)})
+                    continue
+                
+                # A malformed message gets an error reply; it must not end the receiver (and the socket)
+                try:
+                    message = json.loads(raw['text'])
+                
+                    if message['type'] == 'hello':
+                        reply = ws_protocol.negotiate(message, FRAME_CREDIT_WINDOW)
+                        binary_mode = reply['binary']
+                        credit_mode = reply['credit']
+                        if reply['compact']:
+                            indices = {
+                                'all': None,
+                                'exercise': EXERCISE_LANDMARKS.get(exercise_type),
+                                'none': [],
+                            }[reply['landmarks']]
+                            compact_encoder = ws_protocol.CompactEncoder(indices)
+                        else:
+                            compact_encoder = None
+                        mailbox.take_consumed()  # Credits start from the negotiated window
+                        await websocket.send_json(reply)
+                        continue
+                
+                    # ✅ NEW: Handle custom thresholds
+                    if message['type'] == 'set_thresholds':
+                        thresholds = message.get('thresholds', {})
+                        logger.info("Custom thresholds for %s: %s", exercise_type, thresholds)
+                
+                        # Apply custom thresholds to rep_counter
+                        if 'down_angle' in thresholds and thresholds['down_angle']:
+                            if exercise_type == 'squat':
+                                rep_counter.down_threshold = thresholds['down_angle']
+                                logger.debug("Squat down_threshold: %s°", rep_counter.down_threshold)
+                            elif exercise_type == 'arm_raise':
+                                rep_counter.down_threshold = thresholds['down_angle']
+                                logger.debug("Arm raise down_threshold: %s°", rep_counter.down_threshold)
+                
+                        if 'up_angle' in thresholds and thresholds['up_angle']:
+                            if exercise_type == 'squat':
+                                rep_counter.up_threshold = thresholds['up_angle']
+                                logger.debug("Squat up_threshold: %s°", rep_counter.up_threshold)
+                            elif exercise_type == 'arm_raise':
+                                rep_counter.up_threshold = thresholds['up_angle']
+                                logger.debug("Arm raise up_threshold: %s°", rep_counter.up_threshold)
+                
+                        continue
+                
+                    if message['type'] == 'frame':
+                        # JSON frames are decoded by the processor, so replaced frames cost no base64 work
+                        mailbox.put((message['data'], {}))
+                
+                    elif message['type'] == 'landmarks':
+                        # Pose computed in the browser: skip decode and inference entirely
+                        try:
+                            mailbox.put((ws_protocol.landmarks_from_json(message['landmarks']), {}))
+                        except ws_protocol.ProtocolError as e:
+                            await websocket.send_json({'type': 'error', 'message': str(e)})
+                
+                    elif message['type'] == 'reset':
+                        rep_counter.reset()
+                        await websocket.send_json({'type': 'reset_confirmed'})
+                
+                    elif message['type'] == 'metrics':
+                        # This session's stage latencies; reset=True starts a fresh measurement window
+                        await websocket.send_json({'type': 'metrics', 'stages': session_timings.snapshot().get(metrics_label, {})})
+                        if message.get('reset'):
+                            session_timings.reset()
+                except (json.JSONDecodeError, KeyError, TypeError) as e:
+                    await websocket.send_json({'type': 'error', 'message': f'Malformed message: {e!r}'})
+        except WebSocketDisconnect:
+            pass
+        finally:
+            mailbox.close()
+    
+    receiver = asyncio.create_task(receive_messages())
     
     try:
         while True:
-            data = await websocket.receive_text()
-            message = json.loads(data)
+            item = await mailbox.get()
+            if item is None:
+                break
+            frame, frame_meta = item
+            response = None
+            landmark_array = None
+            timer = StageTimer()
+            worker_stage_ms = {}
             
-            # ✅ NEW: Handle custom thresholds
-            if message['type'] == 'set_thresholds':
-                thresholds = message.get('thresholds', {})
-                print(f"🎯 Received custom thresholds: {thresholds}")
+            try:
+                if isinstance(frame, np.ndarray):
+                    # Client-side landmarks: only the rule logic runs on the server
+                    response = {**analyze(frame, timer, include_landmarks=False), **frame_meta}
+                    jpeg = None
+                elif isinstance(frame, bytes):
+                    jpeg = frame
+                else:
+                    jpeg = ws_protocol.jpeg_from_data_url(frame)
+                    timer.lap('base64_decode')
                 
-                # Apply custom thresholds to rep_counter
-                if 'down_angle' in thresholds and thresholds['down_angle']:
-                    if exercise_type == 'squat':
-                        rep_counter.down_threshold = thresholds['down_angle']
-                        print(f"   Squat down_threshold: {rep_counter.down_threshold}°")
-                    elif exercise_type == 'arm_raise':
-                        rep_counter.down_threshold = thresholds['down_angle']
-                        print(f"   Arm raise down_threshold: {rep_counter.down_threshold}°")
+                # Lease a Pose graph on the first frame; report waiting/busy when the pool is empty
+                if jpeg is not None and pose_lease is None:
+                    current_time = time.time()
+                    pose_lease = pose_executor.lease(connection_id)
+                    if pose_lease is None:
+                        if lease_wait_start is None:
+                            lease_wait_start = current_time
+                            response = {'type': 'pose_status', 'status': 'waiting'}
+                        elif current_time - lease_wait_start > POSE_LEASE_TIMEOUT:
+                            await websocket.send_json({'type': 'pose_status', 'status': 'busy'})
+                            await websocket.close(code=1013)  # Try again later
+                            break
+                    elif lease_wait_start is not None:
+                        lease_wait_start = None
+                        await websocket.send_json({'type': 'pose_status', 'status': 'ready'})
                 
-                if 'up_angle' in thresholds and thresholds['up_angle']:
-                    if exercise_type == 'squat':
-                        rep_counter.up_threshold = thresholds['up_angle']
-                        print(f"   Squat up_threshold: {rep_counter.up_threshold}°")
-                    elif exercise_type == 'arm_raise':
-                        rep_counter.up_threshold = thresholds['up_angle']
-                        print(f"   Arm raise up_threshold: {rep_counter.up_threshold}°")
+                if jpeg is not None and pose_lease is not None:
+                    # Decode + inference run in a pose worker, off the event loop
+                    timer.restart()
+                    pipeline_metrics.inference_in_flight += 1
+                    try:
+                        landmark_array, worker_stage_ms = await pose_executor.process(pose_lease, jpeg)
+                    finally:
+                        pipeline_metrics.inference_in_flight -= 1
+                    timer.lap('pose_roundtrip')  # Worker stages + queueing + IPC
+                    pipeline_stats.add(worker_stage_ms)
+                    
+                    if landmark_array is not None:
+                        # Compact clients get the landmarks as int16 straight from the array
+                        analysis = analyze(landmark_array, timer, include_landmarks=compact_encoder is None)
+                        response = {**analysis, **frame_meta}
+                    else:
+                        response = {'type': 'analysis', 'pose_detected': False, **frame_meta}
                 
-                continue
+            except Exception:
+                logger.exception("Frame error")
             
-            if message['type'] == 'frame':
-                current_time = time.time()
-                if current_time - last_process_time < 0.04:
-                    continue
-                last_process_time = current_time
-                
-                try:
-                    img_data = base64.b64decode(message['data'].split(',')[1])
-                    nparr = np.frombuffer(img_data, np.uint8)
-                    frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                    
-                    if frame is None:
-                        continue
-                    
-                    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    results = pose.process(rgb_frame)
-                    
-                    response = {'type': 'analysis', 'pose_detected': False}
-                    
-                    if results.pose_landmarks:
-                        landmarks = results.pose_landmarks.landmark
-                        angles = angle_calc.get_angles(landmarks, exercise_type)
-                        
-                        # ✅ GỌI update() thay vì count()
-                        rep_count = rep_counter.update(angles)
-                        
-                        # Reset error timers when new rep starts
-                        if rep_count > prev_rep_count:
-                            error_detector.reset_timers()
-                            prev_rep_count = rep_count
-                        
-                        # Get current state
-                        current_state = rep_counter.get_state()
-                        
-                        # Detect errors with state and rep_counter
-                        errors = error_detector.detect_errors(landmarks, angles, current_state, rep_counter)
-                        
-                        session_manager.log_frame(rep_count, angles, errors)
-                        
-                        pose_landmarks = [
-                            {'x': lm.x, 'y': lm.y, 'z': lm.z, 'visibility': lm.visibility}
-                            for lm in landmarks
-                        ]
-                        
-                        # ✅ Feedback based on exercise type and state
-                        if errors:
-                            feedback_msg = errors[0]['message']
-                        else:
-                            if exercise_type == "single_leg_stand":
-                                # Special feedback for single leg stand
-                                if current_state == ExerciseState.READY:
-                                    side_text = "trái" if rep_counter.get_current_side() == "left" else "phải"
-                                    feedback_msg = f'🟢 Sẵn sàng - Co chân {side_text} lên'
-                                elif current_state == ExerciseState.LIFTING:
-                                    feedback_msg = '⬆️ Đang co chân lên...'
-                                elif current_state == ExerciseState.HOLDING:
-                                    remaining = rep_counter.get_hold_time_remaining()
-                                    if remaining:
-                                        feedback_msg = f'⏱️ Giữ vững! Còn {int(remaining)}s'
-                                    else:
-                                        feedback_msg = '⏱️ Giữ vững!'
-                                elif current_state == ExerciseState.LOWERING:
-                                    feedback_msg = '⬇️ Hạ chân từ từ...'
-                                elif current_state == ExerciseState.SWITCH_SIDE:
-                                    feedback_msg = '🔄 Tốt lắm! Đổi bên'
-                                elif current_state == ExerciseState.COMPLETE:
-                                    feedback_msg = '✅ Hoàn thành 1 rep!'
-                                else:
-                                    feedback_msg = '✓ Tư thế tốt!'
-                            else:
-                                # Existing feedback for other exercises
-                                if current_state == ExerciseState.RAISING:
-                                    feedback_msg = '⬆️ Đang nâng...'
-                                elif current_state == ExerciseState.UP:
-                                    feedback_msg = '✅ Giữ vững!'
-                                elif current_state == ExerciseState.LOWERING:
-                                    feedback_msg = '⬇️ Đang hạ...'
-                                elif current_state == ExerciseState.DOWN:
-                                    feedback_msg = '🟢 Sẵn sàng!'
-                                else:
-                                    feedback_msg = '✓ Tư thế tốt!'
-                        
-                        # ✅ Additional data for single_leg_stand
-                        extra_data = {}
-                        if exercise_type == "single_leg_stand":
-                            extra_data['hold_time_remaining'] = rep_counter.get_hold_time_remaining()
-                            extra_data['current_side'] = rep_counter.get_current_side()
-                        # ✅ THÊM MỚI
-                        elif exercise_type == "calf_raise":
-                            if current_state == ExerciseState.DOWN:
-                                feedback_msg = '🟢 Sẵn sàng - Nâng gót lên!'
-                            elif current_state == ExerciseState.RAISING:
-                                feedback_msg = '⬆️ Đang nâng gót...'
-                            elif current_state == ExerciseState.UP:
-                                feedback_msg = '✅ Giữ vững ở trên!'
-                            elif current_state == ExerciseState.LOWERING:
-                                feedback_msg = '⬇️ Hạ từ từ...'
-                            else:
-                                feedback_msg = '✓ Tư thế tốt!'
-                        response = {
-                            'type': 'analysis',
-                            'pose_detected': True,
-                            'landmarks': pose_landmarks,
-                            'angles': {k: round(v, 1) if isinstance(v, (int, float)) else v for k, v in angles.items()},
-                            'rep_count': rep_count,
-                            'errors': errors,
-                            'feedback': feedback_msg,
-                            'state': current_state.value,
-                            **extra_data
-                        }
-                    
-                    await websocket.send_json(response)
-                    
-                except Exception as e:
-                    print(f"Frame error: {e}")
-                    import traceback
-                    traceback.print_exc()  # ✅ In full traceback để debug
-                    continue
+            # Hand back one credit per consumed frame so the client never runs ahead of inference
+            if credit_mode:
+                credit = mailbox.take_consumed()
+                if response is not None:
+                    response['credit'] = credit
+                elif credit:
+                    response = {'type': 'credit', 'frames': credit}
             
-            elif message['type'] == 'reset':
-                rep_counter.reset()
-                await websocket.send_json({'type': 'reset_confirmed'})
+            if response is not None and compact_encoder is not None and response['type'] == 'analysis':
+                await websocket.send_bytes(compact_encoder.encode(
+                    response,
+                    landmark_array,
+                    response.pop('seq', 0),
+                    response.pop('client_ts', 0.0)
+                ))
+            elif response is not None:
+                if response.get('angles'):
+                    response['angles'] = {k: round(v, 1) if isinstance(v, (int, float)) else v for k, v in response['angles'].items()}
+                await websocket.send_json(response)
+            
+            if response is not None and response['type'] == 'analysis':
+                timer.lap('send')
+                stage_ms = {**worker_stage_ms, **timer.stage_ms}
+                stage_ms['total'] = sum(timer.stage_ms.values())
+                pipeline_metrics.observe_stages(metrics_label, stage_ms)
+                session_timings.observe_stages(metrics_label, stage_ms)
+                pipeline_metrics.count_frame(metrics_label, mailbox.dropped - dropped_reported)
+                dropped_reported = mailbox.dropped
     
     except WebSocketDisconnect:
-        print("Client disconnected")
+        pass
+    finally:
+        pipeline_metrics.active_connections -= 1
+        if session:
+            session.detach()
+        receiver.cancel()
+        outcome = (await asyncio.gather(receiver, return_exceptions=True))[0]
+        if isinstance(outcome, Exception):
+            logger.error("WebSocket receiver failed", exc_info=outcome)
+        pose_executor.release(connection_id)
+        logger.info("Client disconnected (%s)", exercise_type)
 
 
 if __name__ == "__main__":
@@ -9,7 +9,11 @@ from pathlib import Path
 from datetime import datetime
 import os
 
+from analytics import rebuild_daily_activity, rebuild_error_rollup, rebuild_cohort_summary
+from db import Database
+
 DB_PATH = Path("rehab_v3.db")
+db = Database(DB_PATH, size=1, read_size=1)
 
 def clear_screen():
     os.system('cls' if os.name == 'nt' else 'clear')
@@ -19,16 +23,16 @@ def print_header(title):
     print(f"  {title}")
     print("=" * 80 + "\n")
 
-def connect_db():
+def connect_db(readonly=False):
     if not DB_PATH.exists():
         print(f"❌ Database not found: {DB_PATH}")
         print("   Run 'python main.py' first to create the database.")
         sys.exit(1)
-    return sqlite3.connect(DB_PATH)
+    return db.connect(readonly=readonly)
 
 def view_all_tables():
     """Show all tables in database"""
-    conn = connect_db()
+    conn = connect_db(readonly=True)
     cursor = conn.cursor()
     
     print_header("📊 All Tables in Database")
@@ -45,7 +49,7 @@ def view_all_tables():
 
 def view_users():
     """View all users"""
-    conn = connect_db()
+    conn = connect_db(readonly=True)
     cursor = conn.cursor()
     
     print_header("👥 All Users")
@@ -70,7 +74,7 @@ def view_users():
 
 def view_sessions():
     """View recent sessions"""
-    conn = connect_db()
+    conn = connect_db(readonly=True)
     cursor = conn.cursor()
     
     print_header("🏋️ Recent Sessions (Last 20)")
@@ -99,7 +103,7 @@ def view_sessions():
 
 def view_session_errors():
     """View errors from sessions"""
-    conn = connect_db()
+    conn = connect_db(readonly=True)
     cursor = conn.cursor()
     
     print_header("⚠️ Session Errors Summary")
@@ -170,8 +174,15 @@ def delete_user():
         # Delete sessions and errors first
         cursor.execute("DELETE FROM session_errors WHERE session_id IN (SELECT id FROM sessions WHERE patient_id = ?)", (user_id,))
         cursor.execute("DELETE FROM session_frames WHERE session_id IN (SELECT id FROM sessions WHERE patient_id = ?)", (user_id,))
+        cursor.execute("DELETE FROM session_timeseries_chunks WHERE session_id IN (SELECT id FROM sessions WHERE patient_id = ?)", (user_id,))
+        cursor.execute("DELETE FROM session_timeseries WHERE session_id IN (SELECT id FROM sessions WHERE patient_id = ?)", (user_id,))
         cursor.execute("DELETE FROM sessions WHERE patient_id = ?", (user_id,))
         cursor.execute("DELETE FROM user_exercise_limits WHERE user_id = ?", (user_id,))
+        cursor.execute("DELETE FROM error_rollup WHERE patient_id = ?", (user_id,))
+        cursor.execute("DELETE FROM daily_activity WHERE patient_id = ?", (user_id,))
+        cursor.execute("DELETE FROM activity_streaks WHERE patient_id = ?", (user_id,))
+        cursor.execute("DELETE FROM patient_summary WHERE patient_id = ?", (user_id,))
+        cursor.execute("DELETE FROM weekly_activity WHERE patient_id = ?", (user_id,))
         cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
         
         conn.commit()
@@ -229,9 +240,16 @@ def delete_session():
             return
         
         # Delete
+        owner = cursor.execute("SELECT patient_id FROM sessions WHERE id = ?", (session_id,)).fetchone()
         cursor.execute("DELETE FROM session_errors WHERE session_id = ?", (session_id,))
         cursor.execute("DELETE FROM session_frames WHERE session_id = ?", (session_id,))
+        cursor.execute("DELETE FROM session_timeseries_chunks WHERE session_id = ?", (session_id,))
+        cursor.execute("DELETE FROM session_timeseries WHERE session_id = ?", (session_id,))
         cursor.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+        if owner:
+            rebuild_error_rollup(cursor, owner[0])
+            rebuild_daily_activity(cursor, owner[0])
+            rebuild_cohort_summary(cursor, owner[0])
         
         conn.commit()
         print(f"✅ Session {session_id} deleted successfully!")
@@ -269,7 +287,14 @@ def clear_all_sessions():
     try:
         cursor.execute("DELETE FROM session_errors")
         cursor.execute("DELETE FROM session_frames")
+        cursor.execute("DELETE FROM session_timeseries_chunks")
+        cursor.execute("DELETE FROM session_timeseries")
         cursor.execute("DELETE FROM sessions")
+        cursor.execute("DELETE FROM error_rollup")
+        cursor.execute("DELETE FROM daily_activity")
+        cursor.execute("DELETE FROM activity_streaks")
+        cursor.execute("DELETE FROM patient_summary")
+        cursor.execute("DELETE FROM weekly_activity")
         conn.commit()
         print(f"✅ All {count} sessions deleted successfully!")
     except Exception as e:
@@ -287,8 +312,12 @@ def backup_database():
     backup_path = f"rehab_v3_backup_{timestamp}.db"
     
     try:
-        import shutil
-        shutil.copy2(DB_PATH, backup_path)
+        # Pages committed to the WAL are not in the main file yet - copy through SQLite, not the filesystem
+        conn = connect_db(readonly=True)
+        backup = sqlite3.connect(backup_path)
+        conn.backup(backup)
+        backup.close()
+        conn.close()
         print(f"✅ Backup created: {backup_path}")
         print(f"   Size: {Path(backup_path).stat().st_size / 1024:.2f} KB")
     except Exception as e:
@@ -298,7 +327,7 @@ def backup_database():
 
 def show_database_stats():
     """Show database statistics"""
-    conn = connect_db()
+    conn = connect_db(readonly=True)
     cursor = conn.cursor()
     
     print_header("📈 Database Statistics")
@@ -366,14 +395,15 @@ def execute_custom_query():
         cursor.execute(query)
         
         if query.strip().upper().startswith('SELECT'):
-            # Show results
-            results = cursor.fetchall()
+            # Show the first 20 rows; the rest are only counted, never held in memory
+            results = cursor.fetchmany(20)
             if results:
-                print(f"\n✅ Found {len(results)} rows:")
-                for i, row in enumerate(results[:20], 1):  # Limit to 20 rows
+                remaining = sum(1 for _ in cursor)
+                print(f"\n✅ Found {len(results) + remaining} rows:")
+                for i, row in enumerate(results, 1):
                     print(f"   {i}. {row}")
-                if len(results) > 20:
-                    print(f"   ... and {len(results) - 20} more rows")
+                if remaining:
+                    print(f"   ... and {remaining} more rows (use export.py for full exports)")
             else:
                 print("✅ Query executed, no results returned.")
         else:
@@ -389,6 +419,26 @@ def execute_custom_query():
     conn.close()
     input("\n👉 Press Enter to continue...")
 
+def rebuild_analytics():
+    """Recompute error_rollup, daily_activity and the cohort summary from sessions (after custom SQL edits)"""
+    print_header("📈 Rebuild Analytics")
+    
+    conn = connect_db()
+    try:
+        cursor = conn.cursor()
+        error_rows = rebuild_error_rollup(cursor)
+        activity_rows = rebuild_daily_activity(cursor)
+        rebuild_cohort_summary(cursor)
+        conn.commit()
+        print(f"✅ error_rollup rebuilt: {error_rows} rows")
+        print(f"✅ daily_activity rebuilt: {activity_rows} rows")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        conn.rollback()
+    
+    conn.close()
+    input("\n👉 Press Enter to continue...")
+
 def main_menu():
     while True:
         clear_screen()
@@ -409,6 +459,7 @@ def main_menu():
         print("\n🔧 ADVANCED:")
         print("  9. Execute custom SQL query")
         print("  10. Backup database")
+        print("  11. Rebuild analytics (errors, daily activity, cohort summary)")
         
         print("\n  0. Exit")
         
@@ -437,6 +488,8 @@ def main_menu():
             execute_custom_query()
         elif choice == '10':
             backup_database()
+        elif choice == '11':
+            rebuild_analytics()
         else:
             print("❌ Invalid option. Please try again.")
             input("\n👉 Press Enter to continue...")
@@ -0,0 +1,410 @@
+"""
+Versioned schema migrations for the rehab database
+
+Migrations are numbered and applied in order, each in its own transaction,
+and recorded in the schema_version table. Every migration is idempotent
+(IF NOT EXISTS, column checks), so databases created by older versions of
+init_db() / migrate_db.py are brought up to date without special cases.
+
+    python migrations.py                # apply pending migrations
+    python migrations.py --status       # show applied / pending versions
+    python migrations.py --check-plans  # fail if a hot query stops using its index
+"""
+
+import argparse
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, List, NamedTuple, Sequence, Tuple
+
+from analytics import rebuild_daily_activity, rebuild_error_rollup, rebuild_cohort_summary
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable
+
+
+def _base_schema(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            role TEXT NOT NULL CHECK(role IN ('patient', 'doctor')),
+            full_name TEXT,
+            age INTEGER,
+            gender TEXT CHECK(gender IN ('male', 'female', 'other')),
+            height_cm REAL,
+            weight_kg REAL,
+            bmi REAL,
+            medical_conditions TEXT,
+            injury_type TEXT,
+            mobility_level TEXT CHECK(mobility_level IN ('beginner', 'intermediate', 'advanced')),
+            pain_level INTEGER CHECK(pain_level BETWEEN 0 AND 10),
+            doctor_notes TEXT,
+            contraindicated_exercises TEXT,
+            created_at TEXT NOT NULL,
+            doctor_id INTEGER,
+            FOREIGN KEY (doctor_id) REFERENCES users(id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patient_id INTEGER NOT NULL,
+            exercise_name TEXT NOT NULL,
+            start_time TEXT NOT NULL,
+            end_time TEXT,
+            total_reps INTEGER DEFAULT 0,
+            correct_reps INTEGER DEFAULT 0,
+            accuracy REAL DEFAULT 0,
+            duration_seconds INTEGER DEFAULT 0,
+            avg_heart_rate INTEGER,
+            notes TEXT,
+            FOREIGN KEY (patient_id) REFERENCES users(id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS session_frames (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER NOT NULL,
+            timestamp TEXT NOT NULL,
+            rep_count INTEGER,
+            angles TEXT,
+            errors TEXT,
+            FOREIGN KEY (session_id) REFERENCES sessions(id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS session_errors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER NOT NULL,
+            error_name TEXT NOT NULL,
+            count INTEGER DEFAULT 0,
+            severity TEXT,
+            FOREIGN KEY (session_id) REFERENCES sessions(id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_exercise_limits (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            exercise_type TEXT NOT NULL,
+            max_depth_angle REAL,
+            min_raise_angle REAL,
+            max_reps_per_set INTEGER,
+            recommended_rest_seconds INTEGER,
+            difficulty_score REAL,
+            injury_risk_score REAL,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    """)
+
+
+def _user_biometrics(cursor):
+    """Columns added for AI personalization (formerly migrate_db.py)"""
+    existing = {row[1] for row in cursor.execute("PRAGMA table_info(users)")}
+    for column_name, column_type in [
+        ("height_cm", "REAL"),
+        ("weight_kg", "REAL"),
+        ("bmi", "REAL"),
+        ("medical_conditions", "TEXT"),
+        ("injury_type", "TEXT"),
+        ("mobility_level", "TEXT"),
+        ("pain_level", "INTEGER"),
+        ("doctor_notes", "TEXT"),
+        ("contraindicated_exercises", "TEXT"),
+    ]:
+        if column_name not in existing:
+            cursor.execute(f"ALTER TABLE users ADD COLUMN {column_name} {column_type}")
+
+
+def _session_timeseries(cursor):
+    # Per-session columnar time series (see timeseries.py); replaces row-per-frame session_frames
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS session_timeseries (
+            session_id INTEGER PRIMARY KEY,
+            header TEXT NOT NULL,
+            FOREIGN KEY (session_id) REFERENCES sessions(id)
+        )
+    """)
+    # One row per chunk: appending a chunk never rewrites what is already stored
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS session_timeseries_chunks (
+            session_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            frames INTEGER NOT NULL,
+            t0 REAL NOT NULL,
+            t1 REAL NOT NULL,
+            offsets TEXT NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (session_id, seq),
+            FOREIGN KEY (session_id) REFERENCES sessions(id)
+        )
+    """)
+
+
+def _query_indexes(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_patient_start ON sessions(patient_id, start_time)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_session_errors_session ON session_errors(session_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_doctor_role ON users(doctor_id, role)")
+    # INSERT OR REPLACE in /api/ai/personalized-params only replaces with a unique key; keep the newest row
+    cursor.execute("""
+        DELETE FROM user_exercise_limits WHERE id NOT IN (
+            SELECT MAX(id) FROM user_exercise_limits GROUP BY user_id, exercise_type
+        )
+    """)
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_user_exercise_limits_user_exercise
+        ON user_exercise_limits(user_id, exercise_type)
+    """)
+
+
+def _error_rollup(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS error_rollup (
+            patient_id INTEGER NOT NULL,
+            exercise_name TEXT NOT NULL,
+            error_name TEXT NOT NULL,
+            total_count INTEGER NOT NULL DEFAULT 0,
+            session_count INTEGER NOT NULL DEFAULT 0,
+            last_seen TEXT,
+            PRIMARY KEY (patient_id, exercise_name, error_name)
+        ) WITHOUT ROWID
+    """)
+    rebuild_error_rollup(cursor)  # Backfill from existing history
+
+
+def _daily_activity(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS daily_activity (
+            patient_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            exercise_name TEXT NOT NULL,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            total_reps INTEGER NOT NULL DEFAULT 0,
+            correct_reps INTEGER NOT NULL DEFAULT 0,
+            duration_seconds INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (patient_id, day, exercise_name)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS activity_streaks (
+            patient_id INTEGER PRIMARY KEY,
+            last_day TEXT NOT NULL,
+            current_streak INTEGER NOT NULL,
+            longest_streak INTEGER NOT NULL
+        )
+    """)
+    rebuild_daily_activity(cursor)  # Backfill from finished sessions
+
+
+def _cohort_summary(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS patient_summary (
+            patient_id INTEGER PRIMARY KEY,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            total_reps INTEGER NOT NULL DEFAULT 0,
+            correct_reps INTEGER NOT NULL DEFAULT 0,
+            duration_seconds INTEGER NOT NULL DEFAULT 0,
+            first_day TEXT,
+            last_day TEXT
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS weekly_activity (
+            patient_id INTEGER NOT NULL,
+            week_start TEXT NOT NULL,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            total_reps INTEGER NOT NULL DEFAULT 0,
+            correct_reps INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (patient_id, week_start)
+        ) WITHOUT ROWID
+    """)
+    rebuild_cohort_summary(cursor)  # Backfill from daily_activity
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "base schema", _base_schema),
+    Migration(2, "user biometric columns", _user_biometrics),
+    Migration(3, "session_timeseries tables", _session_timeseries),
+    Migration(4, "indexes for history, error and patient queries", _query_indexes),
+    Migration(5, "error analytics rollup", _error_rollup),
+    Migration(6, "daily activity rollup and streaks", _daily_activity),
+    Migration(7, "patient summary and weekly activity for the cohort view", _cohort_summary),
+]
+
+
+def current_version(conn) -> int:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    """)
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def migrate(conn, migrations: Sequence[Migration] = MIGRATIONS) -> List[Migration]:
+    """Apply pending migrations in order; returns the ones applied"""
+    version = current_version(conn)
+    conn.commit()
+    applied = []
+    for migration in sorted(migrations, key=lambda m: m.version):
+        if migration.version <= version:
+            continue
+        cursor = conn.cursor()
+        cursor.execute("BEGIN")  # DDL included: a failed migration leaves no trace
+        try:
+            migration.apply(cursor)
+            cursor.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (migration.version, migration.description, datetime.now().isoformat())
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(migration)
+    return applied
+
+
+# ============= QUERY PLAN CHECKS =============
+# (name, query, parameters, index the plan must use, plan fragments that must not appear)
+QUERY_PLAN_CHECKS: List[Tuple[str, str, tuple, str, Tuple[str, ...]]] = [
+    ("patient history", """
+        SELECT id, exercise_name, start_time, total_reps, correct_reps, accuracy, duration_seconds
+        FROM sessions WHERE patient_id = ? ORDER BY start_time DESC, id DESC LIMIT ?
+    """, (1, 20), "idx_sessions_patient_start", ("USE TEMP B-TREE",)),
+    ("patient history page", """
+        SELECT id, exercise_name, start_time, total_reps, correct_reps, accuracy, duration_seconds
+        FROM sessions WHERE patient_id = ? AND (start_time, id) < (?, ?)
+        ORDER BY start_time DESC, id DESC LIMIT ?
+    """, (1, '2026-01-01T00:00:00', 100, 20), "idx_sessions_patient_start", ("USE TEMP B-TREE",)),
+    ("history errors", """
+        SELECT session_id, error_name, count, severity FROM session_errors WHERE session_id IN (?, ?, ?) ORDER BY id
+    """, (1, 2, 3), "idx_session_errors_session", ("SCAN session_errors",)),
+    ("error rollup", """
+        SELECT exercise_name, error_name, total_count, session_count, last_seen
+        FROM error_rollup WHERE patient_id = ? ORDER BY exercise_name, total_count DESC
+    """, (1,), "error_rollup USING PRIMARY KEY", ("SCAN error_rollup",)),
+    ("activity calendar", """
+        SELECT day, exercise_name, sessions, total_reps, correct_reps, duration_seconds
+        FROM daily_activity WHERE patient_id = ? AND day BETWEEN ? AND ?
+    """, (1, '2025-10-17', '2026-10-17'), "daily_activity USING PRIMARY KEY", ("SCAN daily_activity",)),
+    ("latest session", """
+        SELECT start_time, exercise_name, accuracy
+        FROM sessions WHERE patient_id = ? ORDER BY start_time DESC LIMIT 1
+    """, (1,), "idx_sessions_patient_start", ("USE TEMP B-TREE",)),
+    ("session errors", """
+        SELECT error_name, count, severity FROM session_errors WHERE session_id = ?
+    """, (1,), "idx_session_errors_session", ("SCAN session_errors",)),
+    ("patient error rollup rebuild", """
+        SELECT s.patient_id, s.exercise_name, se.error_name, SUM(se.count), COUNT(DISTINCT s.id), MAX(s.start_time)
+        FROM session_errors se JOIN sessions s ON se.session_id = s.id
+        WHERE s.patient_id = ?
+        GROUP BY s.patient_id, s.exercise_name, se.error_name
+    """, (1,), "idx_session_errors_session", ("SCAN session_errors", "SCAN s ")),
+    ("doctor's patients", """
+        SELECT id, username, full_name, age, gender, created_at
+        FROM users WHERE role = 'patient' AND doctor_id = ? ORDER BY full_name
+    """, (1,), "idx_users_doctor_role", ("SCAN users",)),
+    ("cohort activity", """
+        SELECT u.id, SUM(da.sessions), COUNT(DISTINCT da.day), SUM(da.total_reps)
+        FROM users u JOIN daily_activity da ON da.patient_id = u.id AND da.day BETWEEN ? AND ?
+        WHERE u.role = 'patient' AND u.doctor_id = ?
+        GROUP BY u.id
+    """, ('2026-09-18', '2026-10-17', 1), "da USING PRIMARY KEY", ("SCAN daily_activity", "SCAN u", "TEMP B-TREE FOR GROUP BY")),
+    ("cohort accuracy trend", """
+        SELECT u.id, wa.week_start, wa.correct_reps, wa.total_reps
+        FROM users u JOIN weekly_activity wa ON wa.patient_id = u.id AND wa.week_start BETWEEN ? AND ?
+        WHERE u.role = 'patient' AND u.doctor_id = ?
+    """, ('2026-07-27', '2026-10-12', 1), "wa USING PRIMARY KEY", ("SCAN weekly_activity", "SCAN u")),
+    ("cohort errors", """
+        SELECT u.id, er.error_name, SUM(er.total_count)
+        FROM users u JOIN error_rollup er ON er.patient_id = u.id
+        WHERE u.role = 'patient' AND u.doctor_id = ?
+        GROUP BY u.id, er.error_name
+    """, (1,), "er USING PRIMARY KEY", ("SCAN error_rollup", "SCAN u")),
+    ("export sessions of a doctor", """
+        SELECT s.id, s.patient_id, s.exercise_name, s.start_time, s.end_time
+        FROM sessions s
+        WHERE s.patient_id IN (SELECT id FROM users WHERE role = 'patient' AND doctor_id = ?) AND s.start_time >= ?
+        ORDER BY s.patient_id, s.start_time, s.id
+    """, (1, '2026-01-01'), "idx_sessions_patient_start", ("TEMP B-TREE", "SCAN s ")),
+    ("export errors of a patient", """
+        SELECT se.session_id, s.patient_id, s.exercise_name, s.start_time, se.error_name, se.count, se.severity
+        FROM sessions s JOIN session_errors se ON se.session_id = s.id
+        WHERE s.patient_id = ?
+        ORDER BY s.patient_id, s.start_time, s.id, se.id
+    """, (1,), "idx_session_errors_session", ("TEMP B-TREE", "SCAN se")),
+    ("time-series chunks", """
+        SELECT seq, frames, t0, t1, offsets FROM session_timeseries_chunks WHERE session_id = ? ORDER BY seq
+    """, (1,), "sqlite_autoindex_session_timeseries_chunks_1", ("SCAN session_timeseries_chunks", "TEMP B-TREE")),
+    ("exercise limits", """
+        SELECT * FROM user_exercise_limits WHERE user_id = ? AND exercise_type = ?
+    """, (1, 'squat'), "idx_user_exercise_limits_user_exercise", ("SCAN user_exercise_limits",)),
+]
+
+
+def explain(conn, query: str, parameters: tuple = ()) -> List[str]:
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", parameters)]
+
+
+def check_query_plans(conn) -> List[str]:
+    """Problems found in the plans of QUERY_PLAN_CHECKS; empty when every query uses its index"""
+    problems = []
+    for name, query, parameters, index, forbidden in QUERY_PLAN_CHECKS:
+        plan = explain(conn, query, parameters)
+        text = " | ".join(plan)
+        if index not in text:
+            problems.append(f"{name}: does not use {index} ({text})")
+        for fragment in forbidden:
+            if fragment in text + " ":
+                problems.append(f"{name}: plan contains '{fragment.strip()}' ({text})")
+    return problems
+
+
+def main(argv=None):
+    from db import Database
+
+    parser = argparse.ArgumentParser(description="Rehab database schema migrations")
+    parser.add_argument("--db", default="rehab_v3.db", help="database file (default: rehab_v3.db)")
+    parser.add_argument("--status", action="store_true", help="show applied and pending migrations")
+    parser.add_argument("--check-plans", action="store_true", help="check that hot queries use their indexes")
+    args = parser.parse_args(argv)
+
+    db = Database(Path(args.db), size=1, read_size=1)
+    conn = db.connect()
+    try:
+        if args.status:
+            version = current_version(conn)
+            for migration in MIGRATIONS:
+                mark = "✅" if migration.version <= version else "⏳"
+                print(f"{mark} {migration.version:>3}  {migration.description}")
+            return 0
+
+        for migration in migrate(conn):
+            print(f"✅ Applied migration {migration.version}: {migration.description}")
+        print(f"📦 Schema version: {current_version(conn)}")
+
+        if args.check_plans:
+            problems = check_query_plans(conn)
+            for problem in problems:
+                print(f"❌ {problem}")
+            if problems:
+                return 1
+            print(f"✅ All {len(QUERY_PLAN_CHECKS)} queries use their indexes")
+        return 0
+    finally:
+        conn.close()
+        db.close_all()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
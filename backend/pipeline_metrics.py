@@ -0,0 +1,216 @@
+"""
+Latency histograms and gauges for the exercise pipeline
+Rendered in Prometheus text format by the /metrics endpoint
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Upper bucket bounds in milliseconds: 0.125 ms .. ~4 s, doubling
+BUCKET_BOUNDS_MS = [0.125 * 2 ** i for i in range(16)]
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class LatencyHistogram:
+    """Fixed-bucket histogram; observe() is a bisect and a few additions"""
+
+    __slots__ = ('counts', 'count', 'total_ms', 'max_ms')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS_MS) + 1)  # Last bucket is +Inf
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms: float):
+        self.counts[bisect_left(BUCKET_BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def copy(self) -> 'LatencyHistogram':
+        other = LatencyHistogram()
+        other.counts = list(self.counts)
+        other.count, other.total_ms, other.max_ms = self.count, self.total_ms, self.max_ms
+        return other
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate a quantile (ms) by linear interpolation inside its bucket"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = BUCKET_BOUNDS_MS[i - 1] if i > 0 else 0.0
+                upper = BUCKET_BOUNDS_MS[i] if i < len(BUCKET_BOUNDS_MS) else BUCKET_BOUNDS_MS[-1]
+                return min(lower + (upper - lower) * (rank - seen) / bucket_count, self.max_ms)
+            seen += bucket_count
+        return self.max_ms
+
+    def summary(self) -> Dict:
+        entry = {
+            'count': self.count,
+            'mean_ms': round(self.total_ms / self.count, 3) if self.count else None,
+            'max_ms': round(self.max_ms, 3),
+        }
+        for q in QUANTILES:
+            value = self.quantile(q)
+            entry[f'p{round(q * 100)}_ms'] = round(value, 3) if value is not None else None
+        return entry
+
+
+class StageTimings:
+    """
+    Histograms keyed by (exercise, stage)
+    Observed from DB threads as well as the event loop, so every access holds `_lock`
+    """
+
+    def __init__(self):
+        self.histograms: Dict[Tuple[str, str], LatencyHistogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, exercise: str, stage: str, ms: float):
+        with self._lock:
+            histogram = self.histograms.get((exercise, stage))
+            if histogram is None:
+                histogram = self.histograms[(exercise, stage)] = LatencyHistogram()
+            histogram.observe(ms)
+
+    def observe_stages(self, exercise: str, stage_ms: Dict[str, float]):
+        for stage, ms in stage_ms.items():
+            if not stage.startswith('baseline_'):
+                self.observe(exercise, stage, ms)
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+
+    def copies(self) -> List[Tuple[Tuple[str, str], LatencyHistogram]]:
+        """Consistent copies of the histograms, sorted by key"""
+        with self._lock:
+            return sorted((key, histogram.copy()) for key, histogram in self.histograms.items())
+
+    def snapshot(self) -> Dict:
+        result: Dict[str, Dict] = {}
+        for (exercise, stage), histogram in self.copies():
+            result.setdefault(exercise, {})[stage] = histogram.summary()
+        return result
+
+
+class StageTimer:
+    """
+    Times consecutive stages of one frame
+
+        timer = StageTimer()
+        ...                 # work
+        timer.lap('angles')
+    """
+
+    __slots__ = ('stage_ms', '_last')
+
+    def __init__(self):
+        self.stage_ms: Dict[str, float] = {}
+        self._last = time.perf_counter()
+
+    def restart(self):
+        self._last = time.perf_counter()
+
+    def lap(self, stage: str):
+        now = time.perf_counter()
+        self.stage_ms[stage] = self.stage_ms.get(stage, 0.0) + (now - self._last) * 1000
+        self._last = now
+
+
+class PipelineMetrics(StageTimings):
+    """Process-wide stage histograms plus connection, drop and inference-queue gauges"""
+
+    def __init__(self):
+        super().__init__()
+        self.queries = StageTimings()  # Keyed by (pool, statement kind)
+        self.db_operations = StageTimings()  # Keyed by (operation, 'wait' | 'run')
+        self.active_connections = 0
+        self.inference_in_flight = 0
+        self.frames: Dict[str, int] = {}
+        self.dropped_frames: Dict[str, int] = {}
+        self._gauge_callbacks: List[Tuple[str, str, Callable[[], float], str]] = []
+
+    def add_gauge(self, name: str, help_text: str, callback: Callable[[], float], kind: str = 'gauge'):
+        """Register a gauge (or counter) whose value is read when /metrics is rendered"""
+        self._gauge_callbacks.append((name, help_text, callback, kind))
+
+    def count_frame(self, exercise: str, dropped: int = 0):
+        self.frames[exercise] = self.frames.get(exercise, 0) + 1
+        if dropped:
+            self.dropped_frames[exercise] = self.dropped_frames.get(exercise, 0) + dropped
+
+    def reset(self):
+        """Clear histograms and counters; live gauges keep their values"""
+        super().reset()
+        self.queries.reset()
+        self.db_operations.reset()
+        self.frames.clear()
+        self.dropped_frames.clear()
+
+    def snapshot(self) -> Dict:
+        return {
+            'active_connections': self.active_connections,
+            'inference_in_flight': self.inference_in_flight,
+            'frames': dict(self.frames),
+            'dropped_frames': dict(self.dropped_frames),
+            'stages': super().snapshot(),
+            'db_queries': self.queries.snapshot(),
+            'db_operations': self.db_operations.snapshot(),
+        }
+
+    def render_prometheus(self) -> str:
+        lines: List[str] = []
+
+        def family(name: str, kind: str, help_text: str, samples: Iterable[Tuple[str, float]]):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for suffix_labels, value in samples:
+                lines.append(f'{name}{suffix_labels} {value:g}')
+
+        family('rehab_active_connections', 'gauge', 'Open exercise WebSocket connections',
+               [('', self.active_connections)])
+        family('rehab_inference_in_flight', 'gauge', 'Frames submitted to the pose workers and not yet returned',
+               [('', self.inference_in_flight)])
+        for name, help_text, callback, kind in self._gauge_callbacks:
+            family(name, kind, help_text, [('', callback())])
+        family('rehab_frames_total', 'counter', 'Frames processed',
+               [(f'{{exercise="{exercise}"}}', count) for exercise, count in sorted(self.frames.items())])
+        family('rehab_dropped_frames_total', 'counter', 'Frames replaced by a newer frame before processing',
+               [(f'{{exercise="{exercise}"}}', count) for exercise, count in sorted(self.dropped_frames.items())])
+
+        def histograms(name: str, help_text: str, label_names: Tuple[str, str], timings: StageTimings):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for key, histogram in timings.copies():
+                labels = ','.join(f'{label}="{value}"' for label, value in zip(label_names, key))
+                cumulative = 0
+                for bound, bucket_count in zip(BUCKET_BOUNDS_MS + [None], histogram.counts):
+                    cumulative += bucket_count
+                    le = '+Inf' if bound is None else f'{bound / 1000:g}'
+                    lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+                lines.append(f'{name}_sum{{{labels}}} {histogram.total_ms / 1000:g}')
+                lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+
+        histograms('rehab_stage_duration_seconds', 'Time spent in each stage of the exercise pipeline',
+                   ('exercise', 'stage'), self)
+        histograms('rehab_db_query_duration_seconds', 'SQLite statement execution time',
+                   ('pool', 'statement'), self.queries)
+        histograms('rehab_db_operation_duration_seconds', 'Database operations of the API: time queued for a DB thread and time running',
+                   ('operation', 'phase'), self.db_operations)
+
+        family('rehab_stage_duration_quantile_seconds', 'gauge', 'Estimated p50/p95/p99 per stage', [
+            (f'{{exercise="{exercise}",stage="{stage}",quantile="{q:g}"}}', histogram.quantile(q) / 1000)
+            for (exercise, stage), histogram in self.copies()
+            if histogram.count
+            for q in QUANTILES
+        ])
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,253 @@
+"""
+Pose inference executor
+Runs MediaPipe Pose in worker processes so inference never blocks the asyncio event loop
+"""
+
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+# Lightweight stand-in for MediaPipe's NormalizedLandmark (same attribute names)
+Landmark = namedtuple('Landmark', ['x', 'y', 'z', 'visibility'])
+
+NUM_LANDMARKS = 33
+
+# Per-worker state (set by _init_worker inside each worker process)
+_worker_graphs: List = []
+_worker_rois: List = []  # One RoiTracker per graph slot
+_worker_decoders: List = []  # One FrameDecoder per graph slot
+_roi_size = 0  # Longest side of the ROI crop fed to the model; 0 disables ROI cropping
+
+
+def _init_worker(num_graphs: int, model_complexity: int, num_threads: int, roi_size: int = 0, decode_size: int = 0):
+    """Create and prewarm this worker's Pose graphs and pin its native thread pools"""
+    global _worker_graphs, _worker_rois, _worker_decoders, _roi_size
+
+    for var in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS'):
+        os.environ[var] = str(num_threads)
+
+    import cv2
+    import mediapipe as mp
+    from frame_pipeline import FrameDecoder, RoiTracker
+
+    cv2.setNumThreads(num_threads)
+    _roi_size = roi_size
+    _worker_rois = [RoiTracker() for _ in range(num_graphs)]
+    _worker_decoders = [FrameDecoder(decode_size) for _ in range(num_graphs)]
+    _worker_graphs = [
+        mp.solutions.pose.Pose(
+            min_detection_confidence=0.5,
+            min_tracking_confidence=0.5,
+            model_complexity=model_complexity
+        )
+        for _ in range(num_graphs)
+    ]
+
+    # First process() call loads the model and builds the delegate - pay it now, not on a patient's first frame
+    blank = np.zeros((256, 256, 3), np.uint8)
+    for graph in _worker_graphs:
+        graph.process(blank)
+        graph.reset()
+
+
+def _ping() -> int:
+    return len(_worker_graphs)
+
+
+def _reset_graph(slot: int):
+    """Clear tracking state so the next lessee starts with a fresh detection"""
+    _worker_graphs[slot].reset()
+    _worker_rois[slot].reset()
+    _worker_decoders[slot].reset()
+
+
+def _run_graph(graph, decoder, bgr_image: np.ndarray, stage_ms: Dict[str, float]) -> Optional[np.ndarray]:
+    start = time.perf_counter()
+    rgb_image = decoder.to_rgb(bgr_image)
+    converted = time.perf_counter()
+    results = graph.process(rgb_image)
+    done = time.perf_counter()
+
+    stage_ms['color'] = stage_ms.get('color', 0.0) + (converted - start) * 1000
+    stage_ms['inference'] = stage_ms.get('inference', 0.0) + (done - converted) * 1000
+
+    if not results.pose_landmarks:
+        return None
+    return landmarks_to_array(results.pose_landmarks.landmark)
+
+
+def _infer(slot: int, jpeg: bytes) -> Tuple[Optional[np.ndarray], Dict[str, float]]:
+    """
+    Decode a JPEG and run pose inference
+
+    Returns a (33, 4) float32 landmark array (or None) and the time spent in
+    each stage in milliseconds.
+    """
+    from frame_pipeline import crop_to_roi, roi_to_frame
+
+    graph = _worker_graphs[slot]
+    tracker = _worker_rois[slot]
+    decoder = _worker_decoders[slot]
+    stage_ms: Dict[str, float] = {}
+
+    if decoder.should_sample_baseline():
+        for stage, ms in decoder.measure_baseline(jpeg).items():
+            stage_ms[f'baseline_{stage}'] = ms
+
+    start = time.perf_counter()
+    frame, scale_changed = decoder.decode(jpeg)
+    stage_ms['decode'] = (time.perf_counter() - start) * 1000
+    if frame is None:
+        return None, stage_ms
+
+    if scale_changed:
+        # ROI is in decoded-frame pixels
+        tracker.reset()
+        graph.reset()
+    frame_h, frame_w = frame.shape[:2]
+
+    # Crop to the region around last frame's pose; colour conversion and inference only see the crop
+    landmarks = None
+    if tracker.roi is not None:
+        start = time.perf_counter()
+        crop = crop_to_roi(frame, tracker.roi, _roi_size)
+        stage_ms['crop'] = (time.perf_counter() - start) * 1000
+        landmarks = _run_graph(graph, decoder, crop, stage_ms)
+        if landmarks is not None:
+            landmarks = roi_to_frame(landmarks, tracker.roi, frame_w, frame_h)
+        else:
+            # Tracking lost - fall back to a fresh detection on the full frame
+            tracker.reset()
+            graph.reset()
+
+    if landmarks is None:
+        landmarks = _run_graph(graph, decoder, frame, stage_ms)
+
+    if _roi_size and landmarks is not None:
+        # A moved crop invalidates MediaPipe's internal tracking window
+        if tracker.update(landmarks, frame_w, frame_h):
+            graph.reset()
+
+    return landmarks, stage_ms
+
+
+def landmarks_from_array(landmark_array: np.ndarray) -> List[Landmark]:
+    """Wrap a (33, 4) landmark array so existing code can use `.x`, `.y`, `.z`, `.visibility`"""
+    return [Landmark(*row) for row in landmark_array.tolist()]
+
+
+def landmarks_to_array(landmarks) -> np.ndarray:
+    """(33, 4) float32 array from any sequence of objects with `.x`, `.y`, `.z`, `.visibility`"""
+    return np.array([(lm.x, lm.y, lm.z, lm.visibility) for lm in landmarks], dtype=np.float32)
+
+
+class PoseLease(NamedTuple):
+    worker: int
+    slot: int
+
+
+class PoseInferenceExecutor:
+    """
+    Pool of single-process pose workers holding a bounded set of Pose graphs
+
+    MediaPipe's tracking mode assumes one continuous video stream, so every
+    connection leases a graph of its own for its lifetime and returns it on
+    disconnect. Graphs are spread over the workers and leases go to the least
+    loaded worker. When every graph is leased, lease() returns None and the
+    caller reports a busy status.
+    With num_workers=0 inference runs on a single background thread instead.
+    """
+
+    def __init__(self, num_workers: int, pool_size: int, model_complexity: int = 1,
+                 threads_per_worker: int = 1, roi_size: int = 0, decode_size: int = 0):
+        self.num_workers = num_workers
+        self.pool_size = max(pool_size, 1)
+        self.model_complexity = model_complexity
+        self.threads_per_worker = threads_per_worker
+        self.roi_size = roi_size
+        self.decode_size = decode_size
+        self._workers: List = []
+        self._free_slots: List[List[int]] = []
+        self._leases: Dict[object, PoseLease] = {}
+        self._replace_lock = threading.Lock()
+
+    def _graphs_for_worker(self, index: int) -> int:
+        count = max(1, self.num_workers)
+        return self.pool_size // count + (1 if index < self.pool_size % count else 0)
+
+    def _create_worker(self, index: int):
+        initargs = (self._graphs_for_worker(index), self.model_complexity, self.threads_per_worker,
+                    self.roi_size, self.decode_size)
+        if self.num_workers == 0:
+            return ThreadPoolExecutor(max_workers=1, initializer=_init_worker, initargs=initargs)
+        # spawn: forking a process that already runs TFLite/OpenCV threads is unsafe
+        return ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=initargs
+        )
+
+    async def start(self):
+        """Start every worker and wait until its graphs are prewarmed"""
+        count = max(1, self.num_workers)
+        self._workers = [self._create_worker(i) for i in range(count)]
+        self._free_slots = [list(range(self._graphs_for_worker(i))) for i in range(count)]
+
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(worker, _ping) for worker in self._workers))
+
+    def shutdown(self):
+        for worker in self._workers:
+            worker.shutdown(wait=False, cancel_futures=True)
+        self._workers = []
+        self._free_slots = []
+        self._leases.clear()
+
+    @property
+    def available(self) -> int:
+        return sum(len(slots) for slots in self._free_slots)
+
+    def lease(self, session_key) -> Optional[PoseLease]:
+        """Lease a graph for a session, or None when the pool is exhausted"""
+        if session_key in self._leases:
+            return self._leases[session_key]
+
+        candidates = [i for i, slots in enumerate(self._free_slots) if slots]
+        if not candidates:
+            return None
+
+        # Least loaded worker = the one with the most free graphs
+        index = max(candidates, key=lambda i: len(self._free_slots[i]) / self._graphs_for_worker(i))
+        lease = PoseLease(index, self._free_slots[index].pop())
+        self._leases[session_key] = lease
+        return lease
+
+    def release(self, session_key):
+        lease = self._leases.pop(session_key, None)
+        if lease is None or lease.worker >= len(self._workers):
+            return
+        self._workers[lease.worker].submit(_reset_graph, lease.slot)
+        self._free_slots[lease.worker].append(lease.slot)
+
+    async def process(self, lease: PoseLease, jpeg: bytes) -> Tuple[Optional[np.ndarray], Dict[str, float]]:
+        loop = asyncio.get_running_loop()
+        worker = self._workers[lease.worker]
+        try:
+            return await loop.run_in_executor(worker, _infer, lease.slot, jpeg)
+        except BrokenProcessPool:
+            # Worker died (e.g. native crash) - replace it so later frames recover. Every lessee of
+            # the worker sees the failure; only the first replaces it, and the dead pool is shut down
+            with self._replace_lock:
+                if self._workers[lease.worker] is worker:
+                    self._workers[lease.worker] = self._create_worker(lease.worker)
+                    worker.shutdown(wait=False, cancel_futures=True)
+            raise
@@ -0,0 +1,88 @@
+"""
+Response cache for the read-only history and analytics endpoints
+
+Cached bodies are keyed by (endpoint, user, params) and versioned by a
+generation counter per data scope ('patient', id) / ('doctor', id), bumped
+whenever that scope's data changes (a session ends, a profile is updated).
+The ETag is derived from the key and the generation alone, so a client that
+already holds the current version gets a 304 without a query or
+serialization, even after its body has been evicted.
+
+Generations live in the API process: edits made directly to the database
+(manage_db.py, analytics.py --rebuild) are served stale until a restart.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+
+Scope = Tuple[str, int]  # ('patient', id) or ('doctor', id)
+
+
+class ResponseCache:
+    """Serialized JSON bodies, least recently used evicted first once over max_entries or max_bytes"""
+
+    def __init__(self, max_entries: int = 512, max_bytes: int = 32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+        # New on every start, so an ETag from before a restart never matches a reset generation
+        self._epoch = os.urandom(8).hex()
+        self._generations: Dict[Scope, int] = {}
+        self._entries: "OrderedDict[Hashable, Tuple[str, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def generation(self, scope: Scope) -> int:
+        return self._generations.get(scope, 0)
+
+    def bump(self, patient_id: Optional[int] = None, doctor_id: Optional[int] = None):
+        """A patient's data changed; doctor_id is their doctor, whose patient list shows it too"""
+        with self._lock:
+            for scope in (('patient', patient_id), ('doctor', doctor_id)):
+                if scope[1] is not None:
+                    self._generations[scope] = self._generations.get(scope, 0) + 1
+
+    def etag(self, key: Hashable, scope: Scope) -> str:
+        digest = hashlib.blake2b(repr((self._epoch, key, self.generation(scope))).encode(), digest_size=12)
+        return f'W/"{digest.hexdigest()}"'
+
+    def matches(self, if_none_match: Optional[str], etag: str) -> bool:
+        """If-None-Match holds the current ETag (or *)"""
+        if not if_none_match:
+            return False
+        tags = {tag.strip() for tag in if_none_match.split(',')}
+        return '*' in tags or etag in tags or etag[2:] in tags  # Weak comparison
+
+    def get(self, key: Hashable, etag: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != etag:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, etag: str, body: bytes):
+        """Store the body of the generation `etag` was computed for, replacing any older one"""
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.nbytes -= len(previous[1])
+            self._entries[key] = (etag, body)
+            self.nbytes += len(body)
+            while len(self._entries) > self.max_entries or self.nbytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.nbytes -= len(evicted)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
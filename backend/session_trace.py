@@ -0,0 +1,101 @@
+"""
+Per-session exercise trace
+Keeps the recent frames and state transitions of a session in a fixed-size
+ring buffer and sends a sampled, rate-limited subset to the logging module
+"""
+
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Optional
+
+logger = logging.getLogger('rehab.trace')
+
+
+class RateLimiter:
+    """Token bucket shared by all traces so total log volume stays bounded"""
+
+    def __init__(self, per_second: float, burst: Optional[float] = None):
+        self.per_second = per_second
+        self.burst = burst if burst is not None else max(per_second, 1.0)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self.suppressed = 0
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.per_second)
+        self._last = now
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return True
+        self.suppressed += 1
+        return False
+
+
+class SessionTrace:
+    """
+    Ring buffer of one session's frames and events
+
+    Every frame is recorded (angles, state, rep count); only every
+    `sample_every`-th frame is logged, at DEBUG. Events (state transitions,
+    completed reps, ...) are logged at INFO. Both go through the shared
+    rate limiter.
+    """
+
+    def __init__(self, exercise: str, capacity: int, sample_every: int, limiter: RateLimiter):
+        self.exercise = exercise
+        self.session_id: Optional[int] = None
+        self.frames = deque(maxlen=capacity)
+        self.events = deque(maxlen=capacity)
+        self.frame_count = 0
+        self.sample_every = max(1, sample_every)
+        self.limiter = limiter
+
+    def frame(self, rep_count: int, state: str, angles: Dict[str, float]):
+        now = time.time()
+        self.frames.append((now, rep_count, state, angles))
+        self.frame_count += 1
+        if self.frame_count % self.sample_every == 0 and logger.isEnabledFor(logging.DEBUG) and self.limiter.allow():
+            logger.debug(
+                'session=%s exercise=%s frame=%d rep=%d state=%s angles=%s',
+                self.session_id, self.exercise, self.frame_count, rep_count, state,
+                {k: round(v, 3) for k, v in angles.items()}
+            )
+
+    def event(self, name: str, **fields):
+        self.events.append((time.time(), self.frame_count, name, fields))
+        if logger.isEnabledFor(logging.INFO) and self.limiter.allow():
+            logger.info('session=%s exercise=%s %s %s', self.session_id, self.exercise, name, fields)
+
+    def dump(self) -> Dict:
+        return {
+            'session_id': self.session_id,
+            'exercise': self.exercise,
+            'frames_total': self.frame_count,
+            'frames': [
+                {'t': t, 'rep_count': rep_count, 'state': state, 'angles': angles}
+                for t, rep_count, state, angles in self.frames
+            ],
+            'events': [
+                {'t': t, 'frame': frame, 'event': name, **fields}
+                for t, frame, name, fields in self.events
+            ],
+        }
+
+
+class TraceArchive:
+    """Traces of the most recently finished sessions, oldest evicted first"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._traces: "OrderedDict[int, SessionTrace]" = OrderedDict()
+
+    def add(self, session_id: int, trace: SessionTrace):
+        self._traces[session_id] = trace
+        self._traces.move_to_end(session_id)
+        while len(self._traces) > self.capacity:
+            self._traces.popitem(last=False)
+
+    def get(self, session_id: int) -> Optional[SessionTrace]:
+        return self._traces.get(session_id)
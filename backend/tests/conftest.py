@@ -0,0 +1,43 @@
+"""Backend modules are flat scripts run from backend/; make them importable from the tests"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from db import Database  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+
+@pytest.fixture
+def conn(tmp_path):
+    """Write connection to a fresh, fully migrated database"""
+    db = Database(tmp_path / "rehab_test.db", size=1, read_size=1)
+    connection = db.connect()
+    migrate(connection)
+    yield connection
+    connection.close()
+    db.close_all()
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    """
+    main, with its database, session registry, frame writer and response cache
+    replaced by fresh ones on a temporary database (startup hooks are not run,
+    so no pose workers start); holds the default users of init_db()
+    """
+    import main
+    from frame_writer import FrameWriter
+    from response_cache import ResponseCache
+
+    db = Database(tmp_path / "rehab_api.db", size=2, read_size=2, workers=2)
+    monkeypatch.setattr(main, 'db', db)
+    monkeypatch.setattr(main, 'session_registry', main.SessionRegistry(idle_timeout=60))
+    monkeypatch.setattr(main, 'frame_writer', FrameWriter(db.pool))
+    monkeypatch.setattr(main, 'response_cache', ResponseCache())
+    main.init_db()
+    yield main
+    db.close_all()
@@ -0,0 +1,232 @@
+import random
+from datetime import date, timedelta
+
+from fastapi.testclient import TestClient
+
+from analytics import (compute_streaks, load_calendar, load_cohort, rebuild_cohort_summary, rebuild_daily_activity,
+                       rebuild_error_rollup, record_daily_activity, record_session_errors, week_start)
+from generate_data import generate
+
+PATIENT = 2  # patient1 of init_db()
+
+
+def generated(conn):
+    generate(conn, doctors=2, patients=8, sessions=400, seed=1, end=date(2026, 10, 1), days=90,
+             log=lambda message: None)
+
+
+def table(conn, name, order):
+    return conn.execute(f"SELECT * FROM {name} ORDER BY {order}").fetchall()
+
+
+def finished_sessions(conn):
+    """
+    (patient, exercise, start_time, {error: count}, total_reps, correct_reps, duration)
+    of every finished session, in random finishing order
+    """
+    sessions = {
+        row[0]: (*row[1:4], {}, *row[4:])
+        for row in conn.execute("""
+            SELECT id, patient_id, exercise_name, start_time, total_reps, correct_reps, duration_seconds
+            FROM sessions WHERE end_time IS NOT NULL
+        """)
+    }
+    for session_id, error_name, count in conn.execute("SELECT session_id, error_name, count FROM session_errors"):
+        sessions[session_id][3][error_name] = count
+    rows = list(sessions.values())
+    random.Random(0).shuffle(rows)
+    return rows
+
+
+def test_error_rollup_kept_at_session_end_matches_a_rebuild(conn):
+    generated(conn)
+    rebuild_error_rollup(conn.cursor())
+    rebuilt = table(conn, 'error_rollup', 'patient_id, exercise_name, error_name')
+    assert rebuilt
+
+    conn.execute("DELETE FROM error_rollup")
+    for patient_id, exercise_name, start_time, errors, *_ in finished_sessions(conn):
+        record_session_errors(conn.cursor(), patient_id, exercise_name, errors, start_time)
+    assert table(conn, 'error_rollup', 'patient_id, exercise_name, error_name') == rebuilt
+
+
+def test_error_analytics_merges_legacy_names(api):
+    client = TestClient(api.app)
+    headers = {'Authorization': f"Bearer {api.create_token(PATIENT, 'patient1', 'patient')}"}
+    for errors in (['not_deep'], ['Gập gối chưa đủ', 'Gập gối chưa đủ']):  # Legacy English name, then Vietnamese
+        session, _ = api.session_registry.start_session(PATIENT, 'squat')
+        counter = session.attach('squat')
+        for error in errors:
+            counter.add_error_to_current_rep(error)
+            counter._complete_rep()
+        api.session_registry.end_session(session.id, PATIENT)
+        session.release()
+
+    response = client.get('/api/sessions/error-analytics', headers=headers)
+    [exercise] = response.json()['analytics']
+    assert exercise['exercise_name'] == 'Bài Tập Squat'
+    [error] = exercise['errors']
+    assert (error['error_name'], error['total_count'], error['session_count'], error['avg_per_session']) == \
+        ('Gập gối chưa đủ', 3, 2, 1.5)
+
+    assert client.get('/api/sessions/error-analytics', headers={
+        **headers, 'If-None-Match': response.headers['etag']}).status_code == 304
+
+
+def test_daily_activity_kept_at_session_end_matches_a_rebuild(conn):
+    generated(conn)
+    rebuild_daily_activity(conn.cursor())
+    rebuilt = (table(conn, 'daily_activity', 'patient_id, day, exercise_name'),
+               table(conn, 'activity_streaks', 'patient_id'))
+    assert rebuilt[0] and rebuilt[1]
+
+    conn.execute("DELETE FROM daily_activity")
+    conn.execute("DELETE FROM activity_streaks")
+    for patient_id, exercise_name, start_time, _, total_reps, correct_reps, duration in finished_sessions(conn):
+        record_daily_activity(conn.cursor(), patient_id, start_time[:10], exercise_name, total_reps, correct_reps, duration)
+    assert (table(conn, 'daily_activity', 'patient_id, day, exercise_name'),
+            table(conn, 'activity_streaks', 'patient_id')) == rebuilt
+
+
+def test_compute_streaks():
+    assert compute_streaks([]) == (0, 0)
+    assert compute_streaks(['2026-02-27', '2026-02-28', '2026-03-01', '2026-03-05', '2026-03-06']) == (2, 3)
+    assert compute_streaks(['2026-03-01', '2026-03-03', '2026-03-04', '2026-03-05']) == (3, 3)
+
+
+def test_calendar_matches_the_sessions(conn):
+    generated(conn)
+    rebuild_daily_activity(conn.cursor())
+    patient_id = conn.execute("SELECT patient_id FROM sessions GROUP BY patient_id ORDER BY COUNT(*) DESC").fetchone()[0]
+    start, end = date(2026, 8, 1), date(2026, 9, 30)
+
+    calendar = load_calendar(conn.cursor(), patient_id, start, end)
+    assert len(calendar['days']) == 61
+    expected = {
+        day: [sessions, reps, correct, duration]
+        for day, sessions, reps, correct, duration in conn.execute("""
+            SELECT substr(start_time, 1, 10), COUNT(*), SUM(total_reps), SUM(correct_reps), SUM(duration_seconds)
+            FROM sessions
+            WHERE patient_id = ? AND end_time IS NOT NULL AND start_time >= ? AND start_time < ?
+            GROUP BY 1
+        """, (patient_id, start.isoformat(), (end + timedelta(days=1)).isoformat()))
+    }
+    assert expected
+    for i, totals in enumerate(calendar['days']):
+        assert totals == expected.get((start + timedelta(days=i)).isoformat(), [0, 0, 0, 0])
+    for rows in calendar['exercises'].values():
+        for index, sessions, *_ in rows:
+            assert 0 < sessions <= calendar['days'][index][0]
+
+
+def test_calendar_endpoint(api):
+    client = TestClient(api.app)
+    headers = {'Authorization': f"Bearer {api.create_token(PATIENT, 'patient1', 'patient')}"}
+    for exercise in ('squat', 'squat', 'calf_raise'):
+        session, _ = api.session_registry.start_session(PATIENT, exercise)
+        counter = session.attach(exercise)
+        counter._complete_rep()
+        api.session_registry.end_session(session.id, PATIENT)
+        session.release()
+
+    today = date.today()
+    calendar = client.get('/api/sessions/calendar', headers=headers,
+                          params={'from': (today - timedelta(days=6)).isoformat(), 'to': today.isoformat()}).json()
+    assert len(calendar['days']) == 7 and calendar['days'][:6] == [[0, 0, 0, 0]] * 6
+    assert calendar['days'][6][:3] == [3, 3, 3]
+    assert calendar['exercises']['Bài Tập Squat'][0][:2] == [6, 2]
+    assert (calendar['current_streak'], calendar['longest_streak'], calendar['last_active_day']) == (1, 1, today.isoformat())
+
+    assert client.get('/api/sessions/calendar', headers=headers).json()['days'] == calendar['days'][6:]
+    assert client.get('/api/sessions/calendar', headers=headers,
+                      params={'from': today.isoformat(), 'to': (today - timedelta(days=1)).isoformat()}).status_code == 400
+
+
+def test_cohort_summaries_kept_at_session_end_match_a_rebuild(conn):
+    generated(conn)
+    rebuild_daily_activity(conn.cursor())
+    rebuild_cohort_summary(conn.cursor())
+    rebuilt = (table(conn, 'patient_summary', 'patient_id'), table(conn, 'weekly_activity', 'patient_id, week_start'))
+    assert rebuilt[0] and rebuilt[1]
+
+    for name in ('daily_activity', 'activity_streaks', 'patient_summary', 'weekly_activity'):
+        conn.execute(f"DELETE FROM {name}")
+    for patient_id, exercise_name, start_time, _, total_reps, correct_reps, duration in finished_sessions(conn):
+        record_daily_activity(conn.cursor(), patient_id, start_time[:10], exercise_name, total_reps, correct_reps, duration)
+    assert (table(conn, 'patient_summary', 'patient_id'),
+            table(conn, 'weekly_activity', 'patient_id, week_start')) == rebuilt
+
+
+def accuracy_of(rows):
+    total = sum(row[2] for row in rows)
+    return round(sum(row[3] for row in rows) / total * 100, 1) if total else None
+
+
+def test_cohort_matches_the_sessions(conn):
+    generated(conn)
+    cursor = conn.cursor()
+    rebuild_error_rollup(cursor)
+    rebuild_daily_activity(cursor)
+    rebuild_cohort_summary(cursor)
+    doctor_id = conn.execute("SELECT id FROM users WHERE username = 'syn1_doctor1'").fetchone()[0]
+    today = date(2026, 10, 1)
+
+    cohort = load_cohort(cursor, doctor_id, today, weeks=4)
+    assert cohort['week_starts'] == [(week_start(today) - timedelta(weeks=3 - i)).isoformat() for i in range(4)]
+    patient_ids = [row[0] for row in conn.execute(
+        "SELECT id FROM users WHERE doctor_id = ? AND role = 'patient' ORDER BY full_name", (doctor_id,))]
+    assert [patient['id'] for patient in cohort['patients']] == patient_ids
+
+    everyone = []
+    for patient in cohort['patients']:
+        rows = conn.execute("""
+            SELECT id, substr(start_time, 1, 10), total_reps, correct_reps FROM sessions
+            WHERE patient_id = ? AND end_time IS NOT NULL
+        """, (patient['id'],)).fetchall()
+        everyone += rows
+        last_7 = [row for row in rows if (today - timedelta(days=6)).isoformat() <= row[1] <= today.isoformat()]
+        last_30 = [row for row in rows if (today - timedelta(days=29)).isoformat() <= row[1] <= today.isoformat()]
+        assert patient['total_sessions'] == len(rows)
+        assert patient['accuracy'] == accuracy_of(rows)
+        assert (patient['sessions_7d'], patient['sessions_30d']) == (len(last_7), len(last_30))
+        assert patient['active_days_30d'] == len({row[1] for row in last_30})
+        assert patient['reps_30d'] == (sum(row[2] for row in last_30) if last_30 else 0)
+        assert patient['accuracy_trend'] == [
+            accuracy_of([row for row in rows if week_start(date.fromisoformat(row[1])).isoformat() == week])
+            for week in cohort['week_starts']
+        ]
+        error_totals = sorted((count for (count,) in conn.execute("""
+            SELECT SUM(se.count) FROM session_errors se JOIN sessions s ON s.id = se.session_id
+            WHERE s.patient_id = ? GROUP BY se.error_name
+        """, (patient['id'],))), reverse=True)
+        assert [error['total_count'] for error in patient['top_errors']] == error_totals[:3]
+
+    totals = cohort['cohort']
+    assert totals['patients'] == len(patient_ids) and totals['sessions_7d'] and totals['top_errors']
+    assert totals['total_sessions'] == len(everyone)
+    assert totals['accuracy'] == accuracy_of(everyone)
+    assert totals['sessions_30d'] == sum(patient['sessions_30d'] for patient in cohort['patients'])
+    assert totals['active_patients_7d'] == sum(1 for patient in cohort['patients'] if patient['sessions_7d'])
+
+
+def test_cohort_endpoint(api):
+    client = TestClient(api.app)
+    doctor = {'Authorization': f"Bearer {api.create_token(1, 'doctor1', 'doctor')}"}
+    patient = {'Authorization': f"Bearer {api.create_token(PATIENT, 'patient1', 'patient')}"}
+    session, _ = api.session_registry.start_session(PATIENT, 'squat')
+    counter = session.attach('squat')
+    counter.add_error_to_current_rep('not_deep')
+    counter._complete_rep()
+    counter._complete_rep()
+    api.session_registry.end_session(session.id, PATIENT)
+    session.release()
+
+    cohort = client.get('/api/doctor/cohort', params={'weeks': 2}, headers=doctor).json()
+    assert cohort['cohort']['patients'] == 2 and cohort['cohort']['sessions_7d'] == 1
+    assert cohort['cohort']['accuracy_trend'] == [None, 50.0]
+    assert cohort['cohort']['top_errors'] == [{'error_name': 'Gập gối chưa đủ', 'total_count': 1, 'patients': 1}]
+    [active] = [row for row in cohort['patients'] if row['id'] == PATIENT]
+    assert (active['total_reps'], active['correct_reps'], active['last_active_day']) == (2, 1, date.today().isoformat())
+
+    assert client.get('/api/doctor/cohort', headers=patient).status_code == 403
+    assert client.get('/api/doctor/cohort', params={'weeks': 0}, headers=doctor).status_code == 400
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from main import AngleCalculator, landmarks_from_array, mp_pose
+
+L = mp_pose.PoseLandmark
+
+
+def reference_angle(a, b, c):
+    """The per-joint formula AngleCalculator replaced"""
+    ba = np.array([a.x - b.x, a.y - b.y])
+    bc = np.array([c.x - b.x, c.y - b.y])
+    cosine_angle = np.dot(ba, bc) / (np.linalg.norm(ba) * np.linalg.norm(bc) + 1e-6)
+    return np.degrees(np.arccos(np.clip(cosine_angle, -1.0, 1.0)))
+
+
+def reference_angles(lm, exercise_type):
+    knees = {
+        'left_knee': reference_angle(lm[L.LEFT_HIP], lm[L.LEFT_KNEE], lm[L.LEFT_ANKLE]),
+        'right_knee': reference_angle(lm[L.RIGHT_HIP], lm[L.RIGHT_KNEE], lm[L.RIGHT_ANKLE]),
+    }
+    if exercise_type == 'squat':
+        return knees
+    if exercise_type == 'arm_raise':
+        return {
+            'left_shoulder': reference_angle(lm[L.LEFT_HIP], lm[L.LEFT_SHOULDER], lm[L.LEFT_ELBOW]),
+            'right_shoulder': reference_angle(lm[L.RIGHT_HIP], lm[L.RIGHT_SHOULDER], lm[L.RIGHT_ELBOW]),
+            'left_elbow': reference_angle(lm[L.LEFT_SHOULDER], lm[L.LEFT_ELBOW], lm[L.LEFT_WRIST]),
+            'right_elbow': reference_angle(lm[L.RIGHT_SHOULDER], lm[L.RIGHT_ELBOW], lm[L.RIGHT_WRIST]),
+        }
+    if exercise_type == 'single_leg_stand':
+        return dict(knees,
+                    left_leg_behind=lm[L.LEFT_KNEE].z - lm[L.LEFT_HIP].z,
+                    right_leg_behind=lm[L.RIGHT_KNEE].z - lm[L.RIGHT_HIP].z,
+                    left_knee_y=lm[L.LEFT_KNEE].y, right_knee_y=lm[L.RIGHT_KNEE].y,
+                    left_hip_y=lm[L.LEFT_HIP].y, right_hip_y=lm[L.RIGHT_HIP].y)
+    return dict(knees,
+                left_ankle=reference_angle(lm[L.LEFT_KNEE], lm[L.LEFT_ANKLE], lm[L.LEFT_FOOT_INDEX]),
+                right_ankle=reference_angle(lm[L.RIGHT_KNEE], lm[L.RIGHT_ANKLE], lm[L.RIGHT_FOOT_INDEX]),
+                left_heel_y=lm[L.LEFT_HEEL].y, right_heel_y=lm[L.RIGHT_HEEL].y,
+                left_foot_index_y=lm[L.LEFT_FOOT_INDEX].y, right_foot_index_y=lm[L.RIGHT_FOOT_INDEX].y)
+
+
+def random_frames(n, seed=0):
+    return np.random.default_rng(seed).uniform(-0.5, 1.5, size=(n, 33, 4)).astype(np.float32)
+
+
+@pytest.mark.parametrize('exercise_type', ['squat', 'arm_raise', 'single_leg_stand', 'calf_raise'])
+def test_matches_the_per_joint_formula(exercise_type):
+    for landmark_array in random_frames(20):
+        landmarks = landmarks_from_array(landmark_array)
+        expected = reference_angles(landmarks, exercise_type)
+        for angles in (AngleCalculator.get_angles(landmarks, exercise_type),
+                       AngleCalculator.get_angles(landmark_array, exercise_type)):
+            assert angles.keys() == expected.keys()
+            for name, value in expected.items():
+                assert angles[name] == pytest.approx(float(value), abs=1e-3), name
+
+
+@pytest.mark.parametrize('exercise_type', ['squat', 'single_leg_stand', 'calf_raise'])
+def test_batch_matches_single_frames(exercise_type):
+    frames = random_frames(8, seed=1)
+    batch = AngleCalculator.get_angles(frames, exercise_type)
+    for i, landmark_array in enumerate(frames):
+        for name, value in AngleCalculator.get_angles(landmark_array, exercise_type).items():
+            assert batch[name].shape == (8,)
+            assert batch[name][i] == pytest.approx(value, abs=1e-4), name
+
+
+def test_known_angles():
+    landmark_array = np.zeros((33, 4), dtype=np.float32)
+    landmark_array[L.LEFT_HIP, :2] = (0.5, 0.2)
+    landmark_array[L.LEFT_KNEE, :2] = (0.5, 0.5)
+    landmark_array[L.LEFT_ANKLE, :2] = (0.8, 0.5)  # Right angle at the knee
+    landmark_array[L.RIGHT_HIP, :2] = (0.6, 0.2)
+    landmark_array[L.RIGHT_KNEE, :2] = (0.6, 0.5)
+    landmark_array[L.RIGHT_ANKLE, :2] = (0.6, 0.8)  # Straight leg
+    angles = AngleCalculator.get_angles(landmark_array, 'squat')
+    assert angles['left_knee'] == pytest.approx(90.0, abs=1e-3)
+    assert angles['right_knee'] > 179  # Not quite 180: the denominator carries the formula's 1e-6
+    assert AngleCalculator.get_angles(landmark_array, 'unknown') == {}
@@ -0,0 +1,118 @@
+import csv
+import io
+import json
+import sqlite3
+from datetime import date
+
+import pytest
+from fastapi.testclient import TestClient
+
+from export import DATASETS, ExportFilter, stream_export
+from generate_data import generate
+from timeseries import open_series
+
+PATIENT = 2  # patient1 of init_db()
+
+
+def generated(conn):
+    generate(conn, doctors=2, patients=6, sessions=200, seed=1, end=date(2026, 10, 1), days=60,
+             frame_sessions=0.05, log=lambda message: None)
+    conn.commit()
+    return conn.execute("SELECT id FROM users WHERE username = 'syn1_doctor1'").fetchone()[0]
+
+
+def names(dataset):
+    return [name for name, _ in DATASETS[dataset]]
+
+
+def test_csv_sessions_stream_the_filtered_rows(conn):
+    doctor_id = generated(conn)
+    filters = ExportFilter(doctor_id=doctor_id, exercise_name='squat', start=date(2026, 8, 1), end=date(2026, 9, 30))
+    expected = conn.execute("""
+        SELECT id, patient_id, exercise_name, start_time, end_time, total_reps, correct_reps, accuracy, duration_seconds
+        FROM sessions
+        WHERE patient_id IN (SELECT id FROM users WHERE doctor_id = ?) AND exercise_name = 'squat'
+          AND start_time >= '2026-08-01' AND start_time < '2026-10-01'
+        ORDER BY patient_id, start_time, id
+    """, (doctor_id,)).fetchall()
+    assert len(expected) > 4
+
+    parts = list(stream_export(conn, 'sessions', 'csv', filters, chunk_rows=2))
+    assert len(parts) == -(-len(expected) // 2)  # One part per chunk of rows
+    header, *rows = csv.reader(io.StringIO(b''.join(parts).decode('utf-8')))
+    assert header == names('sessions')
+    assert rows == [['' if value is None else str(value) for value in row] for row in expected]
+
+
+def test_ndjson_errors_stream_the_filtered_rows(conn):
+    generated(conn)
+    patient_id = conn.execute("SELECT patient_id FROM sessions GROUP BY patient_id ORDER BY COUNT(*) DESC").fetchone()[0]
+    expected = conn.execute("""
+        SELECT se.session_id, s.patient_id, s.exercise_name, s.start_time, se.error_name, se.count, se.severity
+        FROM sessions s JOIN session_errors se ON se.session_id = s.id
+        WHERE s.patient_id = ?
+        ORDER BY s.start_time, s.id, se.id
+    """, (patient_id,)).fetchall()
+    assert expected
+
+    data = b''.join(stream_export(conn, 'errors', 'ndjson', ExportFilter(patient_id=patient_id), chunk_rows=5))
+    assert [json.loads(line) for line in data.decode('utf-8').splitlines()] == \
+        [dict(zip(names('errors'), row)) for row in expected]
+
+
+def test_frames_cover_every_recorded_series(conn):
+    generated(conn)
+    series = {}
+    for (session_id,) in conn.execute("SELECT session_id FROM session_timeseries").fetchall():
+        reader = open_series(conn, session_id)
+        series[session_id] = (reader.frames, sorted(reader.columns))
+    assert series
+
+    data = b''.join(stream_export(conn, 'frames', 'ndjson', ExportFilter(), chunk_rows=300))
+    frames = {}
+    for line in data.decode('utf-8').splitlines():
+        row = json.loads(line)
+        assert list(row) == names('frames')
+        assert row['frame'] == frames.get(row['session_id'], 0)  # Consecutive within each session
+        frames[row['session_id']] = row['frame'] + 1
+        assert row['angles'] and isinstance(row['errors'], list)
+    assert frames == {session_id: count for session_id, (count, _) in series.items()}
+
+
+def test_closing_early_closes_the_cursor(conn):
+    generated(conn)
+    conn.execute("CREATE TABLE scratch (x)")
+    chunks = stream_export(conn, 'sessions', 'csv', ExportFilter(), chunk_rows=10)
+    next(chunks)
+    with pytest.raises(sqlite3.OperationalError):  # A SELECT is still open on the connection
+        conn.execute("DROP TABLE scratch")
+    chunks.close()
+    conn.execute("DROP TABLE scratch")
+
+    with pytest.raises(ValueError):
+        stream_export(conn, 'sessions', 'xml', ExportFilter())
+
+
+def test_export_endpoint(api):
+    client = TestClient(api.app)
+    patient = {'Authorization': f"Bearer {api.create_token(PATIENT, 'patient1', 'patient')}"}
+    doctor = {'Authorization': f"Bearer {api.create_token(1, 'doctor1', 'doctor')}"}
+    for patient_id, exercise in ((PATIENT, 'squat'), (PATIENT, 'calf_raise'), (3, 'squat')):
+        session, _ = api.session_registry.start_session(patient_id, exercise)
+        session.attach(exercise)._complete_rep()
+        api.session_registry.end_session(session.id, patient_id)
+        session.release()
+
+    response = client.get('/api/export/sessions', headers=patient)
+    assert response.headers['content-type'].startswith('text/csv')
+    assert 'attachment; filename="sessions-' in response.headers['content-disposition']
+    header, *rows = csv.reader(io.StringIO(response.text))
+    assert header == names('sessions')
+    assert [(row[1], row[2], row[5]) for row in rows] == [('2', 'squat', '1'), ('2', 'calf_raise', '1')]
+
+    response = client.get('/api/export/sessions', params={'format': 'ndjson', 'exercise': 'squat'}, headers=doctor)
+    assert sorted(json.loads(line)['patient_id'] for line in response.text.splitlines()) == [2, 3]
+
+    assert client.get('/api/export/sessions', params={'format': 'xml'}, headers=patient).status_code == 400
+    assert client.get('/api/export/sessions', params={'from': 'yesterday'}, headers=patient).status_code == 400
+    assert client.get('/api/export/passwords', headers=patient).status_code == 404
@@ -0,0 +1,46 @@
+from datetime import date
+
+import pytest
+
+from db import Database
+from generate_data import generate
+from migrations import migrate
+
+TABLES = ("users", "sessions", "session_errors", "user_exercise_limits", "session_timeseries",
+          "session_timeseries_chunks")
+
+
+def generated(path, seed=1, batch_rows=5000):
+    """Every row of the tables generate() fills, for a fresh database"""
+    db = Database(path, size=1, read_size=1)
+    conn = db.connect()
+    migrate(conn)
+    generate(conn, doctors=2, patients=15, sessions=600, seed=seed, end=date(2026, 10, 1), days=90,
+             frame_sessions=0.05, chunk_frames=200, batch_rows=batch_rows, log=lambda message: None)
+    rows = {table: conn.execute(f"SELECT * FROM {table} ORDER BY rowid").fetchall() for table in TABLES}
+    conn.close()
+    db.close_all()
+    return rows
+
+
+def test_same_seed_same_rows_whatever_the_batch_size(tmp_path):
+    first = generated(tmp_path / "a.db", batch_rows=7)
+    second = generated(tmp_path / "b.db", batch_rows=5000)
+    assert first["session_timeseries"], "no frame series generated"
+    assert {severity for (*_, severity) in first["session_errors"]} <= {"medium", "high", "critical"}
+    for table in TABLES:
+        assert first[table] == second[table], table
+
+
+def test_other_seed_other_rows(tmp_path):
+    first = generated(tmp_path / "a.db", seed=1)
+    second = generated(tmp_path / "b.db", seed=2)
+    assert first["sessions"] != second["sessions"]
+
+
+def test_refuses_to_generate_a_seed_twice(conn):
+    generate(conn, doctors=1, patients=2, sessions=10, seed=3, end=date(2026, 10, 1), days=30,
+             log=lambda message: None)
+    with pytest.raises(ValueError):
+        generate(conn, doctors=1, patients=2, sessions=10, seed=3, end=date(2026, 10, 1), days=30,
+                 log=lambda message: None)
@@ -0,0 +1,75 @@
+from datetime import date
+
+from fastapi.testclient import TestClient
+
+from generate_data import generate
+
+
+def seeded(api):
+    """A generated doctor with their patients, plus sessions sharing a start_time; (client, doctor headers, doctor id)"""
+    conn = api.db.connect()
+    generate(conn, doctors=2, patients=6, sessions=300, seed=1, end=date(2026, 10, 1), days=60,
+             log=lambda message: None)
+    doctor_id, patient_id = conn.execute("""
+        SELECT d.id, p.id FROM users d JOIN users p ON p.doctor_id = d.id
+        WHERE d.username = 'syn1_doctor1' ORDER BY p.id LIMIT 1
+    """).fetchone()
+    conn.executemany("INSERT INTO sessions (patient_id, exercise_name, start_time) VALUES (?, 'squat', ?)",
+                     [(patient_id, '2026-09-30T10:00:00')] * 5)
+    conn.commit()
+    conn.close()
+    token = api.create_token(doctor_id, 'syn1_doctor1', 'doctor')
+    return TestClient(api.app), {'Authorization': f'Bearer {token}'}, doctor_id
+
+
+def test_keyset_pages_cover_the_history_once(api):
+    client, headers, doctor_id = seeded(api)
+    conn = api.db.connect()
+    patient_id = conn.execute("SELECT MIN(id) FROM users WHERE doctor_id = ?", (doctor_id,)).fetchone()[0]
+    expected = [row[0] for row in conn.execute(
+        "SELECT id FROM sessions WHERE patient_id = ? ORDER BY start_time DESC, id DESC", (patient_id,))]
+    error_counts = dict(conn.execute("""
+        SELECT s.id, COUNT(se.id) FROM sessions s LEFT JOIN session_errors se ON se.session_id = s.id
+        WHERE s.patient_id = ? GROUP BY s.id
+    """, (patient_id,)).fetchall())
+    conn.close()
+
+    seen, before, pages = [], None, 0
+    while True:
+        params = {'limit': 7, **({'before': before} if before else {})}
+        page = client.get(f'/api/doctor/patient/{patient_id}/history', params=params, headers=headers).json()
+        seen += [session['id'] for session in page['sessions']]
+        for session in page['sessions']:
+            assert len(session['errors']) == error_counts[session['id']]
+        pages += 1
+        before = page['next_before']
+        if before is None:
+            break
+
+    assert len(expected) > 20
+    assert seen == expected  # Newest first, ties on start_time broken by id, nothing skipped or repeated
+    assert pages == len(expected) // 7 + 1
+
+    response = client.get(f'/api/doctor/patient/{patient_id}/history', params={'before': 'nonsense'}, headers=headers)
+    assert response.status_code == 400
+
+
+def test_patient_list_shows_each_latest_session(api):
+    client, headers, doctor_id = seeded(api)
+    conn = api.db.connect()
+    expected = {}
+    for (patient_id,) in conn.execute("SELECT id FROM users WHERE doctor_id = ? AND role = 'patient'", (doctor_id,)).fetchall():
+        expected[patient_id] = conn.execute("""
+            SELECT start_time, accuracy FROM sessions WHERE patient_id = ? ORDER BY start_time DESC, id DESC LIMIT 1
+        """, (patient_id,)).fetchone()
+    conn.close()
+
+    patients = client.get('/api/doctor/patients', headers=headers).json()['patients']
+    assert sorted(patient['id'] for patient in patients) == sorted(expected)
+    assert [patient['full_name'] for patient in patients] == sorted(patient['full_name'] for patient in patients)
+    for patient in patients:
+        latest = expected[patient['id']]
+        if latest is None:
+            assert patient['last_session'] is None
+        else:
+            assert (patient['last_session']['date'], patient['last_session']['accuracy']) == latest
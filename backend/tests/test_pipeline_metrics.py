@@ -0,0 +1,43 @@
+import sys
+import threading
+
+import pytest
+
+from pipeline_metrics import PipelineMetrics
+
+
+@pytest.fixture
+def frequent_thread_switches():
+    """Switch threads often enough for unsynchronized updates to collide"""
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def test_query_histograms_observed_from_db_threads(frequent_thread_switches):
+    metrics = PipelineMetrics()
+    stop = threading.Event()
+
+    def observe(pool):
+        for i in range(5000):
+            metrics.queries.observe(pool, f'select_{i % 50}', 0.5)
+
+    def render():
+        while not stop.is_set():
+            metrics.render_prometheus()
+
+    renderer = threading.Thread(target=render)
+    renderer.start()
+    threads = [threading.Thread(target=observe, args=(pool,)) for pool in ('read', 'write', 'read', 'write')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stop.set()
+    renderer.join()
+
+    snapshot = metrics.snapshot()['db_queries']
+    assert sum(entry['count'] for entry in snapshot['read'].values()) == 10000
+    assert snapshot['write']['select_7']['count'] == 200
+    assert 'rehab_db_query_duration_seconds_count{pool="read",statement="select_0"} 200' in metrics.render_prometheus()
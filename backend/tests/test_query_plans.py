@@ -0,0 +1,23 @@
+from datetime import date
+
+from generate_data import generate
+from migrations import QUERY_PLAN_CHECKS, check_query_plans
+
+
+def test_hot_queries_use_their_indexes(conn):
+    generate(conn, doctors=3, patients=40, sessions=4000, seed=1, end=date(2026, 10, 1), days=180,
+             frame_sessions=0.01, log=lambda message: None)
+    conn.execute("ANALYZE")
+
+    assert check_query_plans(conn) == []
+
+
+def test_plans_hold_on_an_empty_database(conn):
+    # A fresh install has no statistics yet; the planner must still pick the indexes
+    assert check_query_plans(conn) == []
+
+
+def test_every_check_names_an_index():
+    for name, query, parameters, index, forbidden in QUERY_PLAN_CHECKS:
+        assert index, name
+        assert query.count('?') == len(parameters), name
@@ -0,0 +1,61 @@
+from response_cache import ResponseCache
+
+KEY = ('/api/sessions/history/2', (), 2)
+
+
+def test_etag_changes_only_when_the_scope_is_bumped():
+    cache = ResponseCache()
+    etag = cache.etag(KEY, ('patient', 2))
+    assert etag.startswith('W/"') and etag == cache.etag(KEY, ('patient', 2))
+    assert etag != cache.etag(KEY + ('other',), ('patient', 2))
+
+    cache.bump(patient_id=3, doctor_id=1)
+    assert etag == cache.etag(KEY, ('patient', 2))
+    cache.bump(patient_id=2, doctor_id=1)
+    assert etag != cache.etag(KEY, ('patient', 2))
+    assert cache.generation(('doctor', 1)) == 2
+    assert cache.generation(('doctor', None)) == 0
+
+
+def test_etag_does_not_survive_a_restart():
+    assert ResponseCache().etag(KEY, ('patient', 2)) != ResponseCache().etag(KEY, ('patient', 2))
+
+
+def test_if_none_match():
+    cache = ResponseCache()
+    etag = cache.etag(KEY, ('patient', 2))
+    assert cache.matches(etag, etag)
+    assert cache.matches(etag[2:], etag)  # Strong form of the same tag
+    assert cache.matches(f'"other", {etag}', etag)
+    assert cache.matches('*', etag)
+    assert not cache.matches(None, etag)
+    assert not cache.matches('W/"other"', etag)
+
+
+def test_get_needs_the_current_etag():
+    cache = ResponseCache()
+    etag = cache.etag(KEY, ('patient', 2))
+    assert cache.get(KEY, etag) is None
+    cache.put(KEY, etag, b'{"sessions":[]}')
+    assert cache.get(KEY, etag) == b'{"sessions":[]}'
+
+    cache.bump(patient_id=2)
+    new_etag = cache.etag(KEY, ('patient', 2))
+    assert cache.get(KEY, new_etag) is None
+    cache.put(KEY, new_etag, b'{"sessions":[1]}')
+    assert (len(cache), cache.nbytes) == (1, len(b'{"sessions":[1]}'))
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_evicts_least_recently_used():
+    cache = ResponseCache(max_entries=2, max_bytes=10)
+    cache.put('a', 'e', b'1234')
+    cache.put('b', 'e', b'1234')
+    cache.get('a', 'e')
+    cache.put('c', 'e', b'12')  # Over max_entries: 'b' is the least recently used
+    assert cache.get('b', 'e') is None and cache.get('a', 'e') == b'1234'
+    cache.put('d', 'e', b'1234')  # Over max_bytes: 'c' is the least recently used now
+    assert (len(cache), cache.nbytes, cache.evictions) == (2, 8, 2)
+    assert cache.get('c', 'e') is None
+    cache.put('e', 'e', b'x' * 11)  # Larger than the whole cache: not stored
+    assert cache.get('e', 'e') is None and cache.get('d', 'e') == b'1234'
@@ -0,0 +1,104 @@
+import time
+
+from fastapi.testclient import TestClient
+
+DOCTOR, PATIENT, OTHER_PATIENT = 1, 2, 3  # Default users of init_db()
+
+
+def do_reps(counter, *rep_errors):
+    """Complete one rep per argument, with those errors"""
+    for errors in rep_errors:
+        for error in errors:
+            counter.add_error_to_current_rep(error)
+        counter._complete_rep()
+
+
+def test_reattach_keeps_the_rep_count_of_the_same_exercise(api):
+    session, previous = api.session_registry.start_session(PATIENT, 'squat')
+    assert previous is None and session.doctor_id == DOCTOR
+
+    counter = session.attach('squat')
+    do_reps(counter, [], ['not_deep'])
+    session.detach()
+    assert session.attach('squat') is counter and counter.rep_count == 2
+
+    other = session.attach('arm_raise')  # A different exercise starts counting again
+    assert other is not counter and other.rep_count == 0 and session.connections == 2
+
+
+def test_patients_have_separate_sessions(api):
+    first, _ = api.session_registry.start_session(PATIENT, 'squat')
+    second, _ = api.session_registry.start_session(OTHER_PATIENT, 'squat')
+    do_reps(first.attach('squat'), [], [])
+    do_reps(second.attach('squat'), ['not_deep'])
+
+    assert len(api.session_registry) == 2
+    assert api.session_registry.get(first.id, OTHER_PATIENT) is None
+    first_summary = api.session_registry.end_session(first.id, PATIENT)[1]
+    second_summary = api.session_registry.end_session(second.id, OTHER_PATIENT)[1]
+    assert (first_summary['total_reps'], first_summary['correct_reps'], first_summary['common_errors']) == (2, 2, {})
+    assert (second_summary['total_reps'], second_summary['correct_reps']) == (1, 0)
+    assert second_summary['common_errors'] == {'not_deep': {'count': 1, 'severity': 'high'}}
+
+
+def test_finish_is_idempotent(api):
+    session, _ = api.session_registry.start_session(PATIENT, 'squat')
+    do_reps(session.attach('squat'), ['not_deep'], ['not_deep', 'knees_in'], [])
+
+    session_, summary = api.session_registry.end_session(session.id, PATIENT)
+    assert session_ is session and summary['total_reps'] == 3 and summary['correct_reps'] == 1
+    assert api.session_registry.end_session(session.id, PATIENT) is None
+    assert session.finish() is None
+
+    conn = api.db.connect()
+    end_time, total_reps = conn.execute("SELECT end_time, total_reps FROM sessions WHERE id = ?", (session.id,)).fetchone()
+    errors = conn.execute("SELECT error_name, count FROM session_errors WHERE session_id = ? ORDER BY error_name",
+                          (session.id,)).fetchall()
+    day_sessions = conn.execute("SELECT SUM(sessions) FROM daily_activity WHERE patient_id = ?", (PATIENT,)).fetchone()[0]
+    conn.close()
+    assert end_time is not None and total_reps == 3
+    assert errors == [('knees_in', 1), ('not_deep', 2)]
+    assert day_sessions == 1
+
+
+def test_starting_a_session_ends_the_previous_one(api):
+    first, _ = api.session_registry.start_session(PATIENT, 'squat')
+    second, previous = api.session_registry.start_session(PATIENT, 'calf_raise')
+    assert previous is first and first.ended
+    assert api.session_registry.get(first.id) is None and api.session_registry.get(second.id) is second
+    assert len(api.session_registry) == 1
+
+
+def test_idle_sessions_are_reclaimed_and_released(api):
+    idle, _ = api.session_registry.start_session(PATIENT, 'squat')
+    connected, _ = api.session_registry.start_session(OTHER_PATIENT, 'squat')
+    idle.attach('squat')
+    idle.detach()  # The WebSocket dropped and never came back
+    connected.attach('squat')
+    for session in (idle, connected):
+        session.last_activity = time.monotonic() - 120  # Past the 60 s idle timeout
+
+    assert api.session_registry.reclaim_idle() == [idle]
+    assert idle.ended and not connected.ended and len(api.session_registry) == 1
+
+    generation = api.response_cache.generation(('patient', PATIENT))
+    idle.release()
+    assert api.response_cache.generation(('patient', PATIENT)) == generation + 1
+    assert api.response_cache.generation(('doctor', DOCTOR)) > 0
+    assert api.finished_traces.get(idle.id) is not None
+    assert api.frame_writer.queue.get_nowait() == idle.id  # Its remaining frames get written
+
+    idle.log_frame(0, 'up', {'left_knee': 90.0}, [])  # Ended: no longer recorded
+    assert api.frame_writer.queue.empty()
+
+
+def test_session_endpoints(api):
+    client = TestClient(api.app)
+    headers = {'Authorization': f"Bearer {api.create_token(PATIENT, 'patient1', 'patient')}"}
+    other = {'Authorization': f"Bearer {api.create_token(OTHER_PATIENT, 'patient2', 'patient')}"}
+
+    session_id = client.post('/api/sessions/start', params={'exercise_name': 'squat'}, headers=headers).json()['session_id']
+    assert client.post(f'/api/sessions/{session_id}/end', headers=other).status_code == 404
+    summary = client.post(f'/api/sessions/{session_id}/end', headers=headers).json()
+    assert summary['session_id'] == session_id and summary['total_reps'] == 0
+    assert client.post(f'/api/sessions/{session_id}/end', headers=headers).status_code == 404
@@ -0,0 +1,125 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from db import Database
+from frame_writer import FrameWriter
+from timeseries import INSERT_CHUNK, INSERT_HEADER, SeriesBuilder, chunk_row, open_series
+
+START = 1_760_000_000.0
+
+
+def add_session(conn, session_id=1):
+    conn.execute("INSERT INTO sessions (id, patient_id, exercise_name, start_time) VALUES (?, 2, 'squat', '2026-01-01')",
+                 (session_id,))
+
+
+def store(conn, builder, encoded):
+    conn.execute(INSERT_HEADER, (builder.session_id, builder.header_json()))
+    conn.execute(INSERT_CHUNK, chunk_row(builder.session_id, *encoded))
+
+
+def record(builder, first, last, spill):
+    """Frames first..last-1 at 10 fps; right_knee only appears from frame 15 on"""
+    for i in range(first, last):
+        angles = {'left_knee': float(i)}
+        if i >= 15:
+            angles['right_knee'] = 180.0 - i
+        builder.append(START + i / 10, i // 10, 'up' if i % 10 < 5 else 'down', angles,
+                       [{'name': 'not_deep'}] if i % 7 == 0 else [])
+        if builder.full:
+            spill(builder.encode_chunk())
+
+
+def test_round_trip_over_several_chunks(conn):
+    add_session(conn)
+    builder = SeriesBuilder(1, START, capacity=10)
+    record(builder, 0, 25, lambda encoded: store(conn, builder, encoded))
+    store(conn, builder, builder.encode_chunk())
+
+    reader = open_series(conn, 1)
+    assert reader.frames == 25
+    assert [chunk['seq'] for chunk in reader.chunks] == [0, 1, 2]
+    data = reader.read()
+    np.testing.assert_allclose(data['t'], np.arange(25) / 10, atol=1e-4)
+    np.testing.assert_array_equal(data['left_knee'], np.arange(25, dtype=np.float32))
+    assert np.isnan(data['right_knee'][:15]).all()
+    np.testing.assert_array_equal(data['right_knee'][15:], 180.0 - np.arange(15, 25, dtype=np.float32))
+    assert [reader.header['state_codes'][int(code)] for code in data['state'][:6]] == ['up'] * 5 + ['down']
+    assert reader.errors_at(data['error_mask'][7]) == ['not_deep']
+    assert reader.errors_at(data['error_mask'][8]) == []
+
+
+def test_read_time_range_and_columns(conn):
+    add_session(conn)
+    builder = SeriesBuilder(1, START, capacity=10)
+    record(builder, 0, 25, lambda encoded: store(conn, builder, encoded))
+    store(conn, builder, builder.encode_chunk())
+
+    reader = open_series(conn, 1)
+    data = reader.read(['t', 'left_knee'], start=0.75, end=1.25)
+    assert set(data) == {'t', 'left_knee'}
+    np.testing.assert_array_equal(data['left_knee'], [8, 9, 10, 11, 12])
+    with pytest.raises(KeyError):
+        reader.read(['left_elbow'])
+
+
+def test_partial_chunk_is_replaced_as_it_grows(conn):
+    add_session(conn)
+    builder = SeriesBuilder(1, START, capacity=10)
+    record(builder, 0, 4, lambda encoded: store(conn, builder, encoded))
+    store(conn, builder, builder.encode_partial())
+    assert open_series(conn, 1).frames == 4
+
+    record(builder, 4, 12, lambda encoded: store(conn, builder, encoded))
+    store(conn, builder, builder.encode_partial())
+    reader = open_series(conn, 1)
+    assert [(chunk['seq'], chunk['frames']) for chunk in reader.chunks] == [(0, 10), (1, 2)]
+    np.testing.assert_array_equal(reader.read(['left_knee'])['left_knee'], np.arange(12, dtype=np.float32))
+
+
+def test_new_angles_widen_the_table(conn):
+    add_session(conn)
+    builder = SeriesBuilder(1, START, capacity=10, spare_columns=2)
+    names = [f'angle_{i}' for i in range(20)]
+    for i in range(15):  # One more angle every frame, past the initial width mid-chunk
+        builder.append(START + i / 10, 0, 'up', {name: float(i + j) for j, name in enumerate(names[:i + 5])}, [])
+        if builder.full:
+            store(conn, builder, builder.encode_chunk())
+    store(conn, builder, builder.encode_chunk())
+
+    data = open_series(conn, 1).read()
+    np.testing.assert_array_equal(data['angle_0'], np.arange(15, dtype=np.float32))
+    np.testing.assert_array_equal(data['angle_18'][14:], [32.0])
+    assert np.isnan(data['angle_18'][:14]).all()
+    assert np.isnan(data['angle_5'][0]) and data['angle_5'][1] == 6.0
+
+
+def test_session_without_series(conn):
+    add_session(conn)
+    assert open_series(conn, 1) is None
+
+
+def test_writer_stores_open_chunks_before_the_session_closes(conn, tmp_path):
+    add_session(conn)
+    conn.commit()
+    db = Database(tmp_path / "rehab_test.db", size=1, read_size=1)
+
+    async def scenario():
+        writer = FrameWriter(db.pool, batch_size=10, flush_ms=50, chunk_frames=40)
+        writer.start()
+        for i in range(50):
+            writer.submit(1, START + i / 25, i // 10, 'up', {'left_knee': float(i)}, [])
+        await asyncio.sleep(0.3)
+        stored_while_open = open_series(conn, 1).frames
+        writer.close_session(1)
+        await writer.stop()
+        return stored_while_open, writer.written
+
+    stored_while_open, written = asyncio.run(scenario())
+    assert stored_while_open == 50  # 40 in the full chunk, 10 in the open one
+    reader = open_series(conn, 1)
+    assert [(chunk['seq'], chunk['frames']) for chunk in reader.chunks] == [(0, 40), (1, 10)]
+    assert written == 50
+    db.close_all()
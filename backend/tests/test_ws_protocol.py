@@ -0,0 +1,82 @@
+import json
+
+import numpy as np
+import pytest
+
+from ws_protocol import (HEADER, JSON_LENGTH, LANDMARK_SCALE, MSG_ANALYSIS, MSG_LANDMARKS, NUM_LANDMARKS,
+                         CompactEncoder, ProtocolError, landmarks_from_json, landmarks_from_payload,
+                         pack_header, unpack_message)
+
+
+def decode(message):
+    """(header, JSON body, int16 landmarks) of a MSG_ANALYSIS message"""
+    header, payload = unpack_message(message)
+    (length,) = JSON_LENGTH.unpack_from(payload)
+    body = json.loads(bytes(payload[JSON_LENGTH.size:JSON_LENGTH.size + length]))
+    landmarks = np.frombuffer(payload[JSON_LENGTH.size + length:], dtype='<i2')
+    return header, body, landmarks
+
+
+def test_header_round_trip():
+    header, payload = unpack_message(pack_header(MSG_LANDMARKS, 2**32 + 7, 1234.5) + b'xyz')
+    assert (header.msg_type, header.seq, header.client_ts) == (MSG_LANDMARKS, 7, 1234.5)
+    assert bytes(payload) == b'xyz'
+
+
+def test_rejects_short_and_unknown_version():
+    with pytest.raises(ProtocolError):
+        unpack_message(b'\x01\x02')
+    with pytest.raises(ProtocolError):
+        unpack_message(HEADER.pack(9, MSG_LANDMARKS, 0, 1, 0.0))
+
+
+def test_landmarks_must_be_complete_and_finite():
+    rows = np.zeros((NUM_LANDMARKS, 4), dtype='<f4')
+    assert landmarks_from_payload(memoryview(rows.tobytes())).shape == (NUM_LANDMARKS, 4)
+    with pytest.raises(ProtocolError):
+        landmarks_from_payload(memoryview(rows[:-1].tobytes()))
+    rows[3, 1] = np.nan
+    with pytest.raises(ProtocolError):
+        landmarks_from_payload(memoryview(rows.tobytes()))
+    with pytest.raises(ProtocolError):
+        landmarks_from_json([{'x': 0.1}] * NUM_LANDMARKS)
+
+
+def test_angles_are_fixed_point_and_names_sent_once():
+    encoder = CompactEncoder()
+    response = {'rep_count': 3, 'angles': {'left_knee': 92.46, 'hip_y': 0.7504, 'foot_behind': -0.0126}}
+    _, body, _ = decode(encoder.encode(response, seq=5))
+    assert body['angle_names'] == ['left_knee', 'hip_y', 'foot_behind']
+    assert body['angle_scales'] == [10, 1000, 1000]
+    assert body['angles'] == [925, 750, -13]  # Positions keep thousandths, not the tenths of the JSON path
+    assert body['rep_count'] == 3
+
+    _, body, _ = decode(encoder.encode(response, seq=6))
+    assert 'angle_names' not in body and 'landmark_indices' not in body
+    _, body, _ = decode(encoder.encode({'angles': {'left_knee': 90.0}}, seq=7))
+    assert body['angle_names'] == ['left_knee']
+
+
+def test_delta_fields_only_on_change():
+    encoder = CompactEncoder()
+    _, body, _ = decode(encoder.encode({'state': 'up', 'feedback': 'Go', 'errors': []}))
+    assert (body['state'], body['feedback'], body['errors']) == ('up', 'Go', [])
+    _, body, _ = decode(encoder.encode({'state': 'up', 'feedback': 'Go', 'errors': []}))
+    assert not {'state', 'feedback', 'errors'} & set(body)
+    _, body, _ = decode(encoder.encode({'state': 'down', 'feedback': 'Go', 'errors': []}))
+    assert body['state'] == 'down' and 'feedback' not in body
+
+
+def test_landmark_subset_as_int16():
+    landmark_array = np.linspace(-1, 1, NUM_LANDMARKS * 4, dtype=np.float32).reshape(NUM_LANDMARKS, 4)
+    landmark_array[25, 0] = 5.0  # Out of int16 range - clipped
+    encoder = CompactEncoder([23, 25])
+    header, body, landmarks = decode(encoder.encode({}, landmark_array, seq=1, client_ts=2.0))
+    assert header.msg_type == MSG_ANALYSIS and header.flags == 1
+    assert body['landmark_indices'] == [23, 25]
+    expected = np.clip(np.rint(landmark_array[[23, 25]] * LANDMARK_SCALE), -32768, 32767)
+    np.testing.assert_array_equal(landmarks.reshape(2, 4), expected)
+    assert landmarks[4] == 32767
+
+    header, _, landmarks = decode(encoder.encode({}))
+    assert header.flags == 0 and len(landmarks) == 0
@@ -0,0 +1,254 @@
+"""
+Columnar, compressed per-session time series
+
+A session is stored as one `session_timeseries` row holding a JSON header,
+plus one `session_timeseries_chunks` row per chunk. A chunk covers a run of
+consecutive frames; its blob holds every column zlib-compressed separately,
+so a reader can decompress a single column, or only the chunks overlapping
+a time range. Appending a chunk is an insert, never a rewrite of what is
+already stored.
+
+Header:
+    version, codec ("zlib"), dtype ("<f4"), start_time (unix seconds of the first frame)
+    columns      ["t", "rep_count", "state", "error_mask", <angle names>...]
+    state_codes  state names; the `state` column holds their index
+    error_names  error names; bit i of `error_mask` is error_names[i]
+
+Chunk row:
+    seq, frames, t0, t1, offsets (JSON {column: [offset, length]} within data), data
+
+`t` is seconds since start_time; missing angles are NaN.
+"""
+
+import json
+import zlib
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+FORMAT_VERSION = 1
+DTYPE = np.dtype('<f4')
+BASE_COLUMNS = ['t', 'rep_count', 'state', 'error_mask']
+MAX_ERROR_BITS = 24  # float32 represents integers exactly up to 2**24
+
+
+class SeriesBuilder:
+    """
+    Accumulates one session's frames and encodes them chunk by chunk
+
+    Frames are written straight into a preallocated float32 table of
+    `capacity` rows, so a session's buffered frames take a fixed amount of
+    memory; the owner spills the table with encode_chunk() once it is full,
+    and can store the frames buffered so far with encode_partial() in between.
+    The table only grows in width, when an angle appears that has no column yet.
+    """
+
+    def __init__(self, session_id: int, start_time: float, capacity: int = 750,
+                 compress_level: int = 6, spare_columns: int = 12):
+        self.session_id = session_id
+        self.capacity = capacity
+        self.compress_level = compress_level
+        self.header = {
+            'version': FORMAT_VERSION,
+            'codec': 'zlib',
+            'dtype': DTYPE.str,
+            'start_time': start_time,
+            'columns': list(BASE_COLUMNS),
+            'state_codes': [],
+            'error_names': [],
+        }
+        self.seq = 0  # Chunk being filled
+        self.count = 0
+        self.table = np.full((capacity, len(BASE_COLUMNS) + spare_columns), np.nan, dtype=DTYPE)
+        self._index = {name: i for i, name in enumerate(BASE_COLUMNS)}
+
+    def _code(self, table: str, name: str) -> int:
+        names = self.header[table]
+        if name not in names:
+            names.append(name)
+        return names.index(name)
+
+    def _column(self, name: str) -> int:
+        i = self._index.get(name)
+        if i is None:
+            i = self._index[name] = len(self.header['columns'])
+            self.header['columns'].append(name)
+            if i >= self.table.shape[1]:
+                wider = np.full((self.capacity, self.table.shape[1] * 2), np.nan, dtype=DTYPE)
+                wider[:, :self.table.shape[1]] = self.table
+                self.table = wider
+        return i
+
+    def append(self, timestamp: float, rep_count: int, state: str, angles: Dict[str, float], errors: list):
+        if self.full:
+            raise OverflowError(f"Session {self.session_id}: frame buffer full, encode_chunk() first")
+        error_mask = 0
+        for error in errors:
+            bit = self._code('error_names', error.get('name', '') if isinstance(error, dict) else str(error))
+            if bit < MAX_ERROR_BITS:
+                error_mask |= 1 << bit
+        columns = [self._column(name) for name in angles]  # May widen self.table, so before taking the row
+        row = self.table[self.count]
+        row[:4] = (timestamp - self.header['start_time'], rep_count, self._code('state_codes', state), error_mask)
+        row[columns] = list(angles.values())
+        self.count += 1
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def full(self) -> bool:
+        return self.count >= self.capacity
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the frame buffer"""
+        return self.table.nbytes
+
+    def _encode(self) -> Tuple[Dict, bytes]:
+        columns = self.header['columns']
+        table = self.table[:self.count]
+
+        parts = []
+        offsets = {}
+        position = 0
+        for i, name in enumerate(columns):
+            data = zlib.compress(np.ascontiguousarray(table[:, i]).tobytes(), self.compress_level)
+            offsets[name] = [position, len(data)]
+            position += len(data)
+            parts.append(data)
+
+        chunk = {
+            'seq': self.seq,
+            'frames': self.count,
+            't0': float(table[0, 0]),
+            't1': float(table[-1, 0]),
+            'offsets': offsets,
+        }
+        return chunk, b''.join(parts)
+
+    def encode_chunk(self) -> Optional[Tuple[Dict, bytes]]:
+        """(chunk, data) of the buffered frames as chunk `seq`, then start the next chunk; None if empty"""
+        if not self.count:
+            return None
+        encoded = self._encode()
+        self.table[:self.count].fill(np.nan)  # Angles missing from a frame must read back as NaN
+        self.count = 0
+        self.seq += 1
+        return encoded
+
+    def encode_partial(self) -> Optional[Tuple[Dict, bytes]]:
+        """(chunk, data) of the frames buffered so far, kept buffered: a later encode of `seq` replaces it"""
+        return self._encode() if self.count else None
+
+    def header_json(self) -> str:
+        return json.dumps(self.header, ensure_ascii=False, separators=(',', ':'))
+
+
+class SeriesReader:
+    """
+    Decodes columns of a stored session
+
+    `chunks` are the chunk rows without their data, in order;
+    `fetch(seq, offset, length)` returns that byte range of chunk `seq`, so
+    only the chunks and columns that are needed are read and decompressed.
+    """
+
+    def __init__(self, header: Dict, chunks: List[Dict], fetch: Callable[[int, int, int], bytes]):
+        if header.get('version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported time series version: {header.get('version')}")
+        self.header = header
+        self.chunks = chunks
+        self.fetch = fetch
+
+    @property
+    def columns(self) -> List[str]:
+        return self.header['columns']
+
+    @property
+    def frames(self) -> int:
+        return sum(chunk['frames'] for chunk in self.chunks)
+
+    def _decode(self, chunk: Dict, column: str) -> np.ndarray:
+        location = chunk['offsets'].get(column)
+        if location is None:  # Column first appeared in a later chunk
+            return np.full(chunk['frames'], np.nan, dtype=DTYPE)
+        return np.frombuffer(zlib.decompress(self.fetch(chunk['seq'], *location)), dtype=DTYPE)
+
+    def read(self, columns: Optional[Iterable[str]] = None,
+             start: Optional[float] = None, end: Optional[float] = None) -> Dict[str, np.ndarray]:
+        """Columns (default: all) for frames with start <= t <= end (seconds since session start)"""
+        columns = list(columns) if columns is not None else list(self.columns)
+        unknown = [name for name in columns if name not in self.columns]
+        if unknown:
+            raise KeyError(f"Unknown columns: {', '.join(unknown)}")
+
+        chunks = [
+            chunk for chunk in self.chunks
+            if (start is None or chunk['t1'] >= start) and (end is None or chunk['t0'] <= end)
+        ]
+        result: Dict[str, List[np.ndarray]] = {name: [] for name in columns}
+        for chunk in chunks:
+            mask = None
+            t = None
+            if (start is not None and chunk['t0'] < start) or (end is not None and chunk['t1'] > end):
+                t = self._decode(chunk, 't')
+                mask = np.ones(len(t), dtype=bool)
+                if start is not None:
+                    mask &= t >= start
+                if end is not None:
+                    mask &= t <= end
+            for name in columns:
+                values = t if name == 't' and t is not None else self._decode(chunk, name)
+                result[name].append(values if mask is None else values[mask])
+
+        return {
+            name: np.concatenate(parts) if parts else np.empty(0, dtype=DTYPE)
+            for name, parts in result.items()
+        }
+
+    def iter_chunks(self, columns: Optional[Iterable[str]] = None) -> Iterator[Dict[str, np.ndarray]]:
+        """Columns (default: all) one chunk at a time, so a reader never holds more than chunk_frames rows"""
+        columns = list(columns) if columns is not None else list(self.columns)
+        for chunk in self.chunks:
+            yield {name: self._decode(chunk, name) for name in columns}
+
+    def errors_at(self, error_mask: float) -> List[str]:
+        mask = int(error_mask)
+        return [name for bit, name in enumerate(self.header['error_names']) if mask >> bit & 1]
+
+
+def open_series(conn, session_id: int) -> Optional[SeriesReader]:
+    """SeriesReader over a stored session; blob ranges are read with substr()"""
+    row = conn.execute("SELECT header FROM session_timeseries WHERE session_id = ?", (session_id,)).fetchone()
+    if row is None:
+        return None
+    chunks = [
+        {'seq': seq, 'frames': frames, 't0': t0, 't1': t1, 'offsets': json.loads(offsets)}
+        for seq, frames, t0, t1, offsets in conn.execute("""
+            SELECT seq, frames, t0, t1, offsets FROM session_timeseries_chunks
+            WHERE session_id = ? ORDER BY seq
+        """, (session_id,))
+    ]
+
+    def fetch(seq: int, offset: int, length: int) -> bytes:
+        return conn.execute(
+            "SELECT substr(data, ?, ?) FROM session_timeseries_chunks WHERE session_id = ? AND seq = ?",
+            (offset + 1, length, session_id, seq)  # substr() is 1-based
+        ).fetchone()[0]
+
+    return SeriesReader(json.loads(row[0]), chunks, fetch)
+
+
+# A partial chunk is stored under the seq it keeps once full, and replaced as it grows
+INSERT_HEADER = "INSERT OR REPLACE INTO session_timeseries (session_id, header) VALUES (?, ?)"
+INSERT_CHUNK = """
+    INSERT OR REPLACE INTO session_timeseries_chunks (session_id, seq, frames, t0, t1, offsets, data)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def chunk_row(session_id: int, chunk: Dict, data: bytes) -> tuple:
+    """Parameters of INSERT_CHUNK"""
+    return (session_id, chunk['seq'], chunk['frames'], chunk['t0'], chunk['t1'],
+            json.dumps(chunk['offsets'], separators=(',', ':')), data)
@@ -0,0 +1,42 @@
+"""
+Exercise and error vocabularies shared by the API and the offline tools
+(kept free of heavy imports so scripts do not have to load main.py)
+"""
+
+# Exercise name mapping (English to Vietnamese)
+EXERCISE_NAMES = {
+    "squat": "Bài Tập Squat",
+    "arm_raise": "Bài Tập Giơ Tay",
+    "calf_raise": "Bài Tập Nâng Bắp Chân",
+    "single_leg_stand": "Bài Tập Đứng Một Chân"
+}
+
+# Error name mapping (English to Vietnamese) - for legacy data
+ERROR_NAMES = {
+    # Arm raise errors
+    "not_high": "Góc vai chưa đủ",
+    "arms_bent": "Tay không thẳng",
+    "not_low": "Chưa hạ hết",
+    
+    # Squat errors
+    "not_deep": "Gập gối chưa đủ",
+    "knees_forward": "Gối đẩy ra trước",
+    "not_straight": "Chưa đứng thẳng",
+    
+    # Calf raise errors
+    "not_raised": "Chưa nâng đủ cao",
+    "knees_bent": "Gập gối",
+    "not_lowered": "Chưa hạ hết",
+    
+    # Single leg stand errors
+    "knee_not_bent": "Gối chưa gập đủ sâu",
+    "leg_not_behind": "Chân không ra sau"
+}
+
+# Legacy error names of each exercise (the keys of ERROR_NAMES, grouped as above)
+EXERCISE_ERRORS = {
+    "arm_raise": ["not_high", "arms_bent", "not_low"],
+    "squat": ["not_deep", "knees_forward", "not_straight"],
+    "calf_raise": ["not_raised", "knees_bent", "not_lowered"],
+    "single_leg_stand": ["knee_not_bent", "leg_not_behind"],
+}
@@ -0,0 +1,206 @@
+"""
+WebSocket wire protocol for /ws/exercise/{exercise_type}
+
+Control messages (set_thresholds, reset, hello, credit) stay JSON text messages.
+After a successful `hello` negotiation the client may send frames as binary
+messages: a fixed little-endian header followed by the payload - raw JPEG
+bytes, or 33 x (x, y, z, visibility) float32 landmarks computed in the browser.
+
+    offset  size  field
+    0       1     protocol version
+    1       1     message type (MSG_*)
+    2       2     flags (reserved, 0)
+    4       4     sequence number (uint32)
+    8       8     client timestamp in ms (float64)
+    16      ...   payload
+
+With compact=True in `hello` the server answers frames with binary
+MSG_ANALYSIS messages instead of JSON (see CompactEncoder):
+
+    16      2     length N of the JSON part (uint16)
+    18      N     UTF-8 JSON: rep_count, credit, fixed-point angles and only
+                  the fields that changed since the previous message
+    18+N    ...   landmarks as int16 (x, y, z, visibility) * LANDMARK_SCALE
+"""
+
+import base64
+import json
+import struct
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+PROTOCOL_VERSION = 1
+
+# Binary message types (client -> server)
+MSG_FRAME_JPEG = 1
+MSG_LANDMARKS = 2
+
+# Binary message types (server -> client)
+MSG_ANALYSIS = 0x81
+
+FLAG_HAS_LANDMARKS = 0x1
+
+NUM_LANDMARKS = 33
+LANDMARK_PAYLOAD_SIZE = NUM_LANDMARKS * 4 * 4  # 33 x (x, y, z, visibility) float32
+
+LANDMARK_SCALE = 10000  # int16 landmark = round(value * scale), covers +-3.27
+ANGLE_SCALE = 10  # Joint angles in tenths of a degree
+POSITION_SCALE = 1000  # Normalised positions/depths (e.g. *_y, *_leg_behind) in thousandths
+
+JSON_LENGTH = struct.Struct("<H")
+
+# Sent only when their value changes
+DELTA_FIELDS = ('pose_detected', 'feedback', 'state', 'errors', 'hold_time_remaining', 'current_side')
+
+HEADER = struct.Struct("<BBHId")
+
+
+class ProtocolError(ValueError):
+    """Raised when a message does not follow the wire protocol"""
+
+
+class FrameHeader(NamedTuple):
+    version: int
+    msg_type: int
+    flags: int
+    seq: int
+    client_ts: float
+
+
+def negotiate(hello: dict, credit_window: int) -> dict:
+    """
+    Build the server reply to a client `hello` message
+
+    With credit=True the client may only have `window` frames in flight; every
+    analysis response (or a standalone `credit` message) carries a `credit`
+    count telling it how many more frames it may send.
+    compact=True (binary clients only) switches analysis responses to
+    MSG_ANALYSIS; `landmarks` picks 'all', 'exercise' (only the landmarks
+    the exercise uses) or 'none'.
+    """
+    binary = bool(hello.get('binary')) and hello.get('version', PROTOCOL_VERSION) == PROTOCOL_VERSION
+    credit = bool(hello.get('credit'))
+    compact = binary and bool(hello.get('compact'))
+    landmarks = hello.get('landmarks', 'all')
+    return {
+        'type': 'hello',
+        'version': PROTOCOL_VERSION,
+        'binary': binary,
+        'credit': credit,
+        'window': credit_window if credit else None,
+        'compact': compact,
+        'landmarks': landmarks if landmarks in ('all', 'exercise', 'none') else 'all',
+    }
+
+
+def pack_header(msg_type: int, seq: int, client_ts: float = 0.0, flags: int = 0) -> bytes:
+    return HEADER.pack(PROTOCOL_VERSION, msg_type, flags, seq & 0xFFFFFFFF, client_ts)
+
+
+def unpack_message(data: bytes):
+    """Split a binary message into (FrameHeader, payload memoryview) without copying the payload"""
+    if len(data) < HEADER.size:
+        raise ProtocolError(f"Binary message too short ({len(data)} bytes)")
+
+    header = FrameHeader(*HEADER.unpack_from(data))
+    if header.version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version {header.version}")
+
+    return header, memoryview(data)[HEADER.size:]
+
+
+def jpeg_from_data_url(data_url: str) -> Optional[bytes]:
+    """Decode the legacy `data:image/jpeg;base64,...` payload into raw JPEG bytes"""
+    _, _, encoded = data_url.partition(',')
+    if not encoded:
+        return None
+    return base64.b64decode(encoded)
+
+
+def _checked_landmarks(landmark_array: np.ndarray) -> np.ndarray:
+    if landmark_array.shape != (NUM_LANDMARKS, 4):
+        raise ProtocolError(f"Expected {NUM_LANDMARKS} landmarks with x, y, z, visibility")
+    if not np.isfinite(landmark_array).all():
+        raise ProtocolError("Landmarks contain non-finite values")
+    return landmark_array
+
+
+def landmarks_from_payload(payload: memoryview) -> np.ndarray:
+    """Parse a binary MSG_LANDMARKS payload into a (33, 4) float32 array"""
+    if len(payload) != LANDMARK_PAYLOAD_SIZE:
+        raise ProtocolError(f"Landmark payload must be {LANDMARK_PAYLOAD_SIZE} bytes")
+    return _checked_landmarks(np.frombuffer(payload, dtype='<f4').reshape(NUM_LANDMARKS, 4))
+
+
+def landmarks_from_json(landmarks: list) -> np.ndarray:
+    """Parse JSON landmarks ([x, y, z, visibility] lists or MediaPipe-style dicts) into a (33, 4) array"""
+    try:
+        rows = [
+            (lm['x'], lm['y'], lm['z'], lm.get('visibility', 1.0)) if isinstance(lm, dict) else lm
+            for lm in landmarks
+        ]
+        landmark_array = np.array(rows, dtype=np.float32)
+    except (KeyError, TypeError, ValueError) as e:
+        raise ProtocolError(f"Malformed landmarks: {e}")
+    return _checked_landmarks(landmark_array)
+
+
+def _angle_scale(name: str) -> int:
+    return POSITION_SCALE if name.endswith(('_y', '_behind')) else ANGLE_SCALE
+
+
+class CompactEncoder:
+    """
+    Per-connection encoder for MSG_ANALYSIS messages
+
+    Angles are sent as a list of fixed-point integers; their names and
+    scales are sent once (and again whenever the set of angles changes).
+    The landmark subset is announced the same way in `landmark_indices`.
+    """
+
+    def __init__(self, landmark_indices: Optional[List[int]] = None):
+        self.landmark_indices = list(range(NUM_LANDMARKS)) if landmark_indices is None else list(landmark_indices)
+        self._last: Dict[str, object] = {}
+        self._angle_names: Optional[List[str]] = None
+        self._indices_sent = False
+
+    def encode(self, response: dict, landmark_array: Optional[np.ndarray] = None,
+               seq: int = 0, client_ts: float = 0.0) -> bytes:
+        body = {}
+        if not self._indices_sent:
+            body['landmark_indices'] = self.landmark_indices
+            self._indices_sent = True
+
+        for field in ('rep_count', 'credit'):
+            if field in response:
+                body[field] = response[field]
+
+        angles = response.get('angles')
+        if angles:
+            names = list(angles)
+            if names != self._angle_names:
+                self._angle_names = names
+                body['angle_names'] = names
+                body['angle_scales'] = [_angle_scale(name) for name in names]
+            body['angles'] = [int(round(angles[name] * _angle_scale(name))) for name in names]
+
+        for field in DELTA_FIELDS:
+            if field in response and self._last.get(field, object()) != response[field]:
+                body[field] = response[field]
+                self._last[field] = response[field]
+
+        flags = 0
+        landmark_bytes = b''
+        if landmark_array is not None and self.landmark_indices:
+            quantized = np.rint(landmark_array[self.landmark_indices] * LANDMARK_SCALE)
+            landmark_bytes = np.clip(quantized, -32768, 32767).astype('<i2').tobytes()
+            flags |= FLAG_HAS_LANDMARKS
+
+        json_bytes = json.dumps(body, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        return b''.join((
+            pack_header(MSG_ANALYSIS, seq, client_ts, flags),
+            JSON_LENGTH.pack(len(json_bytes)),
+            json_bytes,
+            landmark_bytes,
+        ))
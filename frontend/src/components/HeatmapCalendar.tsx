@@ -1,18 +1,49 @@
 import { useMemo, useState } from 'react';
-import type { Session } from '../types';
+import type { CalendarResponse } from '../utils/types';
 
 interface HeatmapCalendarProps {
-  sessions: Session[];
+  calendar: CalendarResponse | null;
 }
 
 type TimeFilter = '7days' | '1month' | '3months' | 'all';
 
-export const HeatmapCalendar = ({ sessions }: HeatmapCalendarProps) => {
+const DAY_MS = 24 * 60 * 60 * 1000;
+
+// Local midnight of a YYYY-MM-DD day
+const parseDay = (day: string) => new Date(`${day}T00:00:00`);
+
+export const HeatmapCalendar = ({ calendar }: HeatmapCalendarProps) => {
   const [timeFilter, setTimeFilter] = useState<TimeFilter>('7days');
 
+  // Sessions per day, indexed from calendar.from
+  const sessionsPerDay = useMemo(() => {
+    if (!calendar) {
+      return [];
+    }
+    const sessionsField = calendar.fields.indexOf('sessions');
+    return calendar.days.map(values => values[sessionsField]);
+  }, [calendar]);
+
+  const hasActivity = sessionsPerDay.some(count => count > 0);
+
+  // Total sessions between two local dates (inclusive)
+  const countSessions = (start: Date, end: Date) => {
+    if (!calendar) {
+      return 0;
+    }
+    const origin = parseDay(calendar.from).getTime();
+    const first = Math.max(0, Math.round((start.getTime() - origin) / DAY_MS));
+    const last = Math.min(sessionsPerDay.length - 1, Math.floor((end.getTime() - origin) / DAY_MS));
+    let total = 0;
+    for (let i = first; i <= last; i++) {
+      total += sessionsPerDay[i];
+    }
+    return total;
+  };
+
   // Daily data for 7-day view
   const dailyData = useMemo(() => {
-    if (sessions.length === 0) {
+    if (!hasActivity) {
       return [];
     }
 
@@ -35,10 +66,7 @@ export const HeatmapCalendar = ({ sessions }: HeatmapCalendarProps) => {
       dateEnd.setHours(23, 59, 59, 999);
 
       // Count sessions on this day
-      const daySessions = sessions.filter(session => {
-        const sessionDate = new Date(session.start_time);
-        return sessionDate >= date && sessionDate <= dateEnd;
-      }).length;
+      const daySessions = countSessions(date, dateEnd);
 
       const goal = 3; // Goal: 3 sessions per day
       const percentage = Math.min((daySessions / goal) * 100, 100);
@@ -56,18 +84,15 @@ export const HeatmapCalendar = ({ sessions }: HeatmapCalendarProps) => {
     }
 
     return days;
-  }, [sessions]);
+  }, [calendar, sessionsPerDay]);
 
   const weeklyData = useMemo(() => {
-    if (sessions.length === 0) {
+    if (!calendar || !hasActivity) {
       return [];
     }
 
-    // Find the earliest session date (user's first workout)
-    const firstSession = sessions.reduce((earliest, session) => {
-      const sessionDate = new Date(session.start_time);
-      return sessionDate < earliest ? sessionDate : earliest;
-    }, new Date(sessions[0].start_time));
+    // Find the earliest active day (user's first workout)
+    const firstSession = new Date(parseDay(calendar.from).getTime() + sessionsPerDay.findIndex(count => count > 0) * DAY_MS);
 
     // Get the Monday of the first session's week
     const firstWeekStart = new Date(firstSession);
@@ -106,10 +131,7 @@ export const HeatmapCalendar = ({ sessions }: HeatmapCalendarProps) => {
       weekEnd.setHours(23, 59, 59, 999);
 
       // Count sessions in this week
-      const weekSessions = sessions.filter(session => {
-        const sessionDate = new Date(session.start_time);
-        return sessionDate >= weekStart && sessionDate <= weekEnd;
-      }).length;
+      const weekSessions = countSessions(weekStart, weekEnd);
 
       const goal = 7; // Goal: 7 sessions per week (1 per day)
       const percentage = Math.min((weekSessions / goal) * 100, 100);
@@ -125,7 +147,7 @@ export const HeatmapCalendar = ({ sessions }: HeatmapCalendarProps) => {
     }
 
     return weeks;
-  }, [sessions]);
+  }, [calendar, sessionsPerDay]);
 
   // Determine if we should show daily or weekly view
   const showDailyView = timeFilter === '7days';
@@ -249,7 +271,7 @@ export const HeatmapCalendar = ({ sessions }: HeatmapCalendarProps) => {
     }
   };
 
-  if (sessions.length === 0) {
+  if (!hasActivity) {
     return (
       <div className="bg-white dark:bg-gray-800 rounded-xl shadow-lg p-6 mb-6 border border-gray-200 dark:border-gray-700">
         <div className="text-center py-12">
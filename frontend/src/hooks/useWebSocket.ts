@@ -1,5 +1,13 @@
 import { useState, useEffect, useCallback, useRef } from 'react';
-import type { AnalysisResult } from '../types';
+import type { AnalysisResult, Landmark } from '../types';
+
+// Binary frame protocol (see backend/ws_protocol.py)
+const PROTOCOL_VERSION = 1;
+const MSG_FRAME_JPEG = 1;
+const HEADER_SIZE = 16;
+const MSG_ANALYSIS = 0x81;
+const FLAG_HAS_LANDMARKS = 0x1;
+const LANDMARK_SCALE = 10000;
 
 interface CustomThresholds {
   down_angle?: number;
@@ -10,11 +18,77 @@ interface CustomThresholds {
 export const useWebSocket = (
   exerciseType: string,
   isActive: boolean,
-  customThresholds?: CustomThresholds
+  customThresholds?: CustomThresholds,
+  sessionId?: number | null
 ) => {
   const [isConnected, setIsConnected] = useState(false);
   const [analysisData, setAnalysisData] = useState<AnalysisResult | null>(null);
   const wsRef = useRef<WebSocket | null>(null);
+  const binaryRef = useRef(false);
+  const seqRef = useRef(0);
+  // Credit-based flow control: only send as many frames as the server has asked for
+  const creditModeRef = useRef(false);
+  const creditsRef = useRef(0);
+  // Compact analysis messages only carry what changed - merge them into the last full result
+  const compactStateRef = useRef<{
+    analysis: AnalysisResult;
+    angleNames: string[];
+    angleScales: number[];
+    landmarkIndices: number[];
+  } | null>(null);
+
+  const decodeCompact = (buffer: ArrayBuffer): AnalysisResult | null => {
+    const view = new DataView(buffer);
+    if (view.getUint8(1) !== MSG_ANALYSIS) return null;
+    const flags = view.getUint16(2, true);
+    const jsonLength = view.getUint16(HEADER_SIZE, true);
+    const jsonStart = HEADER_SIZE + 2;
+    const body = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, jsonStart, jsonLength)));
+
+    const state = compactStateRef.current ?? {
+      analysis: { type: 'analysis', pose_detected: false },
+      angleNames: [],
+      angleScales: [],
+      landmarkIndices: [],
+    };
+    compactStateRef.current = state;
+    if (body.landmark_indices) state.landmarkIndices = body.landmark_indices;
+    if (body.angle_names) {
+      state.angleNames = body.angle_names;
+      state.angleScales = body.angle_scales;
+    }
+
+    const { angles, credit } = body;
+    const fields = { ...body };
+    for (const key of ['angles', 'angle_names', 'angle_scales', 'landmark_indices', 'credit']) delete fields[key];
+    const analysis: AnalysisResult = { ...state.analysis, ...fields };
+    if (typeof credit === 'number') creditsRef.current += credit;
+    if (angles) {
+      analysis.angles = Object.fromEntries(
+        state.angleNames.map((name, i) => [name, angles[i] / state.angleScales[i]])
+      );
+    }
+
+    if (flags & FLAG_HAS_LANDMARKS) {
+      const values = new Int16Array(buffer.slice(jsonStart + jsonLength));
+      // Landmarks outside the sent subset stay invisible so the overlay skips them
+      const landmarks: Landmark[] = Array.from({ length: 33 }, () => ({ x: 0, y: 0, z: 0, visibility: 0 }));
+      state.landmarkIndices.forEach((index, i) => {
+        landmarks[index] = {
+          x: values[i * 4] / LANDMARK_SCALE,
+          y: values[i * 4 + 1] / LANDMARK_SCALE,
+          z: values[i * 4 + 2] / LANDMARK_SCALE,
+          visibility: values[i * 4 + 3] / LANDMARK_SCALE,
+        };
+      });
+      analysis.landmarks = landmarks;
+    } else {
+      analysis.landmarks = undefined;
+    }
+
+    state.analysis = analysis;
+    return analysis;
+  };
 
   // Store customThresholds in ref to avoid reconnection
   const customThresholdsRef = useRef(customThresholds);
@@ -26,12 +100,20 @@ export const useWebSocket = (
   const connect = useCallback(() => {
     if (!isActive || wsRef.current) return;
 
-    const wsUrl = `ws://localhost:8000/ws/exercise/${exerciseType}`;
+    // Bind the connection to the started session so its frames and reps are recorded
+    const token = localStorage.getItem('token');
+    const query = sessionId && token ? `?session_id=${sessionId}&token=${encodeURIComponent(token)}` : '';
+    const wsUrl = `ws://localhost:8000/ws/exercise/${exerciseType}${query}`;
     const ws = new WebSocket(wsUrl);
+    ws.binaryType = 'arraybuffer';
+    compactStateRef.current = null;
 
     ws.onopen = () => {
       console.log('WebSocket connected');
       setIsConnected(true);
+
+      // Ask the server for binary frames; JSON frames are used until it agrees
+      ws.send(JSON.stringify({ type: 'hello', version: PROTOCOL_VERSION, binary: true, credit: true, compact: true, landmarks: 'all' }));
       
       // Send custom thresholds if available
       if (customThresholdsRef.current) {
@@ -45,8 +127,22 @@ export const useWebSocket = (
 
     ws.onmessage = (event) => {
       try {
+        if (event.data instanceof ArrayBuffer) {
+          const analysis = decodeCompact(event.data);
+          if (analysis) setAnalysisData(analysis);
+          return;
+        }
         const data = JSON.parse(event.data);
-        if (data.type === 'analysis') {
+        if (typeof data.credit === 'number') {
+          creditsRef.current += data.credit;
+        }
+        if (data.type === 'hello') {
+          binaryRef.current = !!data.binary;
+          creditModeRef.current = !!data.credit;
+          creditsRef.current = data.window ?? 0;
+        } else if (data.type === 'credit') {
+          creditsRef.current += data.frames;
+        } else if (data.type === 'analysis') {
           setAnalysisData(data);
         }
       } catch (e) {
@@ -62,10 +158,13 @@ export const useWebSocket = (
       console.log('WebSocket disconnected');
       setIsConnected(false);
       wsRef.current = null;
+      binaryRef.current = false;
+      creditModeRef.current = false;
+      creditsRef.current = 0;
     };
 
     wsRef.current = ws;
-  }, [exerciseType, isActive]);
+  }, [exerciseType, isActive, sessionId]);
 
   const disconnect = useCallback(() => {
     if (wsRef.current) {
@@ -75,15 +174,36 @@ export const useWebSocket = (
     }
   }, []);
 
-  const sendFrame = useCallback((frameData: string) => {
-    if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
-      wsRef.current.send(
-        JSON.stringify({
-          type: 'frame',
-          data: frameData,
-        })
-      );
+  const sendFrame = useCallback(async (frame: Blob) => {
+    const ws = wsRef.current;
+    if (!ws || ws.readyState !== WebSocket.OPEN) return;
+    if (creditModeRef.current) {
+      if (creditsRef.current <= 0) return; // Server is still busy - skip this frame
+      creditsRef.current -= 1;
+    }
+
+    if (binaryRef.current) {
+      const jpeg = await frame.arrayBuffer();
+      const message = new Uint8Array(HEADER_SIZE + jpeg.byteLength);
+      const header = new DataView(message.buffer);
+      header.setUint8(0, PROTOCOL_VERSION);
+      header.setUint8(1, MSG_FRAME_JPEG);
+      header.setUint16(2, 0, true);
+      header.setUint32(4, seqRef.current++ >>> 0, true);
+      header.setFloat64(8, performance.now(), true);
+      message.set(new Uint8Array(jpeg), HEADER_SIZE);
+      if (ws.readyState === WebSocket.OPEN) ws.send(message);
+      return;
     }
+
+    // Legacy JSON frame with a base64 data URL
+    const reader = new FileReader();
+    reader.onload = () => {
+      if (ws.readyState === WebSocket.OPEN) {
+        ws.send(JSON.stringify({ type: 'frame', data: reader.result }));
+      }
+    };
+    reader.readAsDataURL(frame);
   }, []);
 
   const resetCounter = useCallback(() => {
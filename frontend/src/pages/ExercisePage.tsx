@@ -50,7 +50,8 @@ export const ExercisePage = () => {
   const { isConnected, analysisData, sendFrame, resetCounter } = useWebSocket(
     selectedExercise || 'squat',
     isExercising,
-    customThresholds
+    customThresholds,
+    sessionId
   );
 
   useEffect(() => {
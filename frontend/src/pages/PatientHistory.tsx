@@ -6,10 +6,12 @@ import { SmartRecommendations } from '../components/SmartRecommendations';
 import { HeatmapCalendar } from '../components/HeatmapCalendar';
 import { Navbar } from '../components/Navbar';
 import type { Session } from '../types';
+import type { CalendarResponse } from '../utils/types';
 
 export const PatientHistory = () => {
   const navigate = useNavigate();
   const [sessions, setSessions] = useState<Session[]>([]);
+  const [calendar, setCalendar] = useState<CalendarResponse | null>(null);
   const [isLoading, setIsLoading] = useState(true);
   
   // Filter & Sort states
@@ -23,8 +25,12 @@ export const PatientHistory = () => {
 
   const loadHistory = async () => {
     try {
-      const data = await sessionAPI.getMyHistory(50);
+      const [data, calendarData] = await Promise.all([
+        sessionAPI.getMyHistory(50),
+        sessionAPI.getCalendar(),
+      ]);
       setSessions(data.sessions);
+      setCalendar(calendarData);
     } catch (error) {
       console.error('Failed to load history:', error);
     } finally {
@@ -32,51 +38,8 @@ export const PatientHistory = () => {
     }
   };
 
-  // Calculate current streak
-  const calculateStreak = () => {
-    if (sessions.length === 0) return 0;
-    
-    const sortedSessions = [...sessions].sort((a, b) => 
-      new Date(b.start_time).getTime() - new Date(a.start_time).getTime()
-    );
-    
-    const today = new Date();
-    today.setHours(0, 0, 0, 0);
-    
-    let streak = 0;
-    let currentDate = new Date(today);
-    
-    const sessionDates = new Set(
-      sortedSessions.map(s => {
-        const d = new Date(s.start_time);
-        d.setHours(0, 0, 0, 0);
-        return d.getTime();
-      })
-    );
-    
-    // Check if there's a session today or yesterday
-    const lastSessionDate = new Date(sortedSessions[0].start_time);
-    lastSessionDate.setHours(0, 0, 0, 0);
-    const daysSinceLastSession = Math.floor((today.getTime() - lastSessionDate.getTime()) / (1000 * 60 * 60 * 24));
-    
-    if (daysSinceLastSession > 1) {
-      return 0; // Streak broken
-    }
-    
-    // Count consecutive days
-    while (true) {
-      if (sessionDates.has(currentDate.getTime())) {
-        streak++;
-        currentDate.setDate(currentDate.getDate() - 1);
-      } else {
-        break;
-      }
-    }
-    
-    return streak;
-  };
-
-  const currentStreak = calculateStreak();
+  // Streaks are precomputed by the server from the daily activity rollup
+  const currentStreak = calendar?.current_streak ?? 0;
 
   // Get unique exercise types
   const exerciseTypes = Array.from(new Set(sessions.map(s => s.exercise_name)));
@@ -161,7 +124,7 @@ export const PatientHistory = () => {
             <SmartRecommendations sessions={sessions} />
 
             {/* Heatmap Calendar */}
-            <HeatmapCalendar sessions={sessions} />
+            <HeatmapCalendar calendar={calendar} />
 
             {/* Weekly Goal Progress */}
             <div className="bg-gradient-to-r from-blue-500 to-indigo-600 dark:from-blue-600 dark:to-indigo-700 p-6 rounded-xl shadow-lg mb-6">
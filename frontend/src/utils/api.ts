@@ -1,5 +1,5 @@
 import axios from 'axios';
-import type { LoginResponse, Exercise, Session, Patient, ErrorAnalyticsResponse } from './types';
+import type { LoginResponse, Exercise, Session, Patient, ErrorAnalyticsResponse, CalendarResponse, CohortResponse } from './types';
 
 const API_URL = 'http://localhost:8000/api';
 
@@ -68,9 +68,12 @@ export const sessionAPI = {
     return response.data;
   },
 
-  async getMyHistory(limit: number = 20): Promise<{ sessions: Session[] }> {
+  async getMyHistory(
+    limit: number = 20,
+    before?: string
+  ): Promise<{ sessions: Session[]; next_before: string | null }> {
     const response = await api.get('/sessions/my-history', {
-      params: { limit },
+      params: { limit, before },
     });
     return response.data;
   },
@@ -79,6 +82,13 @@ export const sessionAPI = {
     const response = await api.get('/sessions/error-analytics');
     return response.data;
   },
+
+  async getCalendar(from?: string, to?: string): Promise<CalendarResponse> {
+    const response = await api.get('/sessions/calendar', {
+      params: { from, to },
+    });
+    return response.data;
+  },
 };
 
 // ============= DOCTOR APIs =============
@@ -91,10 +101,11 @@ export const doctorAPI = {
 
   async getPatientHistory(
     patientId: number,
-    limit: number = 20
-  ): Promise<{ sessions: Session[] }> {
+    limit: number = 20,
+    before?: string
+  ): Promise<{ sessions: Session[]; next_before: string | null }> {
     const response = await api.get(`/doctor/patient/${patientId}/history`, {
-      params: { limit },
+      params: { limit, before },
     });
     return response.data;
   },
@@ -103,6 +114,13 @@ export const doctorAPI = {
     const response = await api.get(`/doctor/patient/${patientId}/error-analytics`);
     return response.data;
   },
+
+  async getCohort(weeks: number = 12): Promise<CohortResponse> {
+    const response = await api.get('/doctor/cohort', {
+      params: { weeks },
+    });
+    return response.data;
+  },
 };
 
 // Export default api instance for custom calls
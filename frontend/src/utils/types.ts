@@ -112,6 +112,7 @@ export interface ErrorAnalytics {
   total_count: number;
   session_count: number;
   avg_per_session: number;
+  last_seen?: string | null;
 }
 
 export interface ExerciseErrorAnalytics {
@@ -122,3 +123,58 @@ export interface ExerciseErrorAnalytics {
 export interface ErrorAnalyticsResponse {
   analytics: ExerciseErrorAnalytics[];
 }
+
+// ============= Activity Calendar Types =============
+
+export interface CalendarResponse {
+  from: string; // YYYY-MM-DD, day index 0
+  to: string;
+  fields: string[]; // ['sessions', 'total_reps', 'correct_reps', 'duration_seconds']
+  days: number[][]; // days[i] = values of fields for day from + i
+  exercises: Record<string, number[][]>; // [dayIndex, ...fields] for active days only
+  current_streak: number;
+  longest_streak: number;
+  last_active_day: string | null;
+}
+
+export interface CohortError {
+  error_name: string;
+  total_count: number;
+  patients?: number; // cohort-wide entries only
+}
+
+export interface CohortPatient {
+  id: number;
+  full_name: string;
+  total_sessions: number;
+  total_reps: number;
+  correct_reps: number;
+  duration_seconds: number;
+  accuracy: number | null;
+  last_active_day: string | null;
+  sessions_7d: number;
+  sessions_30d: number;
+  active_days_30d: number;
+  reps_30d: number;
+  accuracy_trend: (number | null)[]; // aligned with CohortResponse.week_starts
+  top_errors: CohortError[];
+}
+
+export interface CohortResponse {
+  today: string;
+  week_starts: string[]; // Mondays (YYYY-MM-DD), oldest first; the last is the current week
+  cohort: {
+    patients: number;
+    active_patients_7d: number;
+    active_patients_30d: number;
+    sessions_7d: number;
+    sessions_30d: number;
+    total_sessions: number;
+    total_reps: number;
+    reps_30d: number;
+    accuracy: number | null;
+    accuracy_trend: (number | null)[];
+    top_errors: CohortError[];
+  };
+  patients: CohortPatient[];
+}